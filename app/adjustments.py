@@ -0,0 +1,230 @@
+import logging
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import BigInteger, Integer, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .metrics import metrics
+from .stock_hub import stock_hub
+from .write_behind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+# inventory_count is an int4
+MAX_COUNT = 2**31 - 1
+
+# one statement for any number of products: the rows are locked in id order so two
+# batches touching the same products cannot deadlock, and an adjustment which would
+# take the count below zero or past MAX_COUNT leaves its row untouched and is
+# reported back. The deltas are bigint so the check itself cannot overflow.
+# Only inventory_count and updated_at change, the trigger notifies op STOCK
+ADJUST_STOCK = text(
+    f"""
+    WITH locked AS (
+        SELECT id FROM products WHERE id = ANY(:ids) ORDER BY id FOR UPDATE
+    )
+    UPDATE products AS p
+    SET inventory_count = coalesce(p.inventory_count, 0) + d.delta,
+        updated_at = now()
+    FROM unnest(:ids, :deltas) AS d(product_id, delta)
+    WHERE p.id = d.product_id
+        AND p.id IN (SELECT id FROM locked)
+        AND coalesce(p.inventory_count, 0) + d.delta BETWEEN 0 AND {MAX_COUNT}
+    RETURNING p.id, p.inventory_count
+    """
+).bindparams(
+    bindparam("ids", type_=ARRAY(Integer)),
+    bindparam("deltas", type_=ARRAY(BigInteger)),
+)
+
+
+# coalesced requests are checked one after the other against the locked counts, so
+# a request which would go below zero or out of range only loses its own adjustments
+LOCK_STOCK = text(
+    """
+    SELECT id, coalesce(inventory_count, 0) FROM products
+    WHERE id = ANY(:ids) ORDER BY id FOR UPDATE
+    """
+).bindparams(bindparam("ids", type_=ARRAY(Integer)))
+
+
+def net_deltas(adjustments: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+    """
+    sum the deltas per product, products whose deltas cancel out are dropped
+    :param adjustments: (product_id, delta) pairs
+    :return: net delta by product id
+    """
+    totals: Counter = Counter()
+    for product_id, delta in adjustments:
+        totals[product_id] += delta
+    return {product_id: delta for product_id, delta in totals.items() if delta}
+
+
+def apply_adjustments(db: Session, deltas: Dict[int, int]) -> Dict[int, int]:
+    """
+    add the deltas to inventory_count in one statement, the caller commits
+    :param db: SqlAlchemy db object
+    :param deltas: net delta by product id
+    :return: new inventory_count of every product which was adjusted; missing
+    products and those which would go below zero or past MAX_COUNT are left out
+    """
+    if not deltas:
+        return {}
+    ids = sorted(deltas)
+    rows = db.execute(ADJUST_STOCK, {"ids": ids, "deltas": [deltas[i] for i in ids]})
+    return {product_id: count for product_id, count in rows}
+
+
+def publish_counts(counts: Dict[int, int]) -> None:
+    """push the new counts to the stock streams of this worker"""
+    for product_id, count in counts.items():
+        stock_hub.publish(product_id, count)
+
+
+class QueuedAdjustments(NamedTuple):
+    id: str
+    deltas: Dict[int, int]
+
+
+class AdjustmentResults:
+    """
+    outcome of the last `max_entries` coalesced requests by id, for
+    GET /inventory/adjustments/{id}. Kept per worker; written by the queue thread
+    """
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def add(self, result: Dict[str, Any]) -> str:
+        """
+        :param result: initial status
+        :return: new id of the request
+        """
+        adjustment_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[adjustment_id] = {"id": adjustment_id, **result}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return adjustment_id
+
+    def update(self, adjustment_id: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            if adjustment_id in self._entries:
+                self._entries[adjustment_id] = {"id": adjustment_id, **result}
+
+    def discard(self, adjustment_id: str) -> None:
+        with self._lock:
+            self._entries.pop(adjustment_id, None)
+
+    def get(self, adjustment_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(adjustment_id)
+
+
+adjustment_results = AdjustmentResults(settings.inventory_adjustment_results)
+
+
+def queue_adjustments(deltas: Dict[int, int]) -> Optional[str]:
+    """
+    :param deltas: net deltas of one request
+    :return: id to look the outcome up with, None if the queue is full
+    """
+    adjustment_id = adjustment_results.add(
+        {"status": "queued" if deltas else "applied", "adjusted": [], "rejected": []}
+    )
+    if deltas and not adjustment_queue.put(QueuedAdjustments(adjustment_id, deltas)):
+        adjustment_results.discard(adjustment_id)
+        return None
+    return adjustment_id
+
+
+def sequence_adjustments(
+    counts: Dict[int, int], batch: List[QueuedAdjustments]
+) -> Tuple[Dict[int, int], Dict[str, Dict[str, Any]]]:
+    """
+    apply the requests in the order they were queued
+    :param counts: current inventory_count of the locked products, updated in place
+    :param batch: coalesced requests
+    :return: net delta of the accepted adjustments by product, and the outcome of
+    every request: the counts after it and its missing or out of range products
+    """
+    accepted: Counter = Counter()
+    results = {}
+    for entry in batch:
+        adjusted, rejected = [], []
+        for product_id, delta in sorted(entry.deltas.items()):
+            count = counts.get(product_id)
+            if count is None or not 0 <= count + delta <= MAX_COUNT:
+                rejected.append(product_id)
+                continue
+            counts[product_id] = count + delta
+            accepted[product_id] += delta
+            adjusted.append(
+                {"product_id": product_id, "inventory_count": counts[product_id]}
+            )
+        results[entry.id] = {
+            "status": "applied",
+            "adjusted": adjusted,
+            "rejected": rejected,
+        }
+    return {
+        product_id: delta for product_id, delta in accepted.items() if delta
+    }, results
+
+
+def write_adjustments(batch: List[QueuedAdjustments]) -> None:
+    """
+    apply the adjustments queued within one window in one transaction, with a
+    single write per product
+    :param batch: coalesced requests, with the net deltas of each
+    """
+    ids = sorted({product_id for entry in batch for product_id in entry.deltas})
+    db = SessionLocal()
+    try:
+        counts = dict(db.execute(LOCK_STOCK, {"ids": ids}).all())
+        deltas, results = sequence_adjustments(counts, batch)
+        counts = apply_adjustments(db, deltas)
+        db.commit()
+    except Exception:
+        for entry in batch:
+            adjustment_results.update(
+                entry.id, {"status": "failed", "adjusted": [], "rejected": []}
+            )
+        raise
+    finally:
+        db.close()
+    metrics.inc("inventory_adjustments_applied", len(counts))
+    rejected = [
+        (adjustment_id, result["rejected"])
+        for adjustment_id, result in results.items()
+        if result["rejected"]
+    ]
+    if rejected:
+        metrics.inc(
+            "inventory_adjustments_rejected", sum(len(ids) for _, ids in rejected)
+        )
+        logger.warning(
+            "inventory adjustments not applied, missing or out of range: %s",
+            rejected,
+        )
+    for adjustment_id, result in results.items():
+        adjustment_results.update(adjustment_id, result)
+    publish_counts(counts)
+
+
+# coalesces adjustments sent with coalesce=true, one transaction per window
+adjustment_queue = WriteBehindQueue(
+    handlers=[write_adjustments],
+    maxsize=settings.inventory_adjustment_queue_maxsize,
+    batch_size=settings.inventory_adjustment_queue_batch_size,
+    flush_interval=settings.inventory_adjustment_window,
+    name="inventory-adjustments",
+)
@@ -0,0 +1,261 @@
+import heapq
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# (kind, display text, product id for kind "product" else None)
+Key = Tuple[str, str, Optional[int]]
+
+FACETS = ("manufacturer", "category", "sub_category")
+
+
+class _Node:
+    __slots__ = ("children", "entries", "top")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        # suggestions whose indexed term ends at this node
+        self.entries: Dict[Key, int] = {}
+        # cached top-K of the subtree as (weight, key), None when stale
+        self.top: Optional[List[Tuple[int, Key]]] = None
+
+
+class PrefixIndex:
+    """
+    Trie over product names, manufacturers, categories and sub-categories. Every node
+    caches the top-K suggestions of its subtree by weight; a write only marks the nodes
+    on its own path stale, which are recomputed lazily from the children's caches.
+    A product weighs 1 + units ordered, a facet value the sum of its products.
+    Terms are only indexed to `max_depth` characters and product names only for the
+    `max_products` most ordered products to bound the number of nodes; longer
+    prefixes are filtered among the entries of the deepest node. Facet weights
+    cover the whole catalog at load; writes and orders of products outside the
+    index only count again at the next load. While `listening`, orders are counted
+    from the notifications of every worker (cache.on_order_placed).
+    """
+
+    def __init__(
+        self, top_k: int = 10, max_depth: int = 20, max_products: Optional[int] = None
+    ) -> None:
+        self.top_k = top_k
+        self.max_depth = max_depth
+        self.max_products = max_products
+        self.listening = False
+        self._root = _Node()
+        self._lock = threading.Lock()
+        # product id -> (name, manufacturer, category, sub_category)
+        self._products: Dict[int, Tuple[str, str, str, str]] = {}
+        self._popularity: Counter = Counter()
+        self._facet_weights: Counter = Counter()
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        # the full text and every word suffix, so "e14" finds "lenovo e14"
+        words = text.lower().split()
+        return [" ".join(words[i:]) for i in range(len(words))]
+
+    def _set(self, key: Key, weight: int) -> None:
+        for term in self._terms(key[1]):
+            node = self._root
+            node.top = None
+            for char in term[: self.max_depth]:
+                node = node.children.setdefault(char, _Node())
+                node.top = None
+            if weight > 0:
+                node.entries[key] = weight
+            else:
+                node.entries.pop(key, None)
+
+    def _top(self, node: _Node) -> List[Tuple[int, Key]]:
+        if node.top is None:
+            best: Dict[Key, int] = dict(node.entries)
+            for child in node.children.values():
+                for weight, key in self._top(child):
+                    if weight > best.get(key, 0):
+                        best[key] = weight
+            node.top = heapq.nsmallest(
+                self.top_k,
+                ((w, k) for k, w in best.items()),
+                key=lambda e: (-e[0], e[1]),
+            )
+        return node.top
+
+    def _add_product(self, product_id: int, sign: int) -> None:
+        name, *facets = self._products[product_id]
+        weight = 1 + self._popularity[product_id]
+        self._set(("product", name, product_id), weight if sign > 0 else 0)
+        for kind, value in zip(FACETS, facets):
+            key = (kind, value, None)
+            self._facet_weights[key] += sign * weight
+            self._set(key, self._facet_weights[key])
+            if self._facet_weights[key] <= 0:
+                del self._facet_weights[key]
+
+    def load(self, rows: Iterable[Tuple[Any, ...]]) -> None:
+        """
+        replace the whole index
+        :param rows: (id, name, manufacturer, category, sub_category, units ordered)
+        """
+        index = PrefixIndex(self.top_k, self.max_depth, self.max_products)
+        # min-heap of the most ordered products as (weight, -id, product)
+        kept: List[Tuple[int, int, Tuple[str, str, str, str]]] = []
+        for product_id, name, manufacturer, category, sub_category, units in rows:
+            product = (name, manufacturer, category, sub_category)
+            weight = 1 + (units or 0)
+            for kind, value in zip(FACETS, product[1:]):
+                index._facet_weights[(kind, value, None)] += weight
+            if self.max_products is None or len(kept) < self.max_products:
+                heapq.heappush(kept, (weight, -product_id, product))
+            else:
+                heapq.heappushpop(kept, (weight, -product_id, product))
+        for weight, product_id, product in kept:
+            index._products[-product_id] = product
+            index._popularity[-product_id] = weight - 1
+            index._set(("product", product[0], -product_id), weight)
+        for key, weight in index._facet_weights.items():
+            index._set(key, weight)
+        index._top(index._root)
+        with self._lock:
+            self._root = index._root
+            self._products = index._products
+            self._popularity = index._popularity
+            self._facet_weights = index._facet_weights
+
+    def upsert_product(
+        self,
+        product_id: int,
+        name: str,
+        manufacturer: str,
+        category: str,
+        sub_category: str,
+    ) -> None:
+        """add a new product or re-index a changed one, unless the index is full"""
+        with self._lock:
+            if product_id in self._products:
+                self._add_product(product_id, -1)
+            elif (
+                self.max_products is not None
+                and len(self._products) >= self.max_products
+            ):
+                return
+            self._products[product_id] = (name, manufacturer, category, sub_category)
+            self._add_product(product_id, 1)
+
+    def remove_product(self, product_id: int) -> None:
+        with self._lock:
+            if product_id in self._products:
+                self._add_product(product_id, -1)
+                del self._products[product_id]
+                self._popularity.pop(product_id, None)
+
+    def add_popularity(self, product_id: int, units: int) -> None:
+        """raise the weight of an ordered product and of its facets"""
+        with self._lock:
+            if product_id not in self._products:
+                return
+            self._add_product(product_id, -1)
+            self._popularity[product_id] += units
+            self._add_product(product_id, 1)
+
+    def search(self, prefix: str, limit: int = 10) -> List[Key]:
+        """
+        :param prefix: what the user typed so far
+        :param limit: max suggestions, at most top_k
+        :return: suggestions ordered by weight
+        """
+        prefix = " ".join(prefix.lower().split())
+        with self._lock:
+            node = self._root
+            for char in prefix[: self.max_depth]:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            if len(prefix) <= self.max_depth:
+                return [key for _, key in self._top(node)[:limit]]
+            matches = [
+                (weight, key)
+                for key, weight in node.entries.items()
+                if any(term.startswith(prefix) for term in self._terms(key[1]))
+            ]
+        return [
+            key
+            for _, key in heapq.nsmallest(limit, matches, key=lambda e: (-e[0], e[1]))
+        ]
+
+
+autocomplete_index = PrefixIndex(
+    top_k=settings.autocomplete_top_k,
+    max_depth=settings.autocomplete_max_depth,
+    max_products=settings.autocomplete_max_products,
+)
+
+
+def load_autocomplete_index(db: Session) -> None:
+    """
+    (re)build the index from the products table and the order counters
+    :param db: SqlAlchemy db object
+    """
+    rows = (
+        db.query(
+            models.Product.id,
+            models.Product.name,
+            models.Product.manufacturer,
+            models.Product.category,
+            models.Product.sub_category,
+            models.ProductStats.units_ordered,
+        )
+        .outerjoin(
+            models.ProductStats, models.ProductStats.product_id == models.Product.id
+        )
+        .yield_per(10000)
+    )
+    autocomplete_index.load(rows)
+    logger.info("autocomplete index loaded")
+
+
+def index_product(product: Any) -> None:
+    """re-index a product after an inventory write"""
+    autocomplete_index.upsert_product(
+        product.id,
+        product.name,
+        product.manufacturer,
+        product.category,
+        product.sub_category,
+    )
+
+
+def update_autocomplete_popularity(batch: List[Any]) -> None:
+    """
+    write-behind handler: weigh suggestions by units ordered, unless the order
+    notifications do
+    :param batch: list of orders.OrderPlaced events
+    """
+    if autocomplete_index.listening:
+        return
+    for event in batch:
+        for product_id, quantity in event.items:
+            autocomplete_index.add_popularity(product_id, quantity)
+
+
+def start_loading() -> None:
+    """load the index in the background so start-up does not wait for postgres"""
+
+    def load() -> None:
+        db = SessionLocal()
+        try:
+            load_autocomplete_index(db)
+        except Exception:
+            logger.exception("loading the autocomplete index failed")
+        finally:
+            db.close()
+
+    threading.Thread(target=load, name="autocomplete-load", daemon=True).start()
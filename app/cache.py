@@ -0,0 +1,148 @@
+import logging
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs
+
+from starlette.types import Scope
+
+from . import models
+from .autocomplete import autocomplete_index, index_product, load_autocomplete_index
+from .compression import ResponseCache
+from .config import settings
+from .counts import category_counts
+from .database import SQLALCHEMY_DATABASE_URL, SessionLocal
+from .invalidation import InvalidationListener
+from .recommendations import related_index, related_refresher
+from .stock_hub import on_stock_change
+
+logger = logging.getLogger(__name__)
+
+# complete responses (and their compressed variants) of public catalog routes
+catalog_cache = ResponseCache(
+    max_entries=settings.catalog_cache_max_entries, ttl=settings.catalog_cache_ttl
+)
+
+# keeps the caches of this worker in sync with writes made by other workers
+invalidation_listener = InvalidationListener(
+    SQLALCHEMY_DATABASE_URL,
+    max_reconnect_delay=settings.cache_invalidation_max_reconnect_delay,
+)
+
+
+def is_catalog_request(scope: Scope) -> bool:
+    """
+    category listings, facet lists and the first page of /products are cacheable
+    :param scope: ASGI scope of the request
+    :return: True if the response can be served from catalog_cache
+    """
+    path = scope["path"]
+    if path.startswith(("/products/category/", "/products/sub_category")):
+        return True
+    if path == "/products/":
+        params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        return params.get("skip", ["0"]) == ["0"] and not params.get("search")
+    return False
+
+
+def invalidate_catalog() -> None:
+    """drop cached catalog responses after a product was written"""
+    catalog_cache.clear()
+
+
+def adjust_category_counts(op: str, change: Dict[str, Any]) -> None:
+    """
+    count a product change in category_counts; every worker, the writing one
+    included, applies it from the notification
+    :param op: INSERT, UPDATE or DELETE
+    :param change: notification with the category and, for updates, old_category
+    """
+    if "category" not in change:
+        # sent by a trigger older than db/init.sql
+        category_counts.invalidate()
+        return
+    category = change["category"]
+    if op == "INSERT":
+        category_counts.adjust(category, 1)
+    elif op == "DELETE":
+        category_counts.adjust(category, -1)
+    elif change.get("old_category") != category:
+        category_counts.adjust(change.get("old_category"), -1)
+        category_counts.adjust(category, 1)
+
+
+def on_product_change(op: str, product_id: int, change: Dict[str, Any]) -> None:
+    """
+    a product was written by any worker
+    :param op: INSERT, UPDATE, STOCK or DELETE
+    :param product_id: product id
+    :param change: notification payload
+    """
+    if op == "STOCK":
+        # only inventory_count changed, which no cached catalog response contains
+        return
+    invalidate_catalog()
+    adjust_category_counts(op, change)
+    if op == "DELETE":
+        autocomplete_index.remove_product(product_id)
+        return
+    db = SessionLocal()
+    try:
+        product = (
+            db.query(models.Product).filter(models.Product.id == product_id).first()
+        )
+    finally:
+        db.close()
+    if product is not None:
+        index_product(product)
+
+
+def order_items(order_id: int) -> List[Tuple[int, int]]:
+    """
+    :param order_id: order id
+    :return: (product id, quantity) of the order's items
+    """
+    db = SessionLocal()
+    try:
+        return (
+            db.query(models.OrderItem.product_id, models.OrderItem.quantity)
+            .filter(
+                models.OrderItem.order_id == order_id,
+                models.OrderItem.product_id.isnot(None),
+            )
+            .all()
+        )
+    finally:
+        db.close()
+
+
+def on_order_placed(op: str, order_id: int, change: Dict[str, Any]) -> None:
+    """
+    an order was checked out by any worker
+    :param op: INSERT
+    :param order_id: order id
+    :param change: notification payload with the [product id, quantity] items
+    """
+    if op != "INSERT":
+        return
+    # too big for a notification, read back
+    items = change["items"] if "items" in change else order_items(order_id)
+    related_index.add_basket(order_id, (product_id for product_id, _ in items))
+    for product_id, quantity in items:
+        autocomplete_index.add_popularity(product_id, quantity)
+
+
+def flush_caches() -> None:
+    """notifications may have been missed, rebuild everything derived from them"""
+    invalidate_catalog()
+    category_counts.invalidate()
+    related_refresher.rebuild_soon()
+    db = SessionLocal()
+    try:
+        load_autocomplete_index(db)
+    finally:
+        db.close()
+
+
+invalidation_listener.on_change("products", on_product_change)
+invalidation_listener.on_change("products", on_stock_change)
+invalidation_listener.on_change("orders", on_order_placed)
+invalidation_listener.on_flush(flush_caches)
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, List
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CancelToken:
+    """
+    Per request registry of cancel callbacks, e.g. the cancel() of the db connection
+    currently running a query for the request. Callbacks may be registered from
+    worker threads while cancel() runs on the event loop.
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._callbacks: Dict[Hashable, Callable[[], Any]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, key: Hashable, callback: Callable[[], Any]) -> None:
+        with self._lock:
+            self._callbacks[key] = callback
+
+    def unregister(self, key: Hashable) -> None:
+        with self._lock:
+            self._callbacks.pop(key, None)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            callbacks = list(self._callbacks.values())
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("cancel callback failed")
+
+
+class DisconnectCancelMiddleware:
+    """
+    Reads the request body up front and then watches the connection while the
+    endpoint runs. When the client disconnects, the request's CancelToken (in
+    scope["state"]["cancel_token"]) fires so in-flight queries are cancelled and their
+    pooled connections released instead of running for a client that is gone.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = CancelToken()
+        scope.setdefault("state", {})["cancel_token"] = token
+
+        body: List[Message] = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message)
+            if not message.get("more_body", False):
+                break
+
+        disconnected = asyncio.Event()
+
+        async def watch() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            if not finished:
+                metrics.inc("requests_cancelled_on_disconnect")
+                token.cancel()
+
+        async def replay() -> Message:
+            if body:
+                return body.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        finished = False
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            finished = True
+            watcher.cancel()
@@ -0,0 +1,257 @@
+import gzip
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import Metrics
+from .metrics import metrics as default_metrics
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+# headers only meant for the caller of the request which filled the cache, e.g. the
+# id of an admin's profile (profiling.ProfilingMiddleware), never replayed to others
+PER_REQUEST_HEADERS = (b"x-profile-id", b"set-cookie")
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    pick the best supported content-coding from an Accept-Encoding header
+    :param accept_encoding: header value, e.g. "gzip, deflate, br;q=0.9"
+    :return: "br", "gzip" or "identity"
+    """
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip()] = q
+    wildcard = weights.get("*", 0.0)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_q = "identity", 0.0
+    for coding in candidates:
+        q = weights.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+class CachedResponse:
+    """a cached response body with its compressed variants by encoding"""
+
+    def __init__(
+        self,
+        status: int,
+        headers: List[Tuple[bytes, bytes]],
+        body: bytes,
+        expires: float,
+    ) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.variants: Dict[str, bytes] = {}
+
+
+class ResponseCache:
+    """bounded LRU cache of complete responses with a TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 30.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(
+        self, key: str, status: int, headers: List[Tuple[bytes, bytes]], body: bytes
+    ) -> CachedResponse:
+        entry = CachedResponse(status, headers, body, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware which compresses complete responses with br/gzip depending on
+    Accept-Encoding. GET responses for which `cacheable(scope)` is true are kept in
+    `cache` together with their compressed variants, so repeated hits neither run the
+    endpoint nor compress again. Streaming responses are passed through untouched.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        cache: Optional[ResponseCache] = None,
+        cacheable: Optional[Callable[[Scope], bool]] = None,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache = cache
+        self.cacheable = cacheable
+        self.metrics = metrics or default_metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        key = None
+        if (
+            self.cache is not None
+            and scope["method"] == "GET"
+            and self.cacheable is not None
+            and self.cacheable(scope)
+        ):
+            key = scope["path"] + "?" + scope.get("query_string", b"").decode("latin-1")
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.metrics.inc("response_cache_hits")
+                await self._send_cached(entry, encoding, send)
+                return
+            self.metrics.inc("response_cache_misses")
+
+        start: Optional[Message] = None
+        streaming = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, streaming
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or streaming:
+                await send(message)
+                return
+            if message.get("more_body", False):
+                # streaming response (e.g. server sent events), do not buffer
+                streaming = True
+                await send(start)
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if key is not None and start["status"] == 200:
+                entry = self.cache.put(key, 200, self._base_headers(start), body)
+                own = [
+                    (name, value)
+                    for name, value in start.get("headers", [])
+                    if name.lower() in PER_REQUEST_HEADERS
+                ]
+                await self._send_cached(entry, encoding, send, own)
+                return
+            await self._send_compressed(start, body, encoding, send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _base_headers(start: Message) -> List[Tuple[bytes, bytes]]:
+        return [
+            (name, value)
+            for name, value in start.get("headers", [])
+            if name.lower() not in (b"content-length", b"content-encoding", b"vary")
+            and name.lower() not in PER_REQUEST_HEADERS
+        ]
+
+    def _should_compress(self, headers: Headers, body: bytes, encoding: str) -> bool:
+        return (
+            encoding != "identity"
+            and len(body) >= self.minimum_size
+            and "content-encoding" not in headers
+            and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+        )
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        started = time.thread_time()
+        compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+        self.metrics.observe("compression_cpu_seconds", time.thread_time() - started)
+        self.metrics.observe("compression_ratio", len(compressed) / len(body))
+        self.metrics.inc(f"compression_bytes_in.{encoding}", len(body))
+        self.metrics.inc(f"compression_bytes_out.{encoding}", len(compressed))
+        return compressed
+
+    async def _send_compressed(
+        self, start: Message, body: bytes, encoding: str, send: Send
+    ) -> None:
+        headers = MutableHeaders(raw=list(start.get("headers", [])))
+        if self._should_compress(headers, body, encoding):
+            body = self._compress(body, encoding)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+        await send({**start, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _send_cached(
+        self,
+        entry: CachedResponse,
+        encoding: str,
+        send: Send,
+        extra_headers: Optional[List[Tuple[bytes, bytes]]] = None,
+    ) -> None:
+        headers = MutableHeaders(raw=list(entry.headers) + (extra_headers or []))
+        headers.add_vary_header("Accept-Encoding")
+        body = entry.body
+        if self._should_compress(headers, body, encoding):
+            variant = entry.variants.get(encoding)
+            if variant is None:
+                variant = entry.variants[encoding] = self._compress(body, encoding)
+            else:
+                self.metrics.inc("compression_precompressed_hits")
+            body = variant
+            headers["content-encoding"] = encoding
+        headers["content-length"] = str(len(body))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": entry.status,
+                "headers": headers.raw,
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseSettings
 
 
@@ -11,6 +13,96 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int
+    # checkout write-behind queue
+    order_queue_maxsize: int = 10000
+    order_queue_batch_size: int = 200
+    order_queue_flush_interval: float = 0.5
+    order_queue_max_retries: int = 3
+    # max ids per /products/batch call
+    product_batch_max_ids: int = 100
+    # response compression and cached catalog responses
+    compression_minimum_size: int = 500
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+    catalog_cache_ttl: float = 30.0
+    catalog_cache_max_entries: int = 1024
+    # LISTEN/NOTIFY listener keeping in-process caches in sync across workers
+    cache_invalidation_enabled: bool = True
+    cache_invalidation_max_reconnect_delay: float = 30.0
+    # "frequently bought together", rebuild interval in seconds (0 = only at start-up)
+    # and its random spread (0.25 = +-25%) so workers do not rebuild all at once
+    related_top_k: int = 20
+    related_rebuild_interval: float = 3600.0
+    related_rebuild_jitter: float = 0.25
+    # max suggestions kept per prefix for search-as-you-type, and how many of the
+    # most ordered products have their names indexed (facets cover all products)
+    autocomplete_top_k: int = 10
+    autocomplete_max_depth: int = 20
+    autocomplete_max_products: int = 100000
+    # per route class statement timeouts (ms), cold listings must not hold
+    # pooled connections the hot cart/checkout paths need
+    statement_timeout_hot_ms: int = 2000
+    statement_timeout_search_ms: int = 1500
+    statement_timeout_admin_ms: int = 10000
+    # optional cart sharding by user_id, e.g. CART_SHARD_URLS='["postgresql://..", ..]'
+    # users map to bucket user_id % cart_shard_buckets, buckets to shards via
+    # cart_shard_map "0-511:0,512-1023:1" (empty spreads the buckets evenly)
+    cart_shard_urls: List[str] = []
+    cart_shard_buckets: int = 1024
+    cart_shard_map: str = ""
+    # listings count exactly up to this many matches, above it the planner estimates
+    exact_count_threshold: int = 10000
+    # live stock streams: max product ids per subscription, min seconds between two
+    # pushes to one client (updates in between are coalesced), keep-alive seconds
+    stock_stream_max_ids: int = 100
+    stock_stream_min_interval: float = 0.5
+    stock_stream_heartbeat: float = 15.0
+    # /batch: max sub-requests per call, how many reads run at the same time and
+    # seconds until a sub-request is answered with a 504
+    batch_max_requests: int = 20
+    batch_concurrency: int = 8
+    batch_item_timeout: float = 30.0
+    # abandoned carts: purged when no line was touched for max_age_days, checked
+    # every interval seconds (0 = never, use python -m app.maintenance), in batches
+    # of batch_size rows with pause seconds in between, VACUUM (ANALYZE) afterwards
+    cart_purge_max_age_days: float = 30.0
+    cart_purge_interval: float = 3600.0
+    cart_purge_batch_size: int = 1000
+    cart_purge_pause: float = 0.1
+    cart_purge_vacuum: bool = True
+    # profiling: requests with an X-Profile header profiled per minute and worker,
+    # request profiles kept, max duration of a sampling profile in seconds
+    profiling_requests_per_minute: float = 6.0
+    profiling_keep: int = 50
+    profiling_max_seconds: float = 60.0
+    # connection pool of the main database engine
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    # threadpool tokens: request sessions and db tasks hold a "db" token each
+    # (0 = db_pool_size + db_max_overflow - db_background_connections, the rest is
+    # left to write-behind queues, listeners and rebuilds), password hashing and
+    # token checks run on "cpu"; the default anyio limiter runs sync dependencies
+    # and endpoints (0 = db + cpu). Waits for a db token end after db_pool_timeout
+    db_background_connections: int = 3
+    threadpool_db_tokens: int = 0
+    threadpool_cpu_tokens: int = 4
+    threadpool_default_tokens: int = 0
+    # /inventory/adjustments: max adjustments per call; with coalesce=true they are
+    # queued and summed per product over window seconds, written in one transaction;
+    # the outcome of the last results coalesced calls can be looked up by id
+    inventory_adjustment_max_items: int = 1000
+    inventory_adjustment_window: float = 0.2
+    inventory_adjustment_queue_maxsize: int = 10000
+    inventory_adjustment_queue_batch_size: int = 500
+    inventory_adjustment_results: int = 10000
+    # Idempotency-Key on cart, checkout and inventory writes: first responses kept
+    # per worker for ttl seconds (at most max_keys, bodies up to max_body bytes),
+    # duplicates still in flight wait up to wait seconds, then get a 409
+    idempotency_ttl: float = 86400.0
+    idempotency_max_keys: int = 10000
+    idempotency_max_body: int = 65536
+    idempotency_wait: float = 10.0
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,167 @@
+import json
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Response
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query, Session
+
+from . import models
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryCounts:
+    """
+    Number of products per category, loaded with one GROUP BY and then adjusted in
+    place from the product change notifications (see cache.on_product_change).
+    When invalidated (notifications may have been missed) the old counts keep being
+    served, flagged as not exact, while a single background reload runs. Only
+    used while `listening`, i.e. the invalidation listener runs; without it nothing
+    adjusts the counts and the totals are counted from the table instead.
+    """
+
+    def __init__(self, loader: Callable[[], Dict[str, int]]) -> None:
+        self.loader = loader
+        self.listening = False
+        self._counts: Optional[Dict[str, int]] = None
+        self._fresh = False
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """reload all counts on the calling thread"""
+        try:
+            counts = self.loader()
+        except Exception:
+            logger.exception("loading category counts failed")
+            with self._lock:
+                self._loading = False
+            return
+        with self._lock:
+            self._counts, self._fresh, self._loading = counts, True, False
+
+    def _refresh_in_background(self) -> None:
+        # caller holds the lock
+        if self._loading:
+            return
+        self._loading = True
+        threading.Thread(
+            target=self.refresh, name="category-counts", daemon=True
+        ).start()
+
+    def snapshot(self) -> Optional[Tuple[Dict[str, int], bool]]:
+        """
+        :return: (counts by category, exact) or None while nothing was loaded yet
+        """
+        with self._lock:
+            if not self._fresh:
+                self._refresh_in_background()
+            if self._counts is None:
+                return None
+            return self._counts, self._fresh
+
+    def adjust(self, category: str, delta: int) -> None:
+        """count a product created in (+1) or removed from (-1) a category"""
+        with self._lock:
+            if self._counts is not None:
+                counts = dict(self._counts)
+                counts[category] = max(counts.get(category, 0) + delta, 0)
+                self._counts = counts
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._fresh = False
+
+
+def load_category_counts() -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        return dict(
+            db.query(models.Product.category, func.count(models.Product.id))
+            .group_by(models.Product.category)
+            .all()
+        )
+    finally:
+        db.close()
+
+
+category_counts = CategoryCounts(load_category_counts)
+
+
+def table_estimate(db: Session) -> int:
+    """row count of products from the planner statistics (pg_class.reltuples)"""
+    estimate = db.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass")
+    ).scalar()
+    return max(int(estimate or 0), 0)
+
+
+def planner_estimate(db: Session, query: Query) -> int:
+    """
+    :param db: SqlAlchemy db object
+    :param query: filtered query without limit/offset
+    :return: number of rows the planner expects the query to return
+    """
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    plan = (
+        db.connection()
+        .exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+        .scalar()
+    )
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_rows(db: Session, query: Query, threshold: int) -> Tuple[int, bool]:
+    """
+    exact count for small results, planner estimate for large ones. The exact count
+    stops after threshold + 1 rows, so it never costs more than a bounded scan.
+    :param db: SqlAlchemy db object
+    :param query: filtered query without limit/offset
+    :param threshold: largest result counted exactly
+    :return: (count, exact)
+    """
+    estimate = planner_estimate(db, query)
+    if estimate > threshold:
+        return estimate, False
+    capped = (
+        db.query(func.count())
+        .select_from(query.limit(threshold + 1).subquery())
+        .scalar()
+    )
+    if capped > threshold:
+        return max(estimate, capped), False
+    return capped, True
+
+
+def products_total(db: Session, search: str = "") -> Tuple[int, bool]:
+    """
+    total for the product listings
+    :param db: SqlAlchemy db object
+    :param search: name filter of the listing
+    :return: (count, exact)
+    """
+    if search:
+        query = db.query(models.Product.id).filter(models.Product.name.contains(search))
+        return count_rows(db, query, settings.exact_count_threshold)
+    if not category_counts.listening:
+        return count_rows(
+            db, db.query(models.Product.id), settings.exact_count_threshold
+        )
+    snapshot = category_counts.snapshot()
+    if snapshot is None:
+        return table_estimate(db), False
+    counts, exact = snapshot
+    return sum(counts.values()), exact
+
+
+def set_total_count(response: Response, total: Tuple[int, bool]) -> None:
+    count, exact = total
+    response.headers["X-Total-Count"] = str(count)
+    response.headers["X-Total-Count-Exact"] = "true" if exact else "false"
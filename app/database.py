@@ -1,11 +1,17 @@
-from sqlalchemy import create_engine
+from typing import Any, AsyncIterator, Callable, Optional
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 # import psycopg2
 # from psycopg2.extras import RealDictCursor
 # import time
 from .config import settings
+from .metrics import metrics
+from .threadpool import holding
 
 # demo: connect DB via psycopg2
 
@@ -33,16 +39,105 @@ SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.
 {settings.database_hostname}:{settings.database_port}/{settings.database_name}"
 
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
-def get_db():
+metrics.gauge("db_pool_checked_out", engine.pool.checkedout)
+metrics.gauge("db_pool_overflow", engine.pool.overflow)
+
+
+async def get_db(request: Request) -> AsyncIterator[Session]:
+    # the session may hold a pooled connection until the request ends, so it is
+    # opened under a db token: a request never holds a connection while it waits
+    # for one (see threadpool.limiter_tokens). Dependencies which need no session,
+    # e.g. oauth2.get_current_user, resolve before it where the route lists them
+    # first
+    async with holding("db", settings.db_pool_timeout):
+        db = SessionLocal()
+        state = request.scope.setdefault("state", {})
+        state["db_session"] = db
+        watch_request(request, db)
+        try:
+            yield db
+        finally:
+            state.pop("db_session", None)
+            await run_in_threadpool(db.close)
+
+
+def watch_session(db: Session, timeout_ms: int, token: Optional[Any]) -> None:
+    """
+    every transaction of the session runs with SET LOCAL statement_timeout, and its
+    running query is cancelled when the request's cancel token fires
+    :param db: SqlAlchemy session of the request
+    :param timeout_ms: statement_timeout in milliseconds
+    :param token: cancellation.CancelToken of the request, if any
+    """
+
+    @event.listens_for(db, "after_begin")
+    def set_timeout(session, transaction, connection):
+        if connection.dialect.name != "postgresql":
+            return
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+        if token is not None:
+            token.register(session, connection.connection.cancel)
+
+    @event.listens_for(db, "after_transaction_end")
+    def release(session, transaction):
+        # the connection goes back to the pool, never cancel someone else's query
+        if token is not None and transaction.parent is None:
+            token.unregister(session)
+
+
+def route_timeout_ms(route_class: str) -> int:
+    """:param route_class: name of the statement_timeout_<route_class>_ms setting"""
+    return int(getattr(settings, f"statement_timeout_{route_class}_ms"))
+
+
+def statement_timeout(route_class: str) -> Callable[..., None]:
+    """
+    dependency factory: every transaction of the request's db sessions runs with
+    SET LOCAL statement_timeout for the route class ("hot", "search" or "admin"),
+    and the running query is cancelled when the client disconnects. It opens no
+    session itself, get_db and the cart shards pick it up via watch_request()
+    :param route_class: name of the statement_timeout_<route_class>_ms setting
+    :return: dependency for Depends()
+    """
+    timeout_ms = route_timeout_ms(route_class)
+
+    def apply_statement_timeout(request: Request) -> None:
+        request.scope.setdefault("state", {})["statement_timeout_ms"] = timeout_ms
+
+    return apply_statement_timeout
+
+
+def task_session(route_class: str) -> Session:
+    """
+    session for a short db task of a request outside get_db, run with
+    run_on("db", ..); the caller closes it
+    :param route_class: statement_timeout of the task, as for statement_timeout()
+    """
     db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    watch_session(db, route_timeout_ms(route_class), None)
+    return db
+
+
+def watch_request(request: Request, db: Session) -> None:
+    """
+    give another session opened for the request, e.g. on a cart shard, the
+    statement_timeout and cancellation of the request's route class
+    :param request: current request
+    :param db: session opened for it
+    """
+    state = request.scope.get("state", {})
+    timeout_ms = state.get("statement_timeout_ms")
+    if timeout_ms is not None:
+        watch_session(db, timeout_ms, state.get("cancel_token"))
@@ -0,0 +1,73 @@
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple, Type
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, create_model
+
+
+def parse_fields(
+    fields: Optional[str], schema: Type[BaseModel]
+) -> Optional[Tuple[str, ...]]:
+    """
+    parse a comma separated ?fields= value and validate the names against the schema
+    :param fields: comma separated field names, e.g. "id,name,category"
+    :param schema: pydantic response model the fields are taken from
+    :return: field names in schema order or None when all fields are wanted
+    """
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = sorted(requested - set(schema.__fields__))
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"unknown fields: {', '.join(unknown)}, "
+            f"allowed fields: {', '.join(schema.__fields__)}",
+        )
+    if not requested:
+        return None
+    return tuple(name for name in schema.__fields__ if name in requested)
+
+
+@lru_cache(maxsize=256)
+def projected_schema(
+    schema: Type[BaseModel], fields: Tuple[str, ...]
+) -> Type[BaseModel]:
+    """
+    build (once per field set) a response model with only the given fields
+    :param schema: full pydantic response model
+    :param fields: field names to keep
+    :return: pydantic model with the subset of fields
+    """
+    definitions = {name: (schema.__fields__[name].outer_type_, ...) for name in fields}
+    return create_model(
+        f"{schema.__name__}Fields",
+        __config__=schema.__config__,
+        **definitions,
+    )
+
+
+def projected_columns(model: Any, fields: Optional[Tuple[str, ...]]) -> List[Any]:
+    """
+    :param model: SqlAlchemy model
+    :param fields: field names to load, None loads the whole model
+    :return: entities/columns to pass to db.query()
+    """
+    if not fields:
+        return [model]
+    return [getattr(model, name) for name in fields]
+
+
+def serialize(rows: Any, schema: Type[BaseModel], fields: Tuple[str, ...]) -> Any:
+    """
+    serialise orm rows (or a single row) with the projected response model
+    :param rows: row or list of rows loaded with projected_columns
+    :param schema: full pydantic response model
+    :param fields: field names to keep
+    :return: json compatible data
+    """
+    partial = projected_schema(schema, fields)
+    if isinstance(rows, list):
+        return jsonable_encoder([partial.from_orm(row) for row in rows])
+    return jsonable_encoder(partial.from_orm(rows))
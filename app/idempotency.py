@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+from .metrics import metrics
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# answers a retry may get differently: server errors, expired tokens, throttling
+RETRYABLE_STATUS = {401, 408, 429}
+
+
+class StoredResponse:
+    """response of the first request sent with a key, or a placeholder while it runs"""
+
+    def __init__(self, fingerprint: str) -> None:
+        self.fingerprint = fingerprint
+        self.done = asyncio.Event()
+        self.status: Optional[int] = None
+        self.headers: List[Tuple[bytes, bytes]] = []
+        self.body = b""
+        self.expires = float("inf")
+
+
+class IdempotencyStore:
+    """
+    The last `max_entries` responses by idempotency key, each kept for `ttl`
+    seconds after it completed. Only used from the event loop, so no locking.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, StoredResponse]" = OrderedDict()
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[bool, StoredResponse]:
+        """
+        :param key: idempotency key scoped to the caller and the endpoint
+        :param fingerprint: hash of the request body
+        :return: True and a new placeholder if the caller runs the request, else
+        False and the entry of the earlier request, which may still be running
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= now:
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            return False, entry
+
+        entry = self._entries[key] = StoredResponse(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True, entry
+
+    def complete(
+        self, key: str, entry: StoredResponse, status: int, headers: list, body: bytes
+    ) -> None:
+        entry.status = status
+        entry.headers = headers
+        entry.body = body
+        entry.expires = time.monotonic() + self.ttl
+        # completed entries expire in insertion order
+        if self._entries.get(key) is entry:
+            self._entries.move_to_end(key)
+        entry.done.set()
+
+    def abandon(self, key: str, entry: StoredResponse) -> None:
+        """forget a request which failed, the next duplicate runs it again"""
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        entry.done.set()
+
+
+idempotency_store = IdempotencyStore(
+    settings.idempotency_max_keys, settings.idempotency_ttl
+)
+
+
+def _json_response(status: int, detail: str) -> Tuple[Message, Message]:
+    body = json.dumps({"detail": detail}).encode()
+    return (
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        },
+        {"type": "http.response.body", "body": body},
+    )
+
+
+class IdempotencyMiddleware:
+    """
+    Answers retries of writes sent with the same `Idempotency-Key` header from the
+    stored first response (marked with `Idempotent-Replayed: true`) without running
+    the endpoint again. A duplicate arriving while the first request still runs
+    waits for its response, up to `wait` seconds before a 409; reusing a key with
+    a different body is a 422. 5xx, 401, 408 and 429 responses are not stored so
+    the retry runs. Keys are scoped to the Authorization header, method and path,
+    and stored per worker, so retries must reach the same worker to be deduplicated.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        prefixes: Sequence[str],
+        store: IdempotencyStore = idempotency_store,
+        wait: float = 10.0,
+        max_body: int = 65536,
+    ) -> None:
+        self.app = app
+        self.prefixes = tuple(prefixes)
+        self.store = store
+        self.wait = wait
+        self.max_body = max_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get("idempotency-key")
+        if (
+            idempotency_key is None
+            or scope["method"] not in WRITE_METHODS
+            or not scope["path"].startswith(self.prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        if not 0 < len(idempotency_key) <= 255:
+            for message in _json_response(
+                400, "Idempotency-Key must be 1 to 255 characters"
+            ):
+                await send(message)
+            return
+
+        messages: List[Message] = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            if not message.get("more_body", False):
+                break
+
+        key = hashlib.sha256(
+            "\n".join(
+                [
+                    headers.get("authorization", ""),
+                    scope["method"],
+                    scope["path"],
+                    idempotency_key,
+                ]
+            ).encode()
+        ).hexdigest()
+        fingerprint = hashlib.sha256(
+            scope.get("query_string", b"")
+            + b"\n"
+            + b"".join(message.get("body", b"") for message in messages)
+        ).hexdigest()
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            owner, entry = self.store.begin(key, fingerprint)
+            if owner:
+                break
+            if entry.fingerprint != fingerprint:
+                metrics.inc("idempotency_mismatches")
+                for message in _json_response(
+                    422, "Idempotency-Key was already used with a different request"
+                ):
+                    await send(message)
+                return
+            if not entry.done.is_set():
+                try:
+                    await asyncio.wait_for(
+                        entry.done.wait(), max(deadline - time.monotonic(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    metrics.inc("idempotency_conflicts")
+                    for message in _json_response(
+                        409, "a request with this Idempotency-Key is still in progress"
+                    ):
+                        await send(message)
+                    return
+            if entry.status is not None:
+                metrics.inc("idempotent_replays")
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": entry.status,
+                        "headers": entry.headers + [(b"idempotent-replayed", b"true")],
+                    }
+                )
+                await send({"type": "http.response.body", "body": entry.body})
+                return
+            # the first request failed, run it again unless another duplicate does
+
+        async def replay() -> Message:
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        start: Optional[Message] = None
+        body: List[bytes] = []
+        size = 0
+
+        async def capture(message: Message) -> None:
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                if size <= self.max_body:
+                    body.append(message.get("body", b""))
+            await send(message)
+
+        stored = False
+        try:
+            await self.app(scope, replay, capture)
+            if (
+                start is not None
+                and start["status"] < 500
+                and start["status"] not in RETRYABLE_STATUS
+                and size <= self.max_body
+            ):
+                self.store.complete(
+                    key, entry, start["status"], list(start["headers"]), b"".join(body)
+                )
+                stored = True
+        finally:
+            if not stored:
+                self.store.abandon(key, entry)
@@ -0,0 +1,125 @@
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+# channel used by the notify_cache_invalidation() trigger in db/init.sql
+CHANNEL = "cache_invalidation"
+
+# handler(op, row_id, change) with op INSERT / UPDATE / STOCK / DELETE and change
+# the whole notification, e.g. with the category of a product
+ChangeHandler = Callable[[str, int, Dict[str, Any]], None]
+
+
+class InvalidationListener:
+    """
+    Background thread holding a dedicated LISTEN connection. Row change notifications
+    `{"table": .., "op": .., "id": ..}` are dispatched to the handlers registered for
+    the table. After a connection failure every flush handler runs once listening
+    again, since notifications sent while the connection was down are lost.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        channel: str = CHANNEL,
+        poll_timeout: float = 5.0,
+        max_reconnect_delay: float = 30.0,
+    ) -> None:
+        self.dsn = dsn
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.max_reconnect_delay = max_reconnect_delay
+        self._handlers: Dict[str, List[ChangeHandler]] = defaultdict(list)
+        self._flush_handlers: List[Callable[[], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def on_change(self, table: str, handler: ChangeHandler) -> None:
+        self._handlers[table].append(handler)
+
+    def on_flush(self, handler: Callable[[], None]) -> None:
+        self._flush_handlers.append(handler)
+
+    def dispatch(self, payload: str) -> None:
+        """
+        run the handlers of one notification
+        :param payload: json payload sent by the trigger
+        """
+        try:
+            change = json.loads(payload)
+            table, op, row_id = change["table"], change["op"], int(change["id"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("ignoring malformed notification %r", payload)
+            return
+        for handler in self._handlers.get(table, ()):
+            try:
+                handler(op, row_id, change)
+            except Exception:
+                logger.exception("cache handler for %s %s %s failed", table, op, row_id)
+
+    def flush_all(self) -> None:
+        """drop/reload every local cache"""
+        for handler in self._flush_handlers:
+            try:
+                handler()
+            except Exception:
+                logger.exception("cache flush handler failed")
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="cache-invalidation", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _listen(self) -> "psycopg2.extensions.connection":
+        # keepalives make a silently dropped connection fail instead of hanging
+        conn = psycopg2.connect(
+            self.dsn, keepalives=1, keepalives_idle=30, keepalives_interval=10
+        )
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return conn
+
+    def _run(self) -> None:
+        delay = 0.5
+        missed = False
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._listen()
+                if missed:
+                    logger.info("cache invalidation reconnected, flushing caches")
+                    self.flush_all()
+                    missed = False
+                delay = 0.5
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError):
+                missed = True
+                logger.warning(
+                    "cache invalidation connection lost, retrying in %.1fs", delay
+                )
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -1,15 +1,42 @@
 import time
 
 import psycopg2
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from psycopg2.errors import QueryCanceled
 from psycopg2.extras import RealDictCursor
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
 # from . import models
+from . import autocomplete
+from .adjustments import adjustment_queue
+from .cancellation import DisconnectCancelMiddleware
+from .cache import catalog_cache, invalidation_listener, is_catalog_request
+from .compression import CompressionMiddleware
 from .config import settings
+from .counts import category_counts
+from .idempotency import IdempotencyMiddleware
+from .maintenance import cart_purge
+from .metrics import metrics
+from .orders import order_queue
+from .profiling import ProfilingMiddleware
+from .recommendations import related_index, related_refresher
 
 # from .database import engine
-from .routers import auth, cart, checkout, inventory, product, user
+from .routers import (
+    auth,
+    batch,
+    cart,
+    checkout,
+    debug,
+    inventory,
+    product,
+    stock,
+    user,
+)
+from .threadpool import LimiterTimeout, configure_threadpool
 
 # models.Base.metadata.create_all(bind=engine)
 
@@ -17,14 +44,69 @@ app = FastAPI()
 
 origins = ["*"]
 
+# inside DisconnectCancelMiddleware, so a cancelled first request is not stored,
+# and inside compression, so replays are encoded for the retrying client
+app.add_middleware(
+    IdempotencyMiddleware,
+    prefixes=["/cart", "/checkout", "/inventory"],
+    wait=settings.idempotency_wait,
+    max_body=settings.idempotency_max_body,
+)
+
+app.add_middleware(DisconnectCancelMiddleware)
+
+app.add_middleware(
+    ProfilingMiddleware, per_minute=settings.profiling_requests_per_minute
+)
+
+# added before CORS so cached catalog responses get CORS headers for each request
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_minimum_size,
+    gzip_level=settings.compression_gzip_level,
+    brotli_quality=settings.compression_brotli_quality,
+    cache=catalog_cache,
+    cacheable=is_catalog_request,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Total-Count-Exact", "Idempotent-Replayed"],
 )
 
+
+@app.exception_handler(OperationalError)
+async def database_error_handler(
+    request: Request, exc: OperationalError
+) -> JSONResponse:
+    # statement_timeout expired or the query was cancelled on client disconnect
+    if isinstance(exc.orig, QueryCanceled):
+        return JSONResponse(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            content={"detail": "Database query timed out"},
+        )
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Database unavailable"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(LimiterTimeout)
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: Exception) -> JSONResponse:
+    # no pooled connection, or no db token for one, became free in time
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Database busy, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+
 # adding all app routes
 app.include_router(auth.router)
 app.include_router(user.router)
@@ -32,8 +114,52 @@ app.include_router(product.router)
 app.include_router(inventory.router)
 app.include_router(cart.router)
 app.include_router(checkout.router)
+app.include_router(stock.router)
+app.include_router(batch.router)
+app.include_router(debug.router)
+
+
+@app.on_event("startup")
+async def size_threadpool() -> None:
+    # anyio limiters can only be changed on the event loop
+    configure_threadpool()
+
+
+@app.on_event("startup")
+def start_background_workers() -> None:
+    order_queue.start()
+    adjustment_queue.start()
+    related_refresher.start(settings.related_rebuild_interval)
+    autocomplete.start_loading()
+    cart_purge.start(settings.cart_purge_interval)
+    if settings.cache_invalidation_enabled:
+        invalidation_listener.start()
+        # the notifications keep the cached category counts exact and bring the
+        # orders of every worker into the related and autocomplete indexes
+        category_counts.listening = True
+        related_index.listening = True
+        autocomplete.autocomplete_index.listening = True
+
+
+@app.on_event("shutdown")
+def stop_background_workers() -> None:
+    # flush the follow-up work of orders already committed
+    order_queue.stop()
+    adjustment_queue.stop()
+    related_refresher.stop()
+    cart_purge.stop()
+    category_counts.listening = False
+    related_index.listening = False
+    autocomplete.autocomplete_index.listening = False
+    invalidation_listener.stop()
 
 
 @app.get("/")
 def root():
     return {"message": "Hello World !!!"}
+
+
+@app.get("/metrics")
+def get_metrics() -> dict:
+    """in-process metrics of this worker"""
+    return metrics.snapshot()
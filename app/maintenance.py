@@ -0,0 +1,189 @@
+import argparse
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Sequence
+
+from sqlalchemy import and_, delete, exists, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import Delete
+
+from . import models
+from .config import settings
+from .database import engine
+from .metrics import metrics
+from .sharding import cart_shards
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key, only one worker per database purges at a time
+PURGE_LOCK_ID = 0x6361_7274
+
+cart = models.Cart.__table__
+
+
+def abandoned_cart_rows(cutoff: datetime, batch_size: int) -> Delete:
+    """
+    delete of at most batch_size lines of carts whose lines were all last touched
+    before cutoff; a cart with any recent line is kept whole
+    :param cutoff: oldest activity which still counts as a live cart
+    :param batch_size: max rows deleted by the statement
+    :return: delete statement
+    """
+    recent = cart.alias("recent")
+    batch = (
+        select(cart.c.id)
+        .where(
+            cart.c.updated_at < cutoff,
+            ~exists().where(
+                and_(recent.c.user_id == cart.c.user_id, recent.c.updated_at >= cutoff)
+            ),
+        )
+        .limit(batch_size)
+        # concurrent purges or cart writes never wait on each other
+        .with_for_update(skip_locked=True)
+    )
+    return delete(cart).where(cart.c.id.in_(batch.scalar_subquery()))
+
+
+def purge_database(
+    db_engine: Engine,
+    cutoff: datetime,
+    batch_size: int,
+    pause: float,
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """
+    purge abandoned carts of one database, one short transaction per batch so
+    row locks are held briefly and WAL is written in small steps
+    :param db_engine: engine of the main db or of a cart shard
+    :param cutoff: carts idle since before this are abandoned
+    :param batch_size: rows per transaction
+    :param pause: seconds to sleep between batches
+    :param stop: set to end the purge after the current batch
+    :return: number of cart rows deleted
+    """
+    postgres = db_engine.dialect.name == "postgresql"
+    purged = 0
+    with db_engine.connect() as conn:
+        if (
+            postgres
+            and not conn.execute(
+                select(func.pg_try_advisory_lock(PURGE_LOCK_ID))
+            ).scalar()
+        ):
+            logger.info("cart purge already running on %s", db_engine.url)
+            return 0
+        try:
+            statement = abandoned_cart_rows(cutoff, batch_size)
+            while True:
+                with conn.begin():
+                    deleted = conn.execute(statement).rowcount
+                purged += deleted
+                metrics.inc("cart_rows_purged", deleted)
+                if deleted < batch_size:
+                    break
+                if stop is not None:
+                    if stop.wait(pause):
+                        break
+                else:
+                    time.sleep(pause)
+        finally:
+            if postgres:
+                conn.execute(select(func.pg_advisory_unlock(PURGE_LOCK_ID)))
+
+    if purged and postgres and settings.cart_purge_vacuum:
+        # plain VACUUM makes the space reusable without the exclusive lock of FULL
+        with db_engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as conn:
+            conn.execute(text("VACUUM (ANALYZE) cart"))
+    return purged
+
+
+def cart_engines() -> List[Engine]:
+    """every database holding cart rows"""
+    return list(cart_shards.engines) if cart_shards.enabled else [engine]
+
+
+def purge_abandoned_carts(
+    max_age_days: float, stop: Optional[threading.Event] = None
+) -> int:
+    """
+    one purge run over the main db or all cart shards
+    :param max_age_days: carts idle for longer are abandoned
+    :param stop: set to end the run early
+    :return: number of cart rows deleted
+    """
+    started = time.monotonic()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    purged = 0
+    for db_engine in cart_engines():
+        purged += purge_database(
+            db_engine,
+            cutoff,
+            settings.cart_purge_batch_size,
+            settings.cart_purge_pause,
+            stop,
+        )
+        if stop is not None and stop.is_set():
+            break
+    elapsed = time.monotonic() - started
+    metrics.observe("cart_purge_seconds", elapsed)
+    logger.info(
+        "purged %d abandoned cart rows idle since %s in %.1fs", purged, cutoff, elapsed
+    )
+    return purged
+
+
+class _PurgeScheduler:
+    """background thread which purges abandoned carts periodically"""
+
+    def __init__(self) -> None:
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                purge_abandoned_carts(settings.cart_purge_max_age_days, self._stop)
+            except Exception:
+                logger.exception("purging abandoned carts failed")
+
+    def start(self, interval: float) -> None:
+        if interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="cart-purge", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+cart_purge = _PurgeScheduler()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    python -m app.maintenance purge-carts
+    python -m app.maintenance purge-carts --max-age-days 7
+    """
+    parser = argparse.ArgumentParser(description="database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    purge = commands.add_parser("purge-carts", help="delete abandoned carts")
+    purge.add_argument(
+        "--max-age-days", type=float, default=settings.cart_purge_max_age_days
+    )
+    args = parser.parse_args(argv)
+
+    purged = purge_abandoned_carts(args.max_age_days)
+    print(f"purged {purged} cart rows")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
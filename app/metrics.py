@@ -0,0 +1,54 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+
+class Metrics:
+    """
+    Minimal thread-safe in-process metrics registry: counters, summaries
+    (count/sum/max of observed values) and gauges evaluated on snapshot.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._summaries: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, value: float = 1.0) -> None:
+        """increments a counter"""
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        """records one observation of a summary, e.g. a duration"""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = self._summaries[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def gauge(self, name: str, func: Callable[[], float]) -> None:
+        """registers a callable which is read on every snapshot"""
+        with self._lock:
+            self._gauges[name] = func
+
+    def snapshot(self) -> Dict[str, object]:
+        """returns a json compatible copy of all metrics"""
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {
+                name: dict(summary, avg=summary["sum"] / summary["count"])
+                for name, summary in self._summaries.items()
+            }
+            gauges = dict(self._gauges)
+        return {
+            "counters": counters,
+            "summaries": summaries,
+            "gauges": {name: func() for name, func in gauges.items()},
+        }
+
+
+metrics = Metrics()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
@@ -47,6 +47,65 @@ class Cart(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"))
     quantity = Column(Integer, nullable=False)
+    # last activity of the line, carts idle for cart_purge_max_age_days are purged.
+    # func.now() renders CURRENT_TIMESTAMP on sqlite, which the shard tests use
+    created_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=func.now()
+    )
+    updated_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=func.now()
+    )
 
     product = relationship("Product")
     user = relationship("User")
+
+
+class Order(Base):
+    """Orders table SqlAlchemy model"""
+
+    __tablename__ = "orders"
+    id = Column(Integer, primary_key=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    created_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+
+    items = relationship("OrderItem")
+
+    # fetch created_at with the INSERT ... RETURNING so checkout needs no extra select
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class OrderItem(Base):
+    """Order items table SqlAlchemy model"""
+
+    __tablename__ = "order_items"
+    id = Column(Integer, primary_key=True, nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"))
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="SET NULL"))
+    quantity = Column(Integer, nullable=False)
+
+
+class OrderHistory(Base):
+    """Denormalised order history table SqlAlchemy model, filled by the write-behind queue"""
+
+    __tablename__ = "order_history"
+    id = Column(Integer, primary_key=True, nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"))
+    user_id = Column(Integer, nullable=False)
+    product_id = Column(Integer, nullable=True)
+    product_name = Column(String, nullable=True)
+    category = Column(String, nullable=True)
+    quantity = Column(Integer, nullable=False)
+    ordered_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+
+class ProductStats(Base):
+    """Per product order counters, filled by the write-behind queue"""
+
+    __tablename__ = "product_stats"
+    product_id = Column(
+        Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True
+    )
+    times_ordered = Column(Integer, nullable=False, server_default=text("0"))
+    units_ordered = Column(Integer, nullable=False, server_default=text("0"))
@@ -1,12 +1,15 @@
 from datetime import datetime, timedelta
+from typing import Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Query, Session
 
 from . import database, models, schemas
 from .config import settings
+from .threadpool import run_on
 
 # from psycopg2 import connection
 
@@ -59,23 +62,68 @@ def verify_access_token(
     return token_data
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
+def load_user(user_id: int) -> Optional[models.User]:
+    """
+    read a user on a short session of its own, run it with run_on("db", ..)
+    :param user_id: id of the user
+    :return: the user, detached so it stays usable after the session is closed
+    """
+    db = database.task_session("hot")
+    try:
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if user is not None:
+            db.expunge(user)
+        return user
+    finally:
+        db.close()
+
+
+async def get_current_user(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
 ) -> object:
     """
-    Returns current user logged-in user
+    Returns current user logged-in user. Takes no db token before the token is
+    checked (on the cpu limiter); the user is read on a short session of its own,
+    or with the request's session if get_db already opened it
+    :param request: sub-requests of /batch carry the user resolved for the batch
     :param token: JWT token
-    :param db: SqlAlchemy db object
     :return: SqlAlchemy result object
     """
+    shared = request.scope.get("state", {}).get("current_user")
+    if shared is not None and shared[0] == token:
+        return shared[1]
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail=f"Could not validate credentials, expired",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    token = verify_access_token(token, credentials_exception)
+    token = await run_on("cpu", verify_access_token, token, credentials_exception)
 
-    user = db.query(models.User).filter(models.User.id == token.id).first()
+    db = request.scope.get("state", {}).get("db_session")
+    if db is not None:
+        # a second db token could wait on requests which wait for this one
+        return await run_in_threadpool(
+            db.query(models.User).filter(models.User.id == token.id).first
+        )
 
-    return user
+    return await run_on("db", load_user, token.id)
+
+
+def get_detached_user(token: str) -> Optional[models.User]:
+    """
+    resolve a token once for all sub-requests of /batch, which run on sessions of
+    their own; the user is detached so their commits do not expire it. Opens a
+    session, so run it with run_on("db", ..)
+    :param token: JWT token
+    :return: the user or None if the token is invalid
+    """
+    try:
+        token_data = verify_access_token(
+            token, HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        )
+    except HTTPException:
+        return None
+    return load_user(token_data.id)
@@ -0,0 +1,138 @@
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import List, NamedTuple, Tuple
+
+from sqlalchemy import Integer, bindparam, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from . import models
+from .autocomplete import update_autocomplete_popularity
+from .config import settings
+from .database import SessionLocal
+from .recommendations import update_related_index
+from .write_behind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+
+class OrderPlaced(NamedTuple):
+    """event queued by the checkout once the order is committed"""
+
+    order_id: int
+    user_id: int
+    items: List[Tuple[int, int]]  # (product_id, quantity)
+    ordered_at: datetime
+
+
+def write_order_history(batch: List[OrderPlaced]) -> None:
+    """
+    denormalise the orders of a batch into order_history with product name and category
+    :param batch: list of placed orders
+    """
+    product_ids = {product_id for event in batch for product_id, _ in event.items}
+    db = SessionLocal()
+    try:
+        products = {
+            product.id: product
+            for product in db.query(
+                models.Product.id, models.Product.name, models.Product.category
+            ).filter(models.Product.id.in_(product_ids))
+        }
+        rows = []
+        for event in batch:
+            for product_id, quantity in event.items:
+                product = products.get(product_id)
+                rows.append(
+                    {
+                        "order_id": event.order_id,
+                        "user_id": event.user_id,
+                        "product_id": product_id,
+                        "product_name": product.name if product else None,
+                        "category": product.category if product else None,
+                        "quantity": quantity,
+                        "ordered_at": event.ordered_at,
+                    }
+                )
+        db.bulk_insert_mappings(models.OrderHistory, rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def update_product_stats(batch: List[OrderPlaced]) -> None:
+    """
+    add the orders of a batch to the per product counters with a single upsert
+    :param batch: list of placed orders
+    """
+    times_ordered: Counter = Counter()
+    units_ordered: Counter = Counter()
+    for event in batch:
+        for product_id, quantity in event.items:
+            times_ordered[product_id] += 1
+            units_ordered[product_id] += quantity
+    if not times_ordered:
+        return
+
+    ids = sorted(times_ordered)
+    # one row per product of the batch, joined to products so the counters of
+    # products deleted since their checkout are dropped instead of failing the
+    # whole batch on the foreign key; FOR KEY SHARE keeps them until the commit
+    batch = func.unnest(
+        bindparam("ids", ids, type_=ARRAY(Integer)),
+        bindparam("times", [times_ordered[i] for i in ids], type_=ARRAY(Integer)),
+        bindparam("units", [units_ordered[i] for i in ids], type_=ARRAY(Integer)),
+    ).table_valued("product_id", "times_ordered", "units_ordered")
+    rows = (
+        select(batch.c.product_id, batch.c.times_ordered, batch.c.units_ordered)
+        .join(models.Product, models.Product.id == batch.c.product_id)
+        .with_for_update(read=True, key_share=True, of=models.Product)
+    )
+    stmt = insert(models.ProductStats).from_select(
+        ["product_id", "times_ordered", "units_ordered"], rows
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.ProductStats.product_id],
+        set_={
+            "times_ordered": models.ProductStats.times_ordered
+            + stmt.excluded.times_ordered,
+            "units_ordered": models.ProductStats.units_ordered
+            + stmt.excluded.units_ordered,
+        },
+    )
+    db = SessionLocal()
+    try:
+        db.execute(stmt)
+        db.commit()
+    finally:
+        db.close()
+
+
+def send_notifications(batch: List[OrderPlaced]) -> None:
+    """
+    local stub for order confirmation mails/pushes
+    :param batch: list of placed orders
+    """
+    for event in batch:
+        logger.info(
+            "order %s confirmed for user %s with %d products",
+            event.order_id,
+            event.user_id,
+            len(event.items),
+        )
+
+
+order_queue = WriteBehindQueue(
+    handlers=[
+        write_order_history,
+        update_product_stats,
+        update_related_index,
+        update_autocomplete_popularity,
+        send_notifications,
+    ],
+    maxsize=settings.order_queue_maxsize,
+    batch_size=settings.order_queue_batch_size,
+    flush_interval=settings.order_queue_flush_interval,
+    max_retries=settings.order_queue_max_retries,
+    name="order-queue",
+)
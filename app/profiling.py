@@ -0,0 +1,259 @@
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+from .metrics import metrics
+from .oauth2 import verify_access_token
+
+# cProfile of the current request, set by ProfilingMiddleware when requested with
+# the X-Profile header; the threadpool copies it to the thread running the endpoint
+current_profile: ContextVar[Optional[cProfile.Profile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def _frame_label(code: Any) -> str:
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads of the worker with sys._current_frames() at a
+    fixed interval. Costs nothing while idle and a few microseconds per thread and
+    sample while running; only one profile runs at a time.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, interval: float = 0.005) -> Optional[Counter]:
+        """
+        :param seconds: how long to sample
+        :param interval: seconds between two samples
+        :return: samples per collapsed stack, None if a profile is already running
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            own = threading.get_ident()
+            names = {}
+            stacks: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own:
+                        continue
+                    if thread_id not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    labels.append(names.get(thread_id, str(thread_id)))
+                    stacks[";".join(reversed(labels))] += 1
+                time.sleep(interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    """collapsed stack format as read by flamegraph.pl, speedscope or inferno"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RateLimit:
+    """token bucket allowing `per_minute` events with bursts of the same size"""
+
+    def __init__(self, per_minute: float) -> None:
+        self.per_minute = per_minute
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.per_minute,
+                self._tokens + (now - self._updated) * self.per_minute / 60,
+            )
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class ProfileStore:
+    """the last `max_entries` request profiles of this worker"""
+
+    def __init__(self, max_entries: int = 50) -> None:
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile_id: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._profiles[profile_id] = entry
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._profiles.values())
+        return [
+            {k: v for k, v in entry.items() if k != "profile"}
+            for entry in reversed(entries)
+        ]
+
+
+def render_stats(profile: cProfile.Profile, sort: str, limit: int) -> str:
+    """pstats report of one request"""
+    profile.create_stats()
+    if not profile.stats:
+        # async endpoints and requests rejected before the endpoint are not profiled
+        return "no profile data, the request did not run a sync endpoint\n"
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+sampling_profiler = SamplingProfiler()
+request_profiles = ProfileStore(settings.profiling_keep)
+
+
+def is_admin_token(authorization: str) -> bool:
+    """
+    :param authorization: Authorization header of a request
+    :return: True for a valid bearer token of the admin, checked without the db
+    """
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        token_data = verify_access_token(token, HTTPException(status_code=401))
+    except HTTPException:
+        return False
+    return token_data.username == "invadmin"
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests of the admin sent with an `X-Profile: 1` header, at
+    most `per_minute` of them. The response carries X-Profile-Id, under which
+    admins find the cProfile stats at /debug/requests/{id}.
+    """
+
+    def __init__(
+        self, app: ASGIApp, per_minute: float, store: ProfileStore = request_profiles
+    ) -> None:
+        self.app = app
+        self.rate = RateLimit(per_minute)
+        self.store = store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        headers = Headers(scope=scope) if scope["type"] == "http" else None
+        if (
+            headers is None
+            or "x-profile" not in headers
+            # others cannot use up the budget of the admin
+            or not is_admin_token(headers.get("authorization", ""))
+            or not self.rate.allow()
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile_id
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            current_profile.reset(token)
+            metrics.inc("requests_profiled")
+            self.store.add(
+                profile_id,
+                {
+                    "id": profile_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "seconds": round(time.perf_counter() - started, 6),
+                    "profile": profile,
+                },
+            )
+
+
+def profiled(endpoint: Callable) -> Callable:
+    """
+    run a sync endpoint under the request's profile, if there is one. cProfile only
+    sees the thread it is enabled on, so this wraps the endpoint inside the thread
+    (see ProfiledRoute)
+    """
+
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        profile = current_profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        profile.enable()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    wrapper.profiled = True
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """
+    route class profiling the sync endpoints of a router; they run on the default
+    limiter like their sync dependencies, the db is gated by the request session
+    (database.get_db)
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any) -> None:
+        # include_router re-creates routes from their wrapped endpoint
+        if not inspect.iscoroutinefunction(endpoint) and not getattr(
+            endpoint, "profiled", False
+        ):
+            endpoint = profiled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
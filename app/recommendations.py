@@ -0,0 +1,249 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from itertools import permutations
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# (related product id, number of orders containing both products)
+Neighbour = Tuple[int, int]
+
+
+class CoOccurrenceIndex:
+    """
+    Sparse product x product co-occurrence counts with the top-K neighbours of every
+    product precomputed, so a lookup is a single dict access. Only the `keep` best
+    counts per product are held; pairs outside them are approximated between two
+    rebuilds, which recount everything. While `listening`, baskets are added from the
+    order notifications every worker receives (cache.on_order_placed); without the
+    invalidation listener only this worker's own checkouts are added, and orders of
+    other workers wait for the next rebuild.
+    """
+
+    def __init__(self, top_k: int = 20, keep: Optional[int] = None) -> None:
+        self.top_k = top_k
+        self.keep = keep or 2 * top_k
+        self.listening = False
+        self._counts: Dict[int, Dict[int, int]] = defaultdict(dict)
+        self._top: Dict[int, Tuple[Neighbour, ...]] = {}
+        # orders up to the fence are in the loaded counts
+        self._fence = 0
+        # baskets added while a rebuild runs, replayed onto its result
+        self._replay: Optional[List[Tuple[int, Set[int]]]] = None
+        self._lock = threading.Lock()
+
+    def _best(self, row: Dict[int, int], n: int) -> List[Neighbour]:
+        # highest count first, lower product id wins ties so results are stable
+        return heapq.nlargest(n, row.items(), key=lambda kv: (kv[1], -kv[0]))
+
+    def _count_basket(self, basket: Set[int]) -> None:
+        for product_id, related_id in permutations(basket, 2):
+            row = self._counts[product_id]
+            row[related_id] = row.get(related_id, 0) + 1
+            if len(row) > self.keep:
+                del row[min(row.items(), key=lambda kv: (kv[1], -kv[0]))[0]]
+        for product_id in basket:
+            self._top[product_id] = tuple(
+                self._best(self._counts[product_id], self.top_k)
+            )
+
+    def begin_rebuild(self) -> None:
+        """remember the baskets added from now on until the next load()"""
+        with self._lock:
+            self._replay = []
+
+    def cancel_rebuild(self) -> None:
+        """the rebuild failed, stop remembering baskets"""
+        with self._lock:
+            self._replay = None
+
+    def load(self, pairs: Iterable[Tuple[int, int, int]], fence: int = 0) -> None:
+        """
+        replace the whole index
+        :param pairs: (product_id, related_product_id, count) triples
+        :param fence: highest order id counted in pairs
+        """
+        counts: Dict[int, Dict[int, int]] = defaultdict(dict)
+        for product_id, related_id, count in pairs:
+            counts[product_id][related_id] = count
+        for product_id, row in counts.items():
+            if len(row) > self.keep:
+                counts[product_id] = dict(self._best(row, self.keep))
+        top = {
+            product_id: tuple(self._best(row, self.top_k))
+            for product_id, row in counts.items()
+        }
+        with self._lock:
+            replay, self._replay = self._replay or [], None
+            self._counts, self._top, self._fence = counts, top, fence
+            for order_id, basket in replay:
+                if order_id > fence:
+                    self._count_basket(basket)
+
+    def add_basket(self, order_id: int, product_ids: Iterable[int]) -> None:
+        """
+        count one checked-out basket and refresh the top-K of the products in it
+        :param order_id: id of the order, orders already counted by a rebuild are skipped
+        :param product_ids: products of one order
+        """
+        basket = set(product_ids)
+        if len(basket) < 2:
+            return
+        with self._lock:
+            if order_id <= self._fence:
+                return
+            if self._replay is not None:
+                self._replay.append((order_id, basket))
+            self._count_basket(basket)
+
+    def related(
+        self, product_id: int, limit: Optional[int] = None
+    ) -> Tuple[Neighbour, ...]:
+        """
+        :param product_id: product id
+        :param limit: max neighbours, defaults to top_k
+        :return: most frequently co-ordered products with their counts
+        """
+        if limit is not None and limit < 1:
+            return ()
+        return self._top.get(product_id, ())[:limit]
+
+    def __len__(self) -> int:
+        return len(self._top)
+
+
+related_index = CoOccurrenceIndex(top_k=settings.related_top_k)
+
+
+def rebuild_related_index(db: Session) -> None:
+    """
+    batch job: count product pairs over all orders inside postgres and reload the index
+    :param db: SqlAlchemy db object
+    """
+    started = time.monotonic()
+    related_index.begin_rebuild()
+    try:
+        _rebuild(db)
+    except BaseException:
+        related_index.cancel_rebuild()
+        raise
+    logger.info(
+        "related index rebuilt for %d products in %.2fs",
+        len(related_index),
+        time.monotonic() - started,
+    )
+
+
+def _rebuild(db: Session) -> None:
+    """count the pairs of orders up to a fence and load the `keep` best per product"""
+    # orders committed from here on are added by update_related_index
+    fence = db.query(func.max(models.OrderItem.order_id)).scalar() or 0
+    item, other = aliased(models.OrderItem), aliased(models.OrderItem)
+    count = func.count(func.distinct(item.order_id))
+    ranked = (
+        db.query(
+            item.product_id.label("product_id"),
+            other.product_id.label("related_id"),
+            count.label("count"),
+            # only the `keep` best neighbours of each product leave postgres
+            func.row_number()
+            .over(
+                partition_by=item.product_id,
+                order_by=(count.desc(), other.product_id),
+            )
+            .label("rank"),
+        )
+        .join(
+            other,
+            and_(
+                item.order_id == other.order_id,
+                item.product_id != other.product_id,
+            ),
+        )
+        .filter(
+            item.product_id.isnot(None),
+            other.product_id.isnot(None),
+            item.order_id <= fence,
+        )
+        .group_by(item.product_id, other.product_id)
+        .subquery()
+    )
+    pairs = (
+        db.query(ranked.c.product_id, ranked.c.related_id, ranked.c.count)
+        .filter(ranked.c.rank <= related_index.keep)
+        .yield_per(10000)
+    )
+    related_index.load(pairs, fence)
+
+
+def update_related_index(batch: List[Any]) -> None:
+    """
+    write-behind handler: add newly checked-out orders to the index, unless the
+    order notifications add them
+    :param batch: list of orders.OrderPlaced events
+    """
+    if related_index.listening:
+        return
+    for event in batch:
+        related_index.add_basket(
+            event.order_id, (product_id for product_id, _ in event.items)
+        )
+
+
+class _Refresher:
+    """
+    background thread which rebuilds the index at start-up, then periodically and
+    when asked to. Every worker rebuilds its own index; the interval is jittered so
+    the workers do not all run the pair count at the same time
+    """
+
+    def __init__(self) -> None:
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+            db = SessionLocal()
+            try:
+                rebuild_related_index(db)
+            except Exception:
+                logger.exception("rebuilding the related index failed")
+            finally:
+                db.close()
+            jitter = settings.related_rebuild_jitter
+            self._wake.wait(
+                interval * random.uniform(1 - jitter, 1 + jitter)
+                if interval > 0
+                else None
+            )
+
+    def start(self, interval: float) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="related-index", daemon=True
+        )
+        self._thread.start()
+
+    def rebuild_soon(self) -> None:
+        """rebuild now, e.g. after order notifications may have been missed"""
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+
+related_refresher = _Refresher()
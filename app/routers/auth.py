@@ -1,15 +1,16 @@
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
 
 # from psycopg2 import connection
 from .. import database, models, oauth2, schemas, utils
+from ..profiling import ProfiledRoute
+from ..threadpool import run_on
 
 # from ..database import get_db
 
-router = APIRouter(tags=["Authentication"])
+router = APIRouter(tags=["Authentication"], route_class=ProfiledRoute)
 
 
 # @router.post('/login', response_model=schemas.Token)
@@ -31,29 +32,40 @@ router = APIRouter(tags=["Authentication"])
 #     return {"access_token": access_token, "token_type": "bearer"}
 
 
+def find_user(username: str) -> Optional[Tuple[int, str, str]]:
+    """
+    read the user on a short session of its own, run with run_on("db", ..)
+    :param username: username to log in
+    :return: id, username and password hash of the user, or None
+    """
+    db = database.task_session("hot")
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        return (user.id, user.username, user.password) if user else None
+    finally:
+        db.close()
+
+
+# async and without get_db: the db token is only held for the user lookup, the
+# password is checked on the cpu limiter afterwards
 @router.post("/login", response_model=schemas.Token)
-def login(
+async def login(
     user_credentials: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(database.get_db),
 ) -> Dict[str, str]:
     """
     User login and returns the JWT token
     :param user_credentials: username and password
-    :param db: SqlAlchemy db object
     :return: JWT token
     """
-    user = (
-        db.query(models.User)
-        .filter(models.User.username == user_credentials.username)
-        .first()
-    )
+    user = await run_on("db", find_user, user_credentials.username)
 
     if not user:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail=f"Invalid Credentials"
         )
 
-    if not utils.verify(user_credentials.password, user.password):
+    user_id, username, password = user
+    if not await run_on("cpu", utils.verify, user_credentials.password, password):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail=f"Invalid Credentials"
         )
@@ -62,7 +74,7 @@ def login(
     # return token
 
     access_token = oauth2.create_access_token(
-        data={"user_id": user.id, "user_name": user.username}
+        data={"user_id": user_id, "user_name": username}
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request, status
+from starlette.types import Message, Scope
+
+from .. import oauth2, schemas
+from ..cancellation import CancelToken
+from ..config import settings
+from ..metrics import metrics
+from ..threadpool import run_on
+
+logger = logging.getLogger(__name__)
+
+# async on purpose: it only awaits the sub-requests, which run their own endpoints
+router = APIRouter(prefix="/batch", tags=["Batch"])
+
+READ_METHODS = {"GET", "HEAD"}
+METHODS = READ_METHODS | {"POST", "PUT", "PATCH", "DELETE"}
+# nested batches, stock streams which never end and the blocking profiler
+UNBATCHABLE = ("/batch", "/stock", "/debug")
+
+
+def sub_scope(
+    parent: Scope, item: schemas.SubRequest, shared_user: Optional[Tuple[str, Any]]
+) -> Scope:
+    """
+    ASGI scope of a sub-request, only the authorization of the batch is passed on;
+    without accept-encoding the sub-response comes back uncompressed
+    """
+    path, _, query = item.path.partition("?")
+    headers = [(b"accept", b"application/json")]
+    if item.body is not None:
+        headers.append((b"content-type", b"application/json"))
+    headers.extend(
+        (name, value) for name, value in parent["headers"] if name == b"authorization"
+    )
+    return {
+        "type": "http",
+        "asgi": parent.get("asgi", {"version": "3.0"}),
+        "http_version": parent.get("http_version", "1.1"),
+        "method": item.method,
+        "scheme": parent.get("scheme", "http"),
+        "server": parent.get("server"),
+        "client": parent.get("client"),
+        "root_path": parent.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "state": {"current_user": shared_user} if shared_user else {},
+    }
+
+
+async def dispatch(
+    request: Request,
+    item: schemas.SubRequest,
+    shared_user: Optional[Tuple[str, Any]],
+    disconnected: asyncio.Event,
+) -> schemas.SubResponse:
+    """
+    run one sub-request through the whole app in-process
+    :param request: the /batch request
+    :param item: sub-request
+    :param shared_user: (token, user) resolved once for the batch
+    :param disconnected: set when the batch client goes away, cancels the sub-request
+    :return: status, headers and decoded body
+    """
+    if item.method not in METHODS or not item.path.startswith("/"):
+        return schemas.SubResponse(
+            id=item.id, status=400, headers={}, body={"detail": "invalid sub-request"}
+        )
+    path = item.path.split("?")[0]
+    if any(path == prefix or path.startswith(prefix + "/") for prefix in UNBATCHABLE):
+        return schemas.SubResponse(
+            id=item.id,
+            status=400,
+            headers={},
+            body={"detail": f"{path} cannot be batched"},
+        )
+
+    body = [json.dumps(item.body).encode() if item.body is not None else b""]
+    response: Dict[str, Any] = {"status": 500, "headers": {}, "body": b""}
+    scope = sub_scope(request.scope, item, shared_user)
+    # replaced by DisconnectCancelMiddleware when the sub-request runs through it
+    scope["state"]["cancel_token"] = CancelToken()
+    timed_out = asyncio.Event()
+
+    async def receive() -> Message:
+        if body:
+            return {"type": "http.request", "body": body.pop(), "more_body": False}
+        if not (disconnected.is_set() or timed_out.is_set()):
+            waits = [
+                asyncio.ensure_future(disconnected.wait()),
+                asyncio.ensure_future(timed_out.wait()),
+            ]
+            try:
+                await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for wait in waits:
+                    wait.cancel()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {
+                name.decode("latin-1"): value.decode("latin-1")
+                for name, value in message.get("headers", [])
+                if name != b"content-length"
+            }
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    metrics.inc("batch_sub_requests")
+    task = asyncio.ensure_future(request.app(scope, receive, send))
+    try:
+        await asyncio.wait({task}, timeout=settings.batch_item_timeout)
+        if not task.done():
+            # cancelling the task would leave a sync endpoint running on its
+            # session after get_db closed it; the sub-request sees a disconnect
+            # and its queries are cancelled instead, and it unwinds on its own
+            metrics.inc("batch_sub_requests_timed_out")
+            timed_out.set()
+            scope["state"]["cancel_token"].cancel()
+            await asyncio.wait({task})
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning(
+                    "batch sub-request %s %s failed after timing out",
+                    item.method,
+                    item.path,
+                    exc_info=task.exception(),
+                )
+            return schemas.SubResponse(
+                id=item.id,
+                status=504,
+                headers={},
+                body={"detail": f"no response within {settings.batch_item_timeout}s"},
+            )
+        task.result()
+    except Exception:
+        # the app's error middleware re-raises after its 500, nothing else logs it
+        logger.exception("batch sub-request %s %s failed", item.method, item.path)
+        return schemas.SubResponse(
+            id=item.id,
+            status=500,
+            headers={},
+            body={"detail": "Internal Server Error"},
+        )
+
+    content: Any = response["body"].decode("utf-8", "replace")
+    if response["headers"].get("content-type", "").startswith("application/json"):
+        content = json.loads(content) if content else None
+    return schemas.SubResponse(
+        id=item.id,
+        status=response["status"],
+        headers=response["headers"],
+        body=content,
+    )
+
+
+@router.post("/", response_model=schemas.BatchResponse)
+async def run_batch(
+    batch: schemas.BatchRequest, request: Request
+) -> schemas.BatchResponse:
+    """
+    runs several API calls in one round trip, e.g.
+    {"requests": [{"id": "cart", "method": "GET", "path": "/cart/"},
+                  {"method": "GET", "path": "/products/?limit=20"}]}
+    consecutive reads run concurrently, a write waits for everything before it and
+    everything after it waits for the write, so results match sequential calls.
+    The Authorization header applies to every sub-request and is resolved once.
+    :param batch: sub-requests with method, path (including the query) and json body
+    :param request: batch request
+    :return: per sub-request status, headers and body, in request order
+    """
+    items = batch.requests
+    if len(items) > settings.batch_max_requests:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"at most {settings.batch_max_requests} requests can be batched",
+        )
+    for item in items:
+        item.method = item.method.upper()
+
+    shared_user = None
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        user = await run_on("db", oauth2.get_detached_user, token)
+        shared_user = (token, user) if user is not None else None
+
+    # a disconnect of the batch client reaches every running sub-request
+    disconnected = asyncio.Event()
+    cancel_token = request.scope.get("state", {}).get("cancel_token")
+    if cancel_token is not None:
+        cancel_token.register(disconnected, disconnected.set)
+
+    limit = asyncio.Semaphore(settings.batch_concurrency)
+
+    async def run(item: schemas.SubRequest) -> schemas.SubResponse:
+        async with limit:
+            return await dispatch(request, item, shared_user, disconnected)
+
+    responses: List[schemas.SubResponse] = []
+    try:
+        reads: List[schemas.SubRequest] = []
+        for item in items + [None]:
+            if item is not None and item.method in READ_METHODS:
+                reads.append(item)
+                continue
+            responses.extend(await asyncio.gather(*map(run, reads)))
+            reads = []
+            if item is not None:
+                responses.append(await run(item))
+    finally:
+        if cancel_token is not None:
+            cancel_token.unregister(disconnected)
+    return schemas.BatchResponse(responses=responses)
@@ -1,30 +1,94 @@
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 # from sqlalchemy.sql.functions import func
 from .. import models, oauth2, schemas
-from ..database import get_db
+from ..database import get_db, statement_timeout
+from ..profiling import ProfiledRoute
+from ..sharding import CartSessions, get_cart_db
+
+router = APIRouter(
+    prefix="/cart",
+    tags=["Cart"],
+    # the user is resolved before get_db takes a db token
+    dependencies=[
+        Depends(oauth2.get_current_user),
+        Depends(statement_timeout("hot")),
+    ],
+    route_class=ProfiledRoute,
+)
+
 
-router = APIRouter(prefix="/cart", tags=["Cart"])
+def with_products(
+    items: List[models.Cart], db: Session
+) -> List[schemas.CartProductOut]:
+    """
+    attach the products to cart items with one query on the catalog db,
+    cart rows may live on a shard without the products table
+    :param items: cart items
+    :param db: SqlAlchemy db object of the catalog
+    :return: cart items with product details
+    """
+    product_ids = {item.product_id for item in items}
+    products = {
+        product.id: product
+        for product in db.query(models.Product).filter(
+            models.Product.id.in_(product_ids)
+        )
+    }
+    return [
+        schemas.CartProductOut(
+            id=item.id,
+            user_id=item.user_id,
+            product_id=item.product_id,
+            quantity=item.quantity,
+            product=products[item.product_id],
+        )
+        for item in items
+        if item.product_id in products
+    ]
+
+
+def cart_item_out(
+    product_id: int, item: Optional[models.Cart], db: Session
+) -> schemas.CartProductOut:
+    """
+    one cart item with its product
+    :param product_id: product id of the item
+    :param item: cart item, None if it was deleted meanwhile
+    :param db: SqlAlchemy db object of the catalog
+    :return: cart item with product details, 404 when the item or product is gone
+    """
+    items = with_products([item], db) if item is not None else []
+    if not items:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"product with id: {product_id} does not exist",
+        )
+    return items[0]
 
 
 @router.get("/", response_model=List[schemas.CartProductOut])
 def get_cart_items(
     db: Session = Depends(get_db),
+    carts: CartSessions = Depends(get_cart_db),
     current_user: object = Depends(oauth2.get_current_user),
 ) -> List[schemas.CartProductOut]:
     """
     get list of cart items
     :param db: SqlAlchemy db object
+    :param carts: cart db sessions by user
     :param current_user: current logged-in user
     :return: list of cart items for a logged in user
     """
+    cart_db = carts.for_user(current_user.id)
     cart_item = (
-        db.query(models.Cart).filter(models.Cart.user_id == current_user.id).all()
+        cart_db.query(models.Cart).filter(models.Cart.user_id == current_user.id).all()
     )
-    return cart_item
+    return with_products(cart_item, db)
 
 
 @router.post(
@@ -33,6 +97,7 @@ def get_cart_items(
 def add_item_to_cart(
     item: schemas.AddToCart,
     db: Session = Depends(get_db),
+    carts: CartSessions = Depends(get_cart_db),
     current_user: object = Depends(oauth2.get_current_user),
 ) -> schemas.CartProductOut:
     """
@@ -41,6 +106,7 @@ def add_item_to_cart(
     if the product is not already in the cart, then product is added to the cart
     :param item: items details: product_id, quantity
     :param db: SqlAlchemy db object
+    :param carts: cart db sessions by user
     :param current_user: current logged-in user
     :return: returns the added product
     """
@@ -57,7 +123,8 @@ def add_item_to_cart(
             detail=f"product with id: {item.product_id} does not exist",
         )
 
-    item_query = db.query(models.Cart).filter(
+    cart_db = carts.for_user(current_user.id)
+    item_query = cart_db.query(models.Cart).filter(
         models.Cart.product_id == item.product_id,
         models.Cart.user_id == current_user.id,
     )
@@ -77,27 +144,28 @@ def add_item_to_cart(
 
     else:
         new_item = models.Cart(user_id=current_user.id, **item.dict())
-        db.add(new_item)
-        db.commit()
-        db.refresh(new_item)
+        cart_db.add(new_item)
+        cart_db.commit()
+        cart_db.refresh(new_item)
         # return {"message": "Item added to Cart"}
-        return new_item
+        return cart_item_out(item.product_id, new_item, db)
 
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_post(
     product_id: int,
-    db: Session = Depends(get_db),
+    carts: CartSessions = Depends(get_cart_db),
     current_user: object = Depends(oauth2.get_current_user),
 ) -> Response:
     """
     delete product from the cart by product id
     :param product_id: product id
-    :param db: SqlAlchemy db object
+    :param carts: cart db sessions by user
     :param current_user: current logged-in user
     :return: status code
     """
-    item_query = db.query(models.Cart).filter(models.Cart.product_id == product_id)
+    cart_db = carts.for_user(current_user.id)
+    item_query = cart_db.query(models.Cart).filter(models.Cart.product_id == product_id)
 
     item = item_query.first()
 
@@ -114,7 +182,7 @@ def delete_post(
         )
 
     item_query.delete(synchronize_session=False)
-    db.commit()
+    cart_db.commit()
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -128,6 +196,7 @@ def update_cart(
     product_id: int,
     updated_item: schemas.UpdateCart,
     db: Session = Depends(get_db),
+    carts: CartSessions = Depends(get_cart_db),
     current_user: object = Depends(oauth2.get_current_user),
 ) -> schemas.CartProductOut:
     """
@@ -137,6 +206,7 @@ def update_cart(
     :param product_id: product id
     :param updated_item: product quantity to be updated
     :param db: SqlAlchemy db object
+    :param carts: cart db sessions by user
     :param current_user: current logged-in user
     :return: updated product
     """
@@ -146,7 +216,8 @@ def update_cart(
         .first()
     )
 
-    item_query = db.query(models.Cart).filter(
+    cart_db = carts.for_user(current_user.id)
+    item_query = cart_db.query(models.Cart).filter(
         models.Cart.product_id == product_id, models.Cart.user_id == current_user.id
     )
 
@@ -162,14 +233,21 @@ def update_cart(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to perform requested action",
         )
+    if product is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"product with id: {product_id} does not exist",
+        )
     if product.inventory_count < updated_item.quantity:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"Update quantity is greater than inventory quantity, Enter quantity below {product.inventory_count+1}",
         )
 
-    item_query.update(updated_item.dict(), synchronize_session=False)
+    item_query.update(
+        {**updated_item.dict(), "updated_at": func.now()}, synchronize_session=False
+    )
 
-    db.commit()
+    cart_db.commit()
 
-    return item_query.first()
+    return cart_item_out(product_id, item_query.first(), db)
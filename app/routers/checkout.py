@@ -1,59 +1,97 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
-from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 # from sqlalchemy.sql.functions import func
 from .. import models, oauth2
-from ..database import get_db
+from ..database import get_db, statement_timeout
+from ..orders import OrderPlaced, order_queue
+from ..profiling import ProfiledRoute
+from ..sharding import CartSessions, get_cart_db
 
-router = APIRouter(prefix="/checkout", tags=["Check-out"])
+router = APIRouter(
+    prefix="/checkout",
+    tags=["Check-out"],
+    # the user is resolved before get_db takes a db token
+    dependencies=[
+        Depends(oauth2.get_current_user),
+        Depends(statement_timeout("hot")),
+    ],
+    route_class=ProfiledRoute,
+)
 
 
 @router.post("/", status_code=status.HTTP_200_OK)
 def get_cart_items(
     db: Session = Depends(get_db),
+    carts: CartSessions = Depends(get_cart_db),
     current_user: object = Depends(oauth2.get_current_user),
 ) -> JSONResponse:
     """
-    mocks the check-out, checks the item in cart for the logged in user.
-    if there are products, then checks out and deletes the record from cart
+    checks out the items in cart for the logged in user.
+    if there are products, then writes the order with its items and deletes the records from cart
+    in a single transaction. history, stats and notifications are handed to the write-behind queue.
+    with cart sharding the order is committed before the cart rows are deleted on the shard.
     :param db: SqlAlchemy db object
+    :param carts: cart db sessions by user
     :param current_user: current logged-in user
     :return: json response with a message
     """
-    item_count = (
-        db.query(
-            models.Cart.user_id, func.count(models.Cart.product_id).label("no_products")
-        )
-        .group_by(models.Cart.user_id)
-        .filter(models.Cart.user_id == current_user.id)
-        .first()
-    )
-    # delete checkedout products in cart
     # TODO reduce the inventory quantity in product table
-    item_query = db.query(models.Cart).filter(models.Cart.user_id == current_user.id)
+    cart_db = carts.for_user(current_user.id)
+    item_query = cart_db.query(models.Cart).filter(
+        models.Cart.user_id == current_user.id
+    )
 
-    item = item_query.first()
+    # a concurrent checkout of the same cart waits here and then finds it empty,
+    # instead of placing a second order for the same lines
+    items = item_query.order_by(models.Cart.id).with_for_update().all()
 
-    if item is None:
+    if not items:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"No items in cart for user {current_user.username}",
         )
 
-    if item.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to perform requested action",
-        )
+    order = models.Order(user_id=current_user.id)
+    db.add(order)
+    db.flush()
+    order_id, ordered_at = order.id, order.created_at
+    db.bulk_insert_mappings(
+        models.OrderItem,
+        [
+            {
+                "order_id": order_id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+            }
+            for item in items
+        ],
+    )
+
+    # values needed after commit, read before the session expires them
+    user_id = current_user.id
+    lines = [(item.product_id, item.quantity) for item in items]
 
+    # delete checkedout products in cart
     item_query.delete(synchronize_session=False)
     db.commit()
+    if cart_db is not db:
+        cart_db.commit()
+
+    order_queue.put(
+        OrderPlaced(
+            order_id=order_id,
+            user_id=user_id,
+            items=lines,
+            ordered_at=ordered_at,
+        )
+    )
 
     return JSONResponse(
         content={
-            "message": f"{item_count.no_products} products checked out for user {item_count.user_id}"
+            "message": f"{len(items)} products checked out for user {user_id}",
+            "order_id": order_id,
         },
         status_code=status.HTTP_200_OK,
     )
@@ -0,0 +1,119 @@
+import asyncio
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from .. import oauth2
+from ..config import settings
+from ..profiling import (
+    ProfiledRoute,
+    collapsed,
+    render_stats,
+    request_profiles,
+    sampling_profiler,
+)
+from ..threadpool import run_on
+
+router = APIRouter(prefix="/debug", tags=["Debug"], route_class=ProfiledRoute)
+
+SORT_KEYS = {"cumulative", "tottime", "calls", "ncalls", "time"}
+
+
+def check_admin(current_user: object) -> None:
+    if "invadmin" != current_user.username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to perform requested action",
+        )
+
+
+# async and without a db session: sampling blocks a thread for up to
+# profiling_max_seconds, which must hold neither a pooled connection nor a token of
+# the db or cpu limiters
+@router.get("/profile", response_class=PlainTextResponse)
+async def sample_worker(
+    seconds: float = 10.0,
+    interval: float = 0.005,
+    token: str = Depends(oauth2.oauth2_scheme),
+) -> PlainTextResponse:
+    """
+    samples the stacks of all threads of the worker serving this call, e.g.
+    curl .. /debug/profile?seconds=30 | flamegraph.pl > worker.svg
+    :param seconds: how long to sample, at most profiling_max_seconds
+    :param interval: seconds between two samples
+    :param token: JWT token of the admin
+    :return: collapsed stacks, one "thread;frame;..;frame samples" per line
+    """
+    # looked up on a session of its own, closed before sampling starts
+    current_user = await run_on("db", oauth2.get_detached_user, token)
+    if current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    check_admin(current_user)
+    if not 0 < seconds <= settings.profiling_max_seconds or interval < 0.001:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds must be within (0, {settings.profiling_max_seconds}] and interval at least 0.001",
+        )
+    stacks = None
+    if not sampling_profiler.running:
+        # asyncio's own executor, outside the anyio limiters of the endpoints
+        stacks = await asyncio.get_running_loop().run_in_executor(
+            None, sampling_profiler.run, seconds, interval
+        )
+    if stacks is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="a profile is already running on this worker",
+        )
+    return PlainTextResponse(collapsed(stacks))
+
+
+@router.get("/requests", response_model=List[Dict[str, Any]])
+def list_request_profiles(
+    current_user: object = Depends(oauth2.get_current_user),
+) -> List[Dict[str, Any]]:
+    """
+    requests profiled on this worker (sent with an X-Profile header), newest first
+    :param current_user: current logged-in user
+    :return: id, method, path, status and duration of each profile
+    """
+    check_admin(current_user)
+    return request_profiles.list()
+
+
+@router.get(
+    "/requests/{profile_id}",
+    response_class=PlainTextResponse,
+)
+def get_request_profile(
+    profile_id: str,
+    sort: str = "cumulative",
+    limit: int = 50,
+    current_user: object = Depends(oauth2.get_current_user),
+) -> PlainTextResponse:
+    """
+    cProfile stats of one request
+    :param profile_id: X-Profile-Id of the response
+    :param sort: pstats sort key, cumulative, tottime or calls
+    :param limit: number of functions listed
+    :param current_user: current logged-in user
+    :return: pstats report
+    """
+    check_admin(current_user)
+    entry = request_profiles.get(profile_id)
+    if entry is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"profile {profile_id} was not found on this worker",
+        )
+    if sort not in SORT_KEYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"sort must be one of {', '.join(sorted(SORT_KEYS))}",
+        )
+    return PlainTextResponse(render_stats(entry["profile"], sort, limit))
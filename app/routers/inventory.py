@@ -1,22 +1,48 @@
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 # from sqlalchemy.sql.functions import func
 from .. import models, oauth2, schemas
-from ..database import get_db
+from ..adjustments import (
+    adjustment_results,
+    apply_adjustments,
+    net_deltas,
+    publish_counts,
+    queue_adjustments,
+)
+from ..autocomplete import autocomplete_index, index_product
+from ..cache import invalidate_catalog
+from ..config import settings
+from ..counts import products_total, set_total_count
+from ..database import get_db, statement_timeout
+from ..fieldsets import parse_fields, projected_columns, serialize
+from ..profiling import ProfiledRoute
+from ..stock_hub import stock_hub
 
-router = APIRouter(prefix="/inventory", tags=["Inventory"])
+router = APIRouter(
+    prefix="/inventory",
+    tags=["Inventory"],
+    # the user is resolved before get_db takes a db token
+    dependencies=[
+        Depends(oauth2.get_current_user),
+        Depends(statement_timeout("admin")),
+    ],
+    route_class=ProfiledRoute,
+)
 
 
 @router.get("/", response_model=List[schemas.InventoryProduct])
 def get_products(
+    response: Response,
     db: Session = Depends(get_db),
     current_user: object = Depends(oauth2.get_current_user),
     limit: int = 10,
     skip: int = 0,
     search: Optional[str] = "",
+    fields: Optional[str] = None,
 ) -> List[schemas.InventoryProduct]:
     """
     gets all products in the inventory
@@ -24,7 +50,9 @@ def get_products(
     :param current_user: current logged-in user
     :param limit: limit number of products
     :param skip: offset/ omit a specified number of rows before the beginning of the result
+    :param fields: comma separated fields to return, e.g. id,name,category
     :param search: list of products
+    :param response: carries X-Total-Count, exact below exact_count_threshold matches
     :return: list of products in inventory
     """
     if "invadmin" != current_user.username:
@@ -32,14 +60,23 @@ def get_products(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to perform requested action",
         )
+    projection = parse_fields(fields, schemas.InventoryProduct)
+    columns = projected_columns(models.Product, projection)
     products = (
-        db.query(models.Product)
+        db.query(*columns)
         .group_by(models.Product.id)
         .filter(models.Product.name.contains(search))
         .limit(limit)
         .offset(skip)
         .all()
     )
+    if projection:
+        response = JSONResponse(
+            content=serialize(products, schemas.InventoryProduct, projection)
+        )
+    set_total_count(response, products_total(db, search))
+    if projection:
+        return response
     return products
 
 
@@ -67,21 +104,113 @@ def create_product(
     db.add(new_product)
     db.commit()
     db.refresh(new_product)
+    invalidate_catalog()
+    index_product(new_product)
 
     return new_product
 
 
+@router.post(
+    "/adjustments",
+    response_model=schemas.AdjustmentResult,
+    responses={
+        status.HTTP_202_ACCEPTED: {
+            "model": schemas.AdjustmentQueued,
+            "description": "queued with coalesce, see GET /inventory/adjustments/{id}",
+        }
+    },
+)
+def adjust_stock(
+    batch: schemas.InventoryAdjustments,
+    db: Session = Depends(get_db),
+    current_user: object = Depends(oauth2.get_current_user),
+) -> schemas.AdjustmentResult:
+    """
+    adds deltas to the inventory_count of products, e.g. restocks and warehouse
+    corrections; concurrent adjustments of the same product add up
+    :param batch: (product_id, delta) pairs, deltas of the same product are summed.
+    With coalesce the call returns 202 and an id once queued; the adjustments of
+    all calls within inventory_adjustment_window are written together, each call
+    checked on its own in the order they were queued
+    :param db: SqlAlchemy db object
+    :param current_user: current logged-in user
+    :return: new counts, and the products which do not exist or would go below zero
+    or past the int4 range
+    """
+    if "invadmin" != current_user.username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to perform requested action",
+        )
+    if len(batch.adjustments) > settings.inventory_adjustment_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"at most {settings.inventory_adjustment_max_items} adjustments can be sent at once",
+        )
+    deltas = net_deltas((item.product_id, item.delta) for item in batch.adjustments)
+    if batch.coalesce:
+        adjustment_id = queue_adjustments(deltas)
+        if adjustment_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="too many pending adjustments, retry later",
+            )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"id": adjustment_id, "queued": len(deltas)},
+        )
+
+    counts = apply_adjustments(db, deltas)
+    db.commit()
+    publish_counts(counts)
+    return {
+        "adjusted": [
+            {"product_id": product_id, "inventory_count": count}
+            for product_id, count in sorted(counts.items())
+        ],
+        "rejected": sorted(set(deltas) - set(counts)),
+    }
+
+
+@router.get("/adjustments/{id}", response_model=schemas.AdjustmentStatus)
+def get_adjustment_status(
+    id: str,
+    current_user: object = Depends(oauth2.get_current_user),
+) -> schemas.AdjustmentStatus:
+    """
+    outcome of a coalesced adjustment call; kept by the worker which queued it for
+    the last inventory_adjustment_results calls
+    :param id: id returned with the 202
+    :param current_user: current logged-in user
+    :return: status, new counts and the rejected products of the call
+    """
+    if "invadmin" != current_user.username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to perform requested action",
+        )
+    result = adjustment_results.get(id)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"adjustment with id: {id} was not found",
+        )
+    return result
+
+
 @router.get("/{id}", response_model=schemas.InventoryProduct)
 def get_product_by_id(
     id: int,
     db: Session = Depends(get_db),
     current_user: object = Depends(oauth2.get_current_user),
+    fields: Optional[str] = None,
 ) -> schemas.InventoryProduct:
     """
     return product by id
     :param id: product id of the product
     :param db: SqlAlchemy db object
     :param current_user: current logged-in user
+    :param fields: comma separated fields to return, e.g. id,name,inventory_count
     :return: returns product which matched the product id
     """
     if "invadmin" != current_user.username:
@@ -89,12 +218,18 @@ def get_product_by_id(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to perform requested action",
         )
-    product = db.query(models.Product).filter(models.Product.id == id).first()
+    projection = parse_fields(fields, schemas.InventoryProduct)
+    columns = projected_columns(models.Product, projection)
+    product = db.query(*columns).filter(models.Product.id == id).first()
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"product with id: {id} was not found",
         )
+    if projection:
+        return JSONResponse(
+            content=serialize(product, schemas.InventoryProduct, projection)
+        )
     return product
 
 
@@ -128,6 +263,9 @@ def delete_product(
 
     product_query.delete(synchronize_session=False)
     db.commit()
+    invalidate_catalog()
+    autocomplete_index.remove_product(id)
+    stock_hub.publish(id, None)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -169,5 +307,9 @@ def update_product(
     product_query.update(updated_product.dict(), synchronize_session=False)
 
     db.commit()
+    invalidate_catalog()
 
-    return product_query.first()
+    product = product_query.first()
+    index_product(product)
+    stock_hub.publish(id, product.inventory_count)
+    return product
@@ -1,44 +1,72 @@
 from typing import Dict, List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import Integer, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
 
 # from sqlalchemy import func
 # from sqlalchemy.sql.functions import func
 from .. import models, schemas
-from ..database import get_db
+from ..autocomplete import autocomplete_index
+from ..config import settings
+from ..counts import products_total, set_total_count
+from ..database import get_db, statement_timeout
+from ..fieldsets import parse_fields, projected_columns, serialize
 from ..models import Product
+from ..profiling import ProfiledRoute
+from ..recommendations import related_index
 
-router = APIRouter(prefix="/products", tags=["Products"])
+router = APIRouter(prefix="/products", tags=["Products"], route_class=ProfiledRoute)
 
+# listings and searches may scan, lookups by id are on the hot path
+search_timeout = [Depends(statement_timeout("search"))]
+hot_timeout = [Depends(statement_timeout("hot"))]
 
-@router.get("/", response_model=List[schemas.Product])
+
+@router.get("/", response_model=List[schemas.Product], dependencies=search_timeout)
 def get_all_products(
+    response: Response,
     db: Session = Depends(get_db),
     limit: int = 10,
     skip: int = 0,
     search: Optional[str] = "",
+    fields: Optional[str] = None,
 ) -> List[schemas.Product]:
     """
     List all the products
     :param db: SqlAlchemy db object
     :param limit: limit number of products
     :param skip: offset/ omit a specified number of rows before the beginning of the result
+    :param fields: comma separated fields to return, e.g. id,name,category
     :param search: search based on product name
+    :param response: carries X-Total-Count, exact below exact_count_threshold matches
     :return: list of products
     """
+    projection = parse_fields(fields, schemas.Product)
+    columns = projected_columns(models.Product, projection)
     products = (
-        db.query(models.Product)
+        db.query(*columns)
         .group_by(models.Product.id)
         .filter(models.Product.name.contains(search))
         .limit(limit)
         .offset(skip)
         .all()
     )
+    if projection:
+        response = JSONResponse(
+            content=serialize(products, schemas.Product, projection)
+        )
+    set_total_count(response, products_total(db, search))
+    if projection:
+        return response
     return products
 
 
-@router.get("/category/all", response_model=Dict[str, List[str]])
+@router.get(
+    "/category/all", response_model=Dict[str, List[str]], dependencies=search_timeout
+)
 def get_all_category(db: Session = Depends(get_db)) -> Dict[str, List[List[Product]]]:
     """
     return the list of all product categories
@@ -55,14 +83,19 @@ def get_all_category(db: Session = Depends(get_db)) -> Dict[str, List[List[Produ
     return {"category": category_l}
 
 
-@router.get("/category/{category_name}", response_model=List[schemas.Product])
+@router.get(
+    "/category/{category_name}",
+    response_model=List[schemas.Product],
+    dependencies=search_timeout,
+)
 def get_products_by_category(
-    category_name: str, db: Session = Depends(get_db)
+    category_name: str, response: Response, db: Session = Depends(get_db)
 ) -> List[schemas.Product]:
     """
     return the list of all product for the specified category
     :return:
     :param category_name: name of the category
+    :param response: carries X-Total-Count, the number of products returned
     :param db: SqlAlchemy db object
     :return: List of product category
     """
@@ -77,11 +110,17 @@ def get_products_by_category(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Products with category: {category_name} was not found",
         )
+    # the listing is not paginated, the total is its length
+    set_total_count(response, (len(category), True))
 
     return category
 
 
-@router.get("/sub_category/{sub_category_name}", response_model=List[schemas.Product])
+@router.get(
+    "/sub_category/{sub_category_name}",
+    response_model=List[schemas.Product],
+    dependencies=search_timeout,
+)
 def get_products_by_sub_category(
     sub_category_name: str, db: Session = Depends(get_db)
 ) -> List[schemas.Product]:
@@ -107,7 +146,11 @@ def get_products_by_sub_category(
     return sub_category
 
 
-@router.get("/sub_category", response_model=Dict[str, Union[str, List[str]]])
+@router.get(
+    "/sub_category",
+    response_model=Dict[str, Union[str, List[str]]],
+    dependencies=search_timeout,
+)
 def get_sub_category_for_category(
     category: str = "", db: Session = Depends(get_db)
 ) -> Dict[str, Union[str, List[str]]]:
@@ -133,18 +176,118 @@ def get_sub_category_for_category(
     return {"category": category, "sub_category": sub_category_l}
 
 
-@router.get("/{id}", response_model=schemas.Product)
-def get_product_by_id(id: int, db: Session = Depends(get_db)) -> schemas.Product:
+# async on purpose: served from the in-memory prefix index, never touches postgres
+@router.get("/autocomplete", response_model=List[schemas.Suggestion])
+async def autocomplete(q: str = "", limit: int = 10) -> List[schemas.Suggestion]:
+    """
+    search-as-you-type suggestions over product names, manufacturers, categories
+    and sub-categories, most ordered first
+    :param q: prefix typed so far
+    :param limit: max number of suggestions
+    :return: list of suggestions
+    """
+    return [
+        schemas.Suggestion(kind=kind, text=text, product_id=product_id)
+        for kind, text, product_id in autocomplete_index.search(q, limit)
+    ]
+
+
+def get_products_in_order(ids: List[int], db: Session) -> schemas.ProductBatch:
+    """
+    resolve a list of product ids with a single query
+    :param ids: product ids, duplicates are returned once
+    :param db: SqlAlchemy db object
+    :return: products in the order of the requested ids and the ids which were not found
+    """
+    if len(ids) > settings.product_batch_max_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"at most {settings.product_batch_max_ids} product ids can be requested at once",
+        )
+    ids = list(dict.fromkeys(ids))
+    found = {}
+    if ids:
+        # one array parameter keeps the statement text identical for any number of ids
+        products = (
+            db.query(models.Product)
+            .filter(
+                models.Product.id == any_(bindparam("ids", ids, type_=ARRAY(Integer)))
+            )
+            .all()
+        )
+        found = {product.id: product for product in products}
+
+    return schemas.ProductBatch(
+        products=[found[i] for i in ids if i in found],
+        missing=[i for i in ids if i not in found],
+    )
+
+
+@router.get("/batch", response_model=schemas.ProductBatch, dependencies=hot_timeout)
+def get_products_batch(
+    ids: List[int] = Query([]), db: Session = Depends(get_db)
+) -> schemas.ProductBatch:
+    """
+    return several products by id in one round trip, ids are passed as ?ids=1&ids=2
+    :param ids: product ids
+    :param db: SqlAlchemy db object
+    :return: products in request order and the missing ids
+    """
+    return get_products_in_order(ids, db)
+
+
+@router.post("/batch", response_model=schemas.ProductBatch, dependencies=hot_timeout)
+def post_products_batch(
+    product_ids: schemas.ProductIds, db: Session = Depends(get_db)
+) -> schemas.ProductBatch:
+    """
+    return several products by id in one round trip, ids are passed in the body
+    :param product_ids: product ids
+    :param db: SqlAlchemy db object
+    :return: products in request order and the missing ids
+    """
+    return get_products_in_order(product_ids.ids, db)
+
+
+@router.get("/{id}", response_model=schemas.Product, dependencies=hot_timeout)
+def get_product_by_id(
+    id: int, db: Session = Depends(get_db), fields: Optional[str] = None
+) -> schemas.Product:
     """
     return product by id
     :param id: product id of the product
+    :param fields: comma separated fields to return, e.g. id,name,category
     :param db: SqlAlchemy db object
     :return: Product with all the product details
     """
-    product = db.query(models.Product).filter(models.Product.id == id).first()
+    projection = parse_fields(fields, schemas.Product)
+    columns = projected_columns(models.Product, projection)
+    product = db.query(*columns).filter(models.Product.id == id).first()
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"product with id: {id} was not found",
         )
+    if projection:
+        return JSONResponse(content=serialize(product, schemas.Product, projection))
     return product
+
+
+# async on purpose: the lookup is an in-memory dict access, no threadpool hop needed
+@router.get("/{id}/related", response_model=schemas.RelatedProducts)
+async def get_related_products(
+    id: int, limit: int = Query(10, ge=1, le=settings.related_top_k)
+) -> schemas.RelatedProducts:
+    """
+    return the products most frequently bought together with the given product
+    :param id: product id of the product
+    :param limit: max number of related products, 1 to related_top_k
+    :return: related product ids with the number of orders they shared
+    """
+    return schemas.RelatedProducts(
+        product_id=id,
+        related=[
+            schemas.RelatedProduct(product_id=product_id, score=score)
+            for product_id, score in related_index.related(id, limit)
+        ],
+    )
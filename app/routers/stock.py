@@ -0,0 +1,104 @@
+import asyncio
+import json
+from typing import AsyncIterator, List
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.websockets import WebSocketDisconnect
+
+from ..config import settings
+from ..stock_hub import Subscription, current_stock, stock_hub
+from ..threadpool import run_on
+
+# async on purpose: connections stay open for minutes, a thread per client would
+# exhaust the threadpool; the db is only touched for the initial snapshot
+router = APIRouter(prefix="/stock", tags=["Stock"])
+
+
+def check_ids(ids: List[int]) -> List[int]:
+    """
+    :param ids: product ids to watch
+    :return: ids without duplicates
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > settings.stock_stream_max_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"between 1 and {settings.stock_stream_max_ids} product ids can be watched",
+        )
+    return ids
+
+
+async def stock_changes(subscription: Subscription) -> AsyncIterator[List[dict]]:
+    """
+    the current stock first, then coalesced changes; an empty list every
+    stock_stream_heartbeat seconds without changes
+    """
+    counts = await run_on("db", current_stock, subscription.ids)
+    yield subscription.snapshot(counts)
+    while True:
+        yield await subscription.next(settings.stock_stream_heartbeat)
+
+
+@router.get("/stream")
+async def stream_stock(ids: List[int] = Query([])) -> StreamingResponse:
+    """
+    server sent events with the inventory_count of the given products, ids are passed
+    as ?ids=1&ids=2. Every `stock` event carries a list of
+    {product_id, inventory_count, delta}, inventory_count is null for deleted products
+    :param ids: product ids to watch
+    :return: text/event-stream
+    """
+    ids = check_ids(ids)
+
+    async def events() -> AsyncIterator[str]:
+        subscription = stock_hub.subscribe(ids)
+        try:
+            async for changes in stock_changes(subscription):
+                if changes:
+                    yield f"event: stock\ndata: {json.dumps(changes)}\n\n"
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            stock_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def websocket_stock(websocket: WebSocket, ids: List[int] = Query([])) -> None:
+    """
+    same messages as /stock/stream as json text frames over a websocket
+    :param websocket: client connection
+    :param ids: product ids to watch, ?ids=1&ids=2
+    """
+    try:
+        ids = check_ids(ids)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = stock_hub.subscribe(ids)
+
+    async def send_changes() -> None:
+        try:
+            async for changes in stock_changes(subscription):
+                await websocket.send_json(changes)
+        except (OSError, RuntimeError, SQLAlchemyError):
+            await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+
+    sender = asyncio.ensure_future(send_changes())
+    try:
+        # the client does not send anything, receive() only notices the disconnect
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        stock_hub.unsubscribe(subscription)
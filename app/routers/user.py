@@ -2,33 +2,48 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 from .. import models, schemas, utils
-from ..database import get_db
+from ..database import get_db, statement_timeout, task_session
+from ..profiling import ProfiledRoute
+from ..threadpool import run_on
 
 # from psycopg2 import connection
 
-router = APIRouter(prefix="/users", tags=["Users"])
+router = APIRouter(
+    prefix="/users",
+    tags=["Users"],
+    dependencies=[Depends(statement_timeout("hot"))],
+    route_class=ProfiledRoute,
+)
 
 
+def add_user(user: schemas.UserCreate) -> models.User:
+    """insert the user on a short session of its own, run with run_on("db", ..)"""
+    db = task_session("hot")
+    try:
+        new_user = models.User(**user.dict())
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+        db.expunge(new_user)
+        return new_user
+    finally:
+        db.close()
+
+
+# async and without get_db: the password is hashed on the cpu limiter before a db
+# token is taken for the insert
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserOut)
-def create_user(
-    user: schemas.UserCreate, db: Session = Depends(get_db)
-) -> schemas.UserOut:  # conn= Depends(get_db)
+async def create_user(user: schemas.UserCreate) -> schemas.UserOut:
     """
     creates new user
     :param user: username, password
-    :param db: SqlAlchemy db object
     :return: created user: id, username, created_at
     """
     # hash the password - user.password
-    hashed_password = utils.get_hash(user.password)
+    hashed_password = await run_on("cpu", utils.get_hash, user.password)
     user.password = hashed_password
 
-    new_user = models.User(**user.dict())
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-
-    return new_user
+    return await run_on("db", add_user, user)
 
     # Demo: create user with raw sql
     # cursor = conn.cursor()
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, conint
 
 
 class UserOut(BaseModel):
@@ -54,6 +54,53 @@ class Product(BaseModel):
         orm_mode = True
 
 
+class ProductIds(BaseModel):
+    ids: List[int]
+
+
+class ProductBatch(BaseModel):
+    products: List[Product]
+    missing: List[int]
+
+
+class RelatedProduct(BaseModel):
+    product_id: int
+    score: int
+
+
+class RelatedProducts(BaseModel):
+    product_id: int
+    related: List[RelatedProduct]
+
+
+class Suggestion(BaseModel):
+    text: str
+    kind: str
+    product_id: Optional[int] = None
+
+
+class SubRequest(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    path: str
+    body: Optional[Any] = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[SubRequest]
+
+
+class SubResponse(BaseModel):
+    id: Optional[str] = None
+    status: int
+    headers: Dict[str, str]
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    responses: List[SubResponse]
+
+
 class InventoryProduct(BaseModel):
     id: int
     name: str
@@ -71,6 +118,38 @@ class InventoryProduct(BaseModel):
         orm_mode = True
 
 
+class InventoryAdjustment(BaseModel):
+    product_id: int
+    # inventory_count is an int4
+    delta: conint(ge=-(2**31), le=2**31 - 1)
+
+
+class InventoryAdjustments(BaseModel):
+    adjustments: List[InventoryAdjustment]
+    coalesce: bool = False
+
+
+class AdjustedStock(BaseModel):
+    product_id: int
+    inventory_count: int
+
+
+class AdjustmentResult(BaseModel):
+    adjusted: List[AdjustedStock]
+    rejected: List[int]
+
+
+class AdjustmentQueued(BaseModel):
+    id: str
+    queued: int
+
+
+class AdjustmentStatus(AdjustmentResult):
+    id: str
+    # queued, applied or failed
+    status: str
+
+
 class Cart(BaseModel):
     id: int
     user_id: int
@@ -0,0 +1,483 @@
+import argparse
+import io
+import itertools
+import logging
+import multiprocessing
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+import psycopg2
+from sqlalchemy.engine import make_url
+
+from . import utils
+from .database import SQLALCHEMY_DATABASE_URL
+from .sharding import cart_shards
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_SALT_CHARS = "./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+COUNTRIES = ["india", "china", "usa", "japan", "taiwan", "uk", "germany", "vietnam"]
+WORDS = ["pro", "max", "mini", "air", "plus", "lite", "ultra", "neo", "one", "go"]
+
+PRODUCT_COLUMNS = (
+    "id",
+    "name",
+    "manufacturer",
+    "supplier",
+    "category",
+    "sub_category",
+    "country_of_origin",
+    "inventory_count",
+)
+USER_COLUMNS = ("id", "username", "password")
+CART_COLUMNS = (
+    "id",
+    "user_id",
+    "product_id",
+    "quantity",
+    "created_at",
+    "updated_at",
+)
+# cart line ids are (user_id - 1) * MAX_CART_LINES + line, the same in every run
+MAX_CART_LINES = 50
+# every table referencing products or users, emptied together by --truncate
+TRUNCATE_MAIN = (
+    "TRUNCATE products, users, cart, orders, order_items, order_history, "
+    "product_stats RESTART IDENTITY"
+)
+# ids and timestamps only depend on the arguments, so a seed gives the same rows
+FIRST_PRODUCT_ID = 1
+FIRST_USER_ID = 1
+DEFAULT_AS_OF = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class SeedConfig(NamedTuple):
+    seed: int
+    products: int
+    users: int
+    categories: int
+    skew: float
+    cart_share: float
+    mean_cart_size: float
+    first_product_id: int
+    first_user_id: int
+    as_of: datetime
+
+
+class Catalog(NamedTuple):
+    """category tree and manufacturers with their zipf cumulative weights"""
+
+    categories: List[str]
+    category_weights: List[float]
+    sub_categories: Dict[str, List[str]]
+    manufacturers: List[str]
+    manufacturer_weights: List[float]
+
+
+def zipf_cumulative(n: int, skew: float) -> List[float]:
+    """cumulative weights of ranks 1..n with P(k) ~ 1 / k^skew"""
+    return list(itertools.accumulate(1 / k**skew for k in range(1, n + 1)))
+
+
+def make_catalog(config: SeedConfig) -> Catalog:
+    rng = random.Random(f"{config.seed}:catalog")
+    categories = [f"category-{i:03d}" for i in range(config.categories)]
+    manufacturers = [f"brand-{i:04d}" for i in range(max(config.categories * 10, 10))]
+    return Catalog(
+        categories=categories,
+        category_weights=zipf_cumulative(len(categories), config.skew),
+        sub_categories={
+            c: [f"{c}-sub-{j:02d}" for j in range(rng.randint(2, 12))]
+            for c in categories
+        },
+        manufacturers=manufacturers,
+        manufacturer_weights=zipf_cumulative(len(manufacturers), config.skew),
+    )
+
+
+def product_rows(
+    config: SeedConfig, catalog: Catalog, chunk: int, start: int, count: int
+) -> Iterator[tuple]:
+    """products start .. start + count - 1, the same for a given seed and chunk"""
+    rng = random.Random(f"{config.seed}:products:{chunk}")
+    categories = rng.choices(
+        catalog.categories, cum_weights=catalog.category_weights, k=count
+    )
+    manufacturers = rng.choices(
+        catalog.manufacturers, cum_weights=catalog.manufacturer_weights, k=count
+    )
+    for product_id, category, manufacturer in zip(
+        range(start, start + count), categories, manufacturers
+    ):
+        yield (
+            product_id,
+            f"{manufacturer} {rng.choice(WORDS)} {product_id}",
+            manufacturer,
+            f"supplier-{rng.randrange(200):03d}",
+            category,
+            rng.choice(catalog.sub_categories[category]),
+            rng.choice(COUNTRIES),
+            rng.randint(0, 500),
+        )
+
+
+def password_pool(seed: int, size: int) -> List[str]:
+    """
+    bcrypt hashes of password0 .. password<size-1> with salts derived from the
+    seed; hashing is the slow part of creating users, so users share this pool
+    """
+    rng = random.Random(f"{seed}:passwords")
+    bcrypt = utils.pwd_context.handler("bcrypt")
+    hashes = []
+    for i in range(size):
+        # the last salt character only carries 2 bits in bcrypt
+        salt = "".join(rng.choices(BCRYPT_SALT_CHARS, k=21)) + rng.choice(".Oeu")
+        hashes.append(bcrypt.using(salt=salt).hash(f"password{i}"))
+    return hashes
+
+
+def user_rows(
+    config: SeedConfig, passwords: Sequence[str], start: int, count: int
+) -> Iterator[tuple]:
+    """users start .. start + count - 1, user<id> logs in with password<id % pool>"""
+    for user_id in range(start, start + count):
+        yield user_id, f"user{user_id}", passwords[user_id % len(passwords)]
+
+
+def cart_rows(
+    config: SeedConfig, chunk: int, start: int, count: int
+) -> Iterator[tuple]:
+    """
+    carts of users start .. start + count - 1: cart_share of the users have one,
+    with a geometric number of lines and a bias towards low (popular) product ids;
+    the last activity is spread over the 60 days before as_of
+    """
+    rng = random.Random(f"{config.seed}:carts:{chunk}")
+    for user_id in range(start, start + count):
+        if rng.random() >= config.cart_share:
+            continue
+        size = 1
+        while size < MAX_CART_LINES and rng.random() > 1 / config.mean_cart_size:
+            size += 1
+        product_ids = {
+            config.first_product_id + int(config.products * rng.random() ** 3)
+            for _ in range(size)
+        }
+        created = config.as_of - timedelta(seconds=rng.randrange(60 * 24 * 3600))
+        for line, product_id in enumerate(sorted(product_ids), start=1):
+            updated = created + timedelta(seconds=rng.randrange(3 * 24 * 3600))
+            yield (
+                (user_id - 1) * MAX_CART_LINES + line,
+                user_id,
+                product_id,
+                rng.randint(1, 3),
+                created.isoformat(),
+                min(updated, config.as_of).isoformat(),
+            )
+
+
+def copy_text(rows: Iterable[tuple]) -> io.StringIO:
+    """rows in the text format of COPY FROM STDIN"""
+
+    def escape(value: Any) -> str:
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(map(escape, row)))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def dsn(url: str) -> str:
+    """libpq connection string of a sqlalchemy url"""
+    return (
+        make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+    )
+
+
+def disable_triggers(conn: Any) -> bool:
+    """
+    skip the per row NOTIFY (cache invalidation) and foreign key triggers for the
+    session; needs superuser
+    :return: False if the triggers still run
+    """
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("SET session_replication_role = replica")
+        except psycopg2.Error:
+            conn.rollback()
+            return False
+    conn.commit()
+    return True
+
+
+# one connection per worker process and database
+_connections: Dict[str, Any] = {}
+
+
+def _connection(url: str) -> Any:
+    conn = _connections.get(url)
+    if conn is None:
+        conn = _connections[url] = psycopg2.connect(dsn(url))
+        if not disable_triggers(conn):
+            if not _state["allow_triggers"]:
+                raise RuntimeError(f"cannot disable triggers on {url}")
+            logger.warning("cannot disable triggers on %s, loading with them", url)
+    return conn
+
+
+def _copy(url: str, table: str, columns: Sequence[str], rows: Iterable[tuple]) -> int:
+    buffer = copy_text(rows)
+    conn = _connection(url)
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+        count = cursor.rowcount
+    conn.commit()
+    return count
+
+
+# seed configuration of a worker process, set by the pool initializer
+_state: Dict[str, Any] = {}
+
+
+class Task(NamedTuple):
+    table: str
+    chunk: int
+    start: int
+    count: int
+
+
+def load_chunk(task: Task) -> int:
+    """generate and COPY one chunk, runs in a worker process"""
+    config, catalog, passwords = (
+        _state["config"],
+        _state["catalog"],
+        _state["passwords"],
+    )
+    if task.table == "products":
+        rows = product_rows(config, catalog, task.chunk, task.start, task.count)
+        return _copy(SQLALCHEMY_DATABASE_URL, "products", PRODUCT_COLUMNS, rows)
+    if task.table == "users":
+        rows = user_rows(config, passwords, task.start, task.count)
+        return _copy(SQLALCHEMY_DATABASE_URL, "users", USER_COLUMNS, rows)
+
+    # carts go to the shard of their user when cart sharding is enabled
+    by_url: Dict[str, List[tuple]] = {}
+    for row in cart_rows(config, task.chunk, task.start, task.count):
+        url = (
+            cart_shards.urls[cart_shards.shard_of(row[1])]
+            if cart_shards.enabled
+            else SQLALCHEMY_DATABASE_URL
+        )
+        by_url.setdefault(url, []).append(row)
+    return sum(_copy(url, "cart", CART_COLUMNS, rows) for url, rows in by_url.items())
+
+
+def _init_worker(
+    config: SeedConfig, catalog: Catalog, passwords: List[str], allow_triggers: bool
+) -> None:
+    _state.update(
+        config=config,
+        catalog=catalog,
+        passwords=passwords,
+        allow_triggers=allow_triggers,
+    )
+
+
+def tasks(table: str, first_id: int, total: int, chunk_size: int) -> List[Task]:
+    return [
+        Task(table, chunk, first_id + offset, min(chunk_size, total - offset))
+        for chunk, offset in enumerate(range(0, total, chunk_size))
+    ]
+
+
+def check_target(
+    urls: Sequence[str], allow_triggers: bool, truncate: bool = False
+) -> List[str]:
+    """
+    :param urls: cart databases, the main one holds products and users
+    :param allow_triggers: load even where triggers cannot be disabled
+    :param truncate: the tables are emptied before the load
+    :return: problems which stop the load: tables which already hold rows (the
+    seed uses fixed id ranges) and databases where triggers cannot be disabled
+    """
+    problems = []
+    for url in dict.fromkeys([SQLALCHEMY_DATABASE_URL, *urls]):
+        tables = ["products", "users"] if url == SQLALCHEMY_DATABASE_URL else []
+        if url in urls:
+            tables.append("cart")
+        conn = psycopg2.connect(dsn(url))
+        try:
+            with conn.cursor() as cursor:
+                for table in [] if truncate else tables:
+                    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+                    if cursor.fetchone()[0]:
+                        problems.append(
+                            f"{table} on {make_url(url).database} is not empty, "
+                            "pass --truncate to empty it first"
+                        )
+            conn.rollback()
+            if not allow_triggers and not disable_triggers(conn):
+                problems.append(
+                    f"cannot disable triggers on {make_url(url).database}, every row "
+                    "would fire a NOTIFY (needs superuser, or pass --allow-triggers)"
+                )
+        finally:
+            conn.close()
+    return problems
+
+
+def truncate(urls: Sequence[str]) -> None:
+    """
+    empty the tables the seed loads, and the orders and stats referencing them;
+    NOTIFY does not fire for TRUNCATE, so restart running api workers afterwards
+    """
+    for url in dict.fromkeys([SQLALCHEMY_DATABASE_URL, *urls]):
+        conn = psycopg2.connect(dsn(url))
+        try:
+            with conn.cursor() as cursor:
+                if url == SQLALCHEMY_DATABASE_URL:
+                    cursor.execute(TRUNCATE_MAIN)
+                else:
+                    cursor.execute("TRUNCATE cart RESTART IDENTITY")
+            conn.commit()
+        finally:
+            conn.close()
+        logger.info("truncated the tables on %s", make_url(url).database)
+
+
+def finish(urls: Iterable[str]) -> None:
+    """move the id sequences past the copied ids and refresh planner statistics"""
+    conn = psycopg2.connect(dsn(SQLALCHEMY_DATABASE_URL))
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for table in ("products", "users"):
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT max(id) FROM {table}))"
+                )
+            cursor.execute("ANALYZE products")
+            cursor.execute("ANALYZE users")
+    finally:
+        conn.close()
+    for url in urls:
+        conn = psycopg2.connect(dsn(url))
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence('cart', 'id'), "
+                    "(SELECT max(id) FROM cart))"
+                )
+                cursor.execute("ANALYZE cart")
+        finally:
+            conn.close()
+
+
+def parse_as_of(value: str) -> datetime:
+    """--as-of in ISO 8601, naive times are taken as UTC"""
+    as_of = datetime.fromisoformat(value)
+    if as_of.tzinfo is None:
+        as_of = as_of.replace(tzinfo=timezone.utc)
+    return as_of
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    python -m app.seed --products 2000000 --users 300000 --seed 7
+    """
+    parser = argparse.ArgumentParser(description="bulk-load a synthetic dataset")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument(
+        "--skew", type=float, default=1.1, help="zipf exponent of categories/brands"
+    )
+    parser.add_argument(
+        "--cart-share", type=float, default=0.3, help="share of users with a cart"
+    )
+    parser.add_argument("--mean-cart-size", type=float, default=3.0)
+    parser.add_argument(
+        "--passwords", type=int, default=16, help="distinct pre-hashed passwords"
+    )
+    parser.add_argument(
+        "--as-of",
+        type=parse_as_of,
+        default=DEFAULT_AS_OF,
+        help="cart activity is spread over the 60 days before, default "
+        f"{DEFAULT_AS_OF.isoformat()}; without an offset the time is UTC",
+    )
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="empty products, users, carts and the orders referencing them first, "
+        "e.g. the sample rows of db/init.sql",
+    )
+    parser.add_argument(
+        "--allow-triggers",
+        action="store_true",
+        help="load even where triggers cannot be disabled",
+    )
+    args = parser.parse_args(argv)
+
+    cart_urls = cart_shards.urls if cart_shards.enabled else [SQLALCHEMY_DATABASE_URL]
+    problems = check_target(cart_urls, args.allow_triggers, args.truncate)
+    if problems:
+        parser.error("; ".join(problems))
+    if args.truncate:
+        truncate(cart_urls)
+
+    config = SeedConfig(
+        seed=args.seed,
+        products=args.products,
+        users=args.users,
+        categories=args.categories,
+        skew=args.skew,
+        cart_share=args.cart_share,
+        mean_cart_size=args.mean_cart_size,
+        first_product_id=FIRST_PRODUCT_ID,
+        first_user_id=FIRST_USER_ID,
+        as_of=args.as_of,
+    )
+    catalog = make_catalog(config)
+    passwords = password_pool(args.seed, args.passwords)
+
+    with multiprocessing.Pool(
+        args.workers,
+        initializer=_init_worker,
+        initargs=(config, catalog, passwords, args.allow_triggers),
+    ) as pool:
+        # carts reference products and users, so they are loaded last
+        for table, first_id, total in (
+            ("products", config.first_product_id, config.products),
+            ("users", config.first_user_id, config.users),
+            ("cart", config.first_user_id, config.users),
+        ):
+            started = time.monotonic()
+            rows = sum(
+                pool.imap_unordered(
+                    load_chunk, tasks(table, first_id, total, args.chunk_size)
+                )
+            )
+            print(f"{table}: {rows} rows in {time.monotonic() - started:.1f}s")
+
+    finish(cart_urls)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
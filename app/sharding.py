@@ -0,0 +1,222 @@
+import argparse
+import functools
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import models
+from .config import settings
+from .database import get_db, watch_request
+
+
+def parse_shard_map(spec: str, shards: int, buckets: int) -> List[int]:
+    """
+    parse a shard map like "0-511:0,512-1023:1" into the shard of every bucket
+    :param spec: comma separated bucket ranges with their shard, empty spreads evenly
+    :param shards: number of shards
+    :param buckets: number of buckets
+    :return: list indexed by bucket with the shard number
+    """
+    shard_of = [bucket * shards // buckets for bucket in range(buckets)]
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        buckets_range, _, shard = part.partition(":")
+        first, _, last = buckets_range.partition("-")
+        shard_no = int(shard)
+        if not 0 <= shard_no < shards:
+            raise ValueError(f"shard {shard_no} in shard map does not exist")
+        for bucket in range(int(first), int(last or first) + 1):
+            shard_of[bucket] = shard_no
+    return shard_of
+
+
+def format_shard_map(shard_of: Sequence[int]) -> str:
+    """inverse of parse_shard_map, consecutive buckets are merged into ranges"""
+    parts = []
+    start = 0
+    for bucket in range(1, len(shard_of) + 1):
+        if bucket == len(shard_of) or shard_of[bucket] != shard_of[start]:
+            parts.append(f"{start}-{bucket - 1}:{shard_of[start]}")
+            start = bucket
+    return ",".join(parts)
+
+
+class ShardRouter:
+    """
+    Routes cart data to one of N databases. A user belongs to bucket
+    user_id % buckets and the shard map assigns buckets to shards, so users are
+    moved between shards a bucket at a time. Without urls carts stay in the main db.
+    """
+
+    def __init__(self, urls: Sequence[str], buckets: int = 1024, shard_map: str = ""):
+        self.urls = list(urls)
+        self.buckets = buckets
+        self.engines = [create_engine(url) for url in self.urls]
+        self.sessionmakers = [
+            sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            for engine in self.engines
+        ]
+        self.shard_of_bucket = (
+            parse_shard_map(shard_map, len(self.urls), buckets) if self.urls else []
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.urls)
+
+    def bucket_of(self, user_id: int) -> int:
+        return user_id % self.buckets
+
+    def shard_of(self, user_id: int) -> int:
+        return self.shard_of_bucket[self.bucket_of(user_id)]
+
+    def session(self, shard: int) -> Session:
+        return self.sessionmakers[shard]()
+
+
+class CartSessions:
+    """
+    per request access to the cart database of a user, opened lazily and closed with
+    the request. When sharding is disabled every user gets the main db session, so
+    cart and catalog writes share one transaction as before.
+    """
+
+    def __init__(
+        self,
+        router: ShardRouter,
+        db: Session,
+        on_open: Optional[Callable[[Session], None]] = None,
+    ) -> None:
+        self.router = router
+        self.db = db
+        self.on_open = on_open
+        self._sessions: Dict[int, Session] = {}
+
+    def for_user(self, user_id: int) -> Session:
+        if not self.router.enabled:
+            return self.db
+        shard = self.router.shard_of(user_id)
+        if shard not in self._sessions:
+            session = self._sessions[shard] = self.router.session(shard)
+            if self.on_open is not None:
+                self.on_open(session)
+        return self._sessions[shard]
+
+    def close(self) -> None:
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+
+cart_shards = ShardRouter(
+    settings.cart_shard_urls, settings.cart_shard_buckets, settings.cart_shard_map
+)
+
+
+def get_cart_db(
+    request: Request, db: Session = Depends(get_db)
+) -> Iterator[CartSessions]:
+    # shard sessions get the statement_timeout and cancellation of the main session
+    carts = CartSessions(cart_shards, db, functools.partial(watch_request, request))
+    try:
+        yield carts
+    finally:
+        carts.close()
+
+
+def move_bucket(router: ShardRouter, bucket: int, target: int) -> int:
+    """
+    copy the cart rows of every user in a bucket to the target shard and delete them
+    from the source. Run it before deploying the new shard map (see format_shard_map)
+    while the bucket is not being written, e.g. in a maintenance window.
+    :param router: router with the current shard map
+    :param bucket: bucket to move
+    :param target: shard number the bucket moves to
+    :return: number of cart rows moved
+    """
+    source = router.shard_of_bucket[bucket]
+    if source == target:
+        return 0
+    in_bucket = models.Cart.user_id % router.buckets == bucket
+    # ids are per shard sequences, the target assigns new ones
+    columns = [c.name for c in models.Cart.__table__.columns if c.name != "id"]
+
+    source_db, target_db = router.session(source), router.session(target)
+    try:
+        rows = [
+            {name: getattr(row, name) for name in columns}
+            for row in source_db.query(models.Cart).filter(in_bucket)
+        ]
+        target_db.query(models.Cart).filter(in_bucket).delete(synchronize_session=False)
+        target_db.bulk_insert_mappings(models.Cart, rows)
+        target_db.commit()
+        source_db.query(models.Cart).filter(in_bucket).delete(synchronize_session=False)
+        source_db.commit()
+    finally:
+        source_db.close()
+        target_db.close()
+    router.shard_of_bucket[bucket] = target
+    return len(rows)
+
+
+def rebalance(router: ShardRouter) -> Dict[int, int]:
+    """
+    move buckets until they are spread evenly over all shards, e.g. after a new shard
+    url was appended to the settings
+    :param router: router with the current shard map
+    :return: rows moved by bucket
+    """
+    target_map = parse_shard_map("", len(router.urls), router.buckets)
+    return {
+        bucket: move_bucket(router, bucket, target)
+        for bucket, target in enumerate(target_map)
+        if router.shard_of_bucket[bucket] != target
+    }
+
+
+def shard_row_counts(router: ShardRouter) -> List[int]:
+    """number of cart rows on every shard"""
+    counts = []
+    for shard in range(len(router.urls)):
+        db = router.session(shard)
+        try:
+            counts.append(db.query(func.count(models.Cart.id)).scalar())
+        finally:
+            db.close()
+    return counts
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    python -m app.sharding status
+    python -m app.sharding move --bucket 17 --to 2
+    python -m app.sharding rebalance
+    """
+    parser = argparse.ArgumentParser(description="cart shard maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="cart rows per shard and the shard map")
+    move = commands.add_parser("move", help="move a bucket of users to another shard")
+    move.add_argument("--bucket", type=int, required=True, nargs="+")
+    move.add_argument("--to", type=int, required=True)
+    commands.add_parser("rebalance", help="spread all buckets evenly over the shards")
+    args = parser.parse_args(argv)
+
+    if not cart_shards.enabled:
+        parser.exit(1, "cart sharding is not configured (CART_SHARD_URLS)\n")
+
+    if args.command == "status":
+        for shard, count in enumerate(shard_row_counts(cart_shards)):
+            print(f"shard {shard}: {count} cart rows")
+    elif args.command == "move":
+        for bucket in args.bucket:
+            moved = move_bucket(cart_shards, bucket, args.to)
+            print(f"bucket {bucket}: moved {moved} cart rows to shard {args.to}")
+    else:
+        moved = rebalance(cart_shards)
+        print(f"moved {len(moved)} buckets with {sum(moved.values())} cart rows")
+    print(f"CART_SHARD_MAP={format_shard_map(cart_shards.shard_of_bucket)}")
+
+
+if __name__ == "__main__":
+    main()
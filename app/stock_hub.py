@@ -0,0 +1,172 @@
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .metrics import metrics
+
+
+class Subscription:
+    """
+    Stock updates pending for one client. Only the latest count per product is kept,
+    so a slow consumer costs at most one entry per watched id and receives the
+    current values once it catches up instead of a backlog of stale ones.
+    Lives on the event loop, it is not thread-safe.
+    """
+
+    def __init__(self, ids: Iterable[int], min_interval: float) -> None:
+        self.ids = frozenset(ids)
+        self.min_interval = min_interval
+        self._pending: Dict[int, Optional[int]] = {}
+        self._sent: Dict[int, Optional[int]] = {}
+        self._ready = asyncio.Event()
+        self._last_send = 0.0
+
+    def snapshot(self, counts: Dict[int, int]) -> List[dict]:
+        """
+        :param counts: current inventory_count of the watched products
+        :return: initial changes to send, deltas are relative to these
+        """
+        return self._changes({i: counts.get(i) for i in sorted(self.ids)})
+
+    def offer(self, product_id: int, count: Optional[int]) -> None:
+        if product_id in self._pending or self._sent.get(product_id, -1) != count:
+            self._pending[product_id] = count
+            self._ready.set()
+
+    async def next(self, timeout: float) -> List[dict]:
+        """
+        wait for the next coalesced batch of changes
+        :param timeout: max seconds to wait, e.g. to send a keep-alive
+        :return: changes as {product_id, inventory_count, delta}, empty on timeout
+        """
+        loop = asyncio.get_event_loop()
+        wait = self._last_send + self.min_interval - loop.time()
+        if wait > 0:
+            # throttle, updates arriving meanwhile are merged into one batch
+            await asyncio.sleep(wait)
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        pending, self._pending = self._pending, {}
+        self._ready.clear()
+        self._last_send = loop.time()
+        return self._changes(pending)
+
+    def _changes(self, pending: Dict[int, Optional[int]]) -> List[dict]:
+        changes = []
+        for product_id, count in pending.items():
+            previous = self._sent.get(product_id)
+            if product_id in self._sent and previous == count:
+                continue
+            self._sent[product_id] = count
+            delta = (
+                count - previous if count is not None and previous is not None else None
+            )
+            changes.append(
+                {"product_id": product_id, "inventory_count": count, "delta": delta}
+            )
+        return changes
+
+
+class StockHub:
+    """
+    In-process fan-out of inventory_count changes to the subscribers of this worker.
+    publish() may be called from any thread, delivery happens on the event loop the
+    first subscriber was created on.
+    """
+
+    def __init__(self, min_interval: float = 0.5) -> None:
+        self.min_interval = min_interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._watchers: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def subscribers(self) -> int:
+        return self._count
+
+    def watched(self, product_id: int) -> bool:
+        return product_id in self._watchers
+
+    def subscribe(self, ids: Iterable[int]) -> Subscription:
+        """register a client, must be called on the event loop"""
+        self._loop = asyncio.get_event_loop()
+        subscription = Subscription(ids, self.min_interval)
+        with self._lock:
+            for product_id in subscription.ids:
+                self._watchers[product_id].add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for product_id in subscription.ids:
+                watchers = self._watchers.get(product_id)
+                if watchers is not None:
+                    watchers.discard(subscription)
+                    if not watchers:
+                        del self._watchers[product_id]
+            self._count -= 1
+
+    def publish(self, product_id: int, count: Optional[int]) -> None:
+        """
+        :param product_id: product whose stock changed
+        :param count: new inventory_count, None when the product was deleted
+        """
+        if self._loop is None or not self.watched(product_id):
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._fan_out, product_id, count)
+        except RuntimeError:
+            # loop closed during shutdown
+            pass
+
+    def _fan_out(self, product_id: int, count: Optional[int]) -> None:
+        with self._lock:
+            watchers = list(self._watchers.get(product_id, ()))
+        for subscription in watchers:
+            subscription.offer(product_id, count)
+        metrics.inc("stock_updates_published")
+
+
+stock_hub = StockHub(min_interval=settings.stock_stream_min_interval)
+metrics.gauge("stock_subscribers", lambda: stock_hub.subscribers)
+
+
+def current_stock(ids: Iterable[int]) -> Dict[int, int]:
+    """inventory_count of the given products, read on a worker thread"""
+    db = SessionLocal()
+    try:
+        return dict(
+            db.query(models.Product.id, models.Product.inventory_count).filter(
+                models.Product.id.in_(list(ids))
+            )
+        )
+    finally:
+        db.close()
+
+
+def on_stock_change(op: str, product_id: int, change: Dict[str, Any]) -> None:
+    """
+    invalidation listener handler: forward changes made by any worker to the
+    subscribers of this one, with the count sent by the trigger
+    :param op: INSERT, UPDATE, STOCK or DELETE
+    :param product_id: product id
+    :param change: notification payload
+    """
+    if not stock_hub.watched(product_id):
+        return
+    if op == "DELETE":
+        stock_hub.publish(product_id, None)
+        return
+    if "inventory_count" in change:
+        stock_hub.publish(product_id, change["inventory_count"])
+        return
+    # sent by a trigger older than db/init.sql
+    stock_hub.publish(product_id, current_stock([product_id]).get(product_id))
@@ -0,0 +1,111 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import anyio
+import anyio.to_thread
+
+from .config import settings
+from .metrics import metrics
+
+# capacity limiters by name, created on the event loop by configure_threadpool()
+_limiters: Dict[str, anyio.CapacityLimiter] = {}
+
+
+def limiter_tokens() -> Dict[str, int]:
+    """
+    tokens per limiter. A "db" token is the right to hold a pooled connection: the
+    request session (database.get_db) and db tasks of requests (run_on("db", ..))
+    take one before they open a session. By default the tokens leave
+    db_background_connections of the pool to the write-behind queues, listeners
+    and index rebuilds, which are not gated; they and requests beyond that wait
+    up to db_pool_timeout and get a 503. "cpu" bounds password hashing and token
+    checks; the default anyio limiter runs sync dependencies and endpoints, and
+    has room for every db token holder and the cpu work besides
+    """
+    db = settings.threadpool_db_tokens or max(
+        settings.db_pool_size
+        + settings.db_max_overflow
+        - settings.db_background_connections,
+        1,
+    )
+    cpu = settings.threadpool_cpu_tokens
+    return {
+        "db": db,
+        "cpu": cpu,
+        "default": settings.threadpool_default_tokens or db + cpu,
+    }
+
+
+def configure_threadpool() -> None:
+    """size the limiters, must run on the event loop (async start-up handler)"""
+    tokens = limiter_tokens()
+    default = anyio.to_thread.current_default_thread_limiter()
+    default.total_tokens = tokens.pop("default")
+    metrics.gauge("threadpool_default_busy", lambda: default.borrowed_tokens)
+    metrics.gauge(
+        "threadpool_default_waiting", lambda: default.statistics().tasks_waiting
+    )
+    for name, total in tokens.items():
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = anyio.CapacityLimiter(total)
+        limiter.total_tokens = total
+        metrics.gauge(
+            f"threadpool_{name}_busy", lambda limiter=limiter: limiter.borrowed_tokens
+        )
+        metrics.gauge(
+            f"threadpool_{name}_waiting",
+            lambda limiter=limiter: limiter.statistics().tasks_waiting,
+        )
+
+
+def get_limiter(name: str) -> anyio.CapacityLimiter:
+    limiter = _limiters.get(name)
+    if limiter is None:
+        # requests before start-up, e.g. in tests
+        limiter = _limiters[name] = anyio.CapacityLimiter(limiter_tokens()[name])
+    return limiter
+
+
+class LimiterTimeout(Exception):
+    """no token of a limiter became free in time"""
+
+
+@asynccontextmanager
+async def holding(name: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+    """
+    hold a token of the named limiter for the block, e.g. while a request session
+    is open, recording the wait for it as threadpool_wait_seconds.<name>
+    :param timeout: seconds to wait for the token before LimiterTimeout
+    """
+    limiter = get_limiter(name)
+    borrower = object()
+    queued = time.perf_counter()
+    try:
+        with anyio.fail_after(timeout):
+            await limiter.acquire_on_behalf_of(borrower)
+    except TimeoutError:
+        metrics.inc(f"threadpool_timeouts.{name}")
+        raise LimiterTimeout(f"no {name} token within {timeout}s")
+    metrics.observe(f"threadpool_wait_seconds.{name}", time.perf_counter() - queued)
+    try:
+        yield
+    finally:
+        limiter.release_on_behalf_of(borrower)
+
+
+async def run_on(name: str, func: Callable, *args: Any) -> Any:
+    """
+    run func on a thread of the named limiter, recording the wait for the thread
+    as threadpool_wait_seconds.<name>. Never call run_on("db", ..) while holding a
+    db token, e.g. from a request with a get_db session: with every token held
+    that way nothing could run
+    """
+    queued = time.perf_counter()
+
+    def run() -> Any:
+        metrics.observe(f"threadpool_wait_seconds.{name}", time.perf_counter() - queued)
+        return func(*args)
+
+    return await anyio.to_thread.run_sync(run, limiter=get_limiter(name))
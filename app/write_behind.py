@@ -0,0 +1,147 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# a handler receives a whole batch of events and does its writes in one go
+Handler = Callable[[List[Any]], None]
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue that hands events to a background thread which
+    batches them and runs every handler once per batch.
+    Producers never block: when the queue is full the event is dropped and counted.
+    """
+
+    def __init__(
+        self,
+        handlers: Sequence[Handler],
+        maxsize: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_retries: int = 3,
+        retry_backoff: float = 0.2,
+        name: str = "write-behind",
+    ) -> None:
+        self.handlers = list(handlers)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.name = name
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "enqueued": 0,
+            "dropped": 0,
+            "processed": 0,
+            "failed": 0,
+            "batches": 0,
+        }
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += value
+        # e.g. write_behind_dropped.order-queue on /metrics
+        metrics.inc(f"write_behind_{key}.{self.name}", value)
+
+    def put(self, event: Any) -> bool:
+        """
+        enqueue an event without blocking the caller
+        :param event: event passed to the handlers
+        :return: False if the queue is full or stopped and the event was dropped
+        """
+        if self._stop.is_set():
+            self._count("dropped")
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._count("dropped")
+            logger.warning("%s queue is full, dropping event", self.name)
+            return False
+        self._count("enqueued")
+        return True
+
+    def start(self) -> None:
+        """starts the background worker thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        stops accepting events and flushes everything already queued
+        :param timeout: seconds to wait for the final flush
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # worker never started or did not get to the tail of the queue
+        self._drain()
+
+    def flush(self) -> None:
+        """processes everything currently queued on the calling thread"""
+        self._drain()
+
+    def _drain(self) -> None:
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return
+            self._process(batch)
+
+    def _take(self, block: bool) -> List[Any]:
+        batch: List[Any] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if block and not batch:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+                elif block:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take(block=True)
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch: List[Any]) -> None:
+        for handler in self.handlers:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    handler(batch)
+                    break
+                except Exception:
+                    if attempt == self.max_retries:
+                        logger.exception(
+                            "%s handler %s failed for %d events, giving up",
+                            self.name,
+                            getattr(handler, "__name__", handler),
+                            len(batch),
+                        )
+                        self._count("failed", len(batch))
+                    else:
+                        time.sleep(self.retry_backoff * (2**attempt))
+        self._count("batches")
+        self._count("processed", len(batch))
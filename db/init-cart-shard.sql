@@ -0,0 +1,18 @@
+-- schema of a cart shard database (CART_SHARD_URLS), users and products stay in the main db
+
+DROP TABLE IF EXISTS cart;
+
+CREATE TABLE IF NOT EXISTS cart (
+	id SERIAL NOT NULL,
+	user_id int4 NULL,
+	product_id int4 NULL,
+	quantity int4 NOT NULL,
+	created_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+	updated_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+	CONSTRAINT cart_pkey PRIMARY KEY (id)
+);
+
+-- user lookups and the abandoned cart purge (app/maintenance.py); databases created
+-- without the created_at/updated_at columns get them from db/migrations/001_cart_activity.sql
+CREATE INDEX IF NOT EXISTS cart_user_id_updated_at_idx ON cart (user_id, updated_at);
+CREATE INDEX IF NOT EXISTS cart_updated_at_idx ON cart (updated_at);
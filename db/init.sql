@@ -1,3 +1,11 @@
+DROP TABLE IF EXISTS order_history;
+
+DROP TABLE IF EXISTS product_stats;
+
+DROP TABLE IF EXISTS order_items;
+
+DROP TABLE IF EXISTS orders;
+
 DROP TABLE IF EXISTS products;
 
 DROP TABLE IF EXISTS users;
@@ -30,6 +38,8 @@ CREATE TABLE IF NOT EXISTS cart (
 	user_id int4 NULL,
 	product_id int4 NULL,
 	quantity int4 NOT NULL,
+	created_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+	updated_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
 	CONSTRAINT cart_pkey PRIMARY KEY (id)
 );
 
@@ -37,6 +47,117 @@ CREATE TABLE IF NOT EXISTS cart (
 ALTER TABLE cart ADD CONSTRAINT cart_product_id_fkey FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE;
 ALTER TABLE cart ADD CONSTRAINT cart_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
 
+-- user lookups and the abandoned cart purge (app/maintenance.py); databases created
+-- without the created_at/updated_at columns get them from db/migrations/001_cart_activity.sql
+CREATE INDEX IF NOT EXISTS cart_user_id_updated_at_idx ON cart (user_id, updated_at);
+CREATE INDEX IF NOT EXISTS cart_updated_at_idx ON cart (updated_at);
+
+
+CREATE TABLE IF NOT EXISTS orders (
+    id SERIAL PRIMARY KEY,
+    user_id int4 NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    id SERIAL PRIMARY KEY,
+    order_id int4 NULL REFERENCES orders(id) ON DELETE CASCADE,
+    product_id int4 NULL REFERENCES products(id) ON DELETE SET NULL,
+    quantity int4 NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id);
+
+-- written asynchronously by the checkout write-behind queue
+CREATE TABLE IF NOT EXISTS order_history (
+    id SERIAL PRIMARY KEY,
+    order_id int4 NULL REFERENCES orders(id) ON DELETE CASCADE,
+    user_id int4 NOT NULL,
+    product_id int4 NULL,
+    product_name character varying(255) NULL,
+    category character varying(255) NULL,
+    quantity int4 NOT NULL,
+    ordered_at timestamp with time zone NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS order_history_user_id_idx ON order_history (user_id);
+
+CREATE TABLE IF NOT EXISTS product_stats (
+    product_id int4 PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    times_ordered int4 DEFAULT 0 NOT NULL,
+    units_ordered int4 DEFAULT 0 NOT NULL
+);
+
+-- row changes of products are broadcast to every api worker (app/invalidation.py)
+CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS trigger AS $$
+DECLARE
+    new_row jsonb := CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE to_jsonb(NEW) END;
+    old_row jsonb := CASE WHEN TG_OP = 'INSERT' THEN NULL ELSE to_jsonb(OLD) END;
+    op text := TG_OP;
+BEGIN
+    -- product updates touching only the stock are sent as STOCK so workers keep
+    -- their catalog caches and just push the new count to stock subscribers
+    IF TG_OP = 'UPDATE' AND TG_TABLE_NAME = 'products'
+        AND new_row - 'inventory_count' - 'updated_at'
+            = old_row - 'inventory_count' - 'updated_at' THEN
+        op := 'STOCK';
+    END IF;
+    -- categories and the new stock let every worker update its category counts and
+    -- stock streams without reading the row back
+    PERFORM pg_notify(
+        'cache_invalidation',
+        json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', op,
+            'id', coalesce(new_row, old_row)->'id',
+            'category', coalesce(new_row, old_row)->>'category',
+            'old_category', old_row->>'category',
+            'inventory_count', new_row->'inventory_count'
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON products
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+-- checked-out orders are broadcast with their basket, so every worker counts them
+-- in its related index and autocomplete weights (app/cache.py on_order_placed).
+-- Deferred to commit, when the order_items of the order are all written.
+-- Existing databases get it from db/migrations/002_order_notifications.sql
+CREATE OR REPLACE FUNCTION notify_order_placed() RETURNS trigger AS $$
+DECLARE
+    payload text := json_build_object(
+        'table', 'orders',
+        'op', TG_OP,
+        'id', NEW.id,
+        'items', (
+            SELECT coalesce(json_agg(json_build_array(product_id, quantity)), '[]')
+            FROM order_items
+            WHERE order_id = NEW.id AND product_id IS NOT NULL
+        )
+    )::text;
+BEGIN
+    -- payloads must stay below 8000 bytes, workers read big baskets back instead
+    IF octet_length(payload) > 7900 THEN
+        payload := json_build_object('table', 'orders', 'op', TG_OP, 'id', NEW.id)::text;
+    END IF;
+    PERFORM pg_notify('cache_invalidation', payload);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_placed_notification ON orders;
+CREATE CONSTRAINT TRIGGER orders_placed_notification
+    AFTER INSERT ON orders
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION notify_order_placed();
+
+-- no worker caches users, so user writes send no notifications
+DROP TRIGGER IF EXISTS users_cache_invalidation ON users;
+
 --TRUNCATE TABLE  products;
 --
 --TRUNCATE TABLE  users;
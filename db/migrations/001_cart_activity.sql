@@ -0,0 +1,41 @@
+-- cart line activity for the abandoned cart purge (app/maintenance.py) on databases
+-- created before init.sql / init-cart-shard.sql had the columns. Idempotent, run it
+-- outside a transaction on the main db and on every cart shard:
+--   psql -v ON_ERROR_STOP=1 -d <db> -f db/migrations/001_cart_activity.sql
+
+ALTER TABLE cart ADD COLUMN IF NOT EXISTS created_at timestamp with time zone;
+ALTER TABLE cart ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone;
+-- lines added while the backfill runs get their timestamps from the defaults
+ALTER TABLE cart ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE cart ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP;
+
+-- existing lines count as touched now, so no cart is purged as abandoned before
+-- cart_purge_max_age_days have passed. Batches keep row locks and WAL small.
+DO $$
+DECLARE
+    backfilled int;
+BEGIN
+    LOOP
+        UPDATE cart
+        SET created_at = coalesce(created_at, CURRENT_TIMESTAMP),
+            updated_at = coalesce(updated_at, CURRENT_TIMESTAMP)
+        WHERE id IN (
+            SELECT id FROM cart
+            WHERE created_at IS NULL OR updated_at IS NULL
+            LIMIT 10000
+        );
+        GET DIAGNOSTICS backfilled = ROW_COUNT;
+        EXIT WHEN backfilled = 0;
+        COMMIT;
+    END LOOP;
+END;
+$$;
+
+ALTER TABLE cart ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE cart ALTER COLUMN updated_at SET NOT NULL;
+
+-- user lookups and the purge; (user_id, updated_at) replaces the user_id index
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cart_user_id_updated_at_idx
+    ON cart (user_id, updated_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cart_updated_at_idx ON cart (updated_at);
+DROP INDEX CONCURRENTLY IF EXISTS cart_user_id_idx;
@@ -0,0 +1,33 @@
+-- order notifications feeding the related and autocomplete indexes of every worker
+-- (app/cache.py on_order_placed) on a main db created before init.sql had them.
+-- Idempotent; without it workers running the invalidation listener only pick up
+-- orders at their periodic related index rebuild:
+--   psql -v ON_ERROR_STOP=1 -d <db> -f db/migrations/002_order_notifications.sql
+
+CREATE OR REPLACE FUNCTION notify_order_placed() RETURNS trigger AS $$
+DECLARE
+    payload text := json_build_object(
+        'table', 'orders',
+        'op', TG_OP,
+        'id', NEW.id,
+        'items', (
+            SELECT coalesce(json_agg(json_build_array(product_id, quantity)), '[]')
+            FROM order_items
+            WHERE order_id = NEW.id AND product_id IS NOT NULL
+        )
+    )::text;
+BEGIN
+    -- payloads must stay below 8000 bytes, workers read big baskets back instead
+    IF octet_length(payload) > 7900 THEN
+        payload := json_build_object('table', 'orders', 'op', TG_OP, 'id', NEW.id)::text;
+    END IF;
+    PERFORM pg_notify('cache_invalidation', payload);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_placed_notification ON orders;
+CREATE CONSTRAINT TRIGGER orders_placed_notification
+    AFTER INSERT ON orders
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION notify_order_placed();
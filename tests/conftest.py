@@ -0,0 +1,14 @@
+import os
+
+# app.config.Settings needs these, the tests never open a postgres connection
+for name, value in {
+    "DATABASE_HOSTNAME": "localhost",
+    "DATABASE_PORT": "5432",
+    "DATABASE_PASSWORD": "password",
+    "DATABASE_NAME": "ecom-test",
+    "DATABASE_USERNAME": "postgres",
+    "SECRET_KEY": "test-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+}.items():
+    os.environ.setdefault(name, value)
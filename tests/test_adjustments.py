@@ -0,0 +1,182 @@
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from sqlalchemy.dialects import postgresql
+from starlette.testclient import TestClient
+
+from app import adjustments, oauth2
+from app.adjustments import (
+    ADJUST_STOCK,
+    MAX_COUNT,
+    AdjustmentResults,
+    net_deltas,
+    queue_adjustments,
+)
+from app.database import get_db
+from app.routers import inventory
+from app.write_behind import WriteBehindQueue
+
+
+def test_deltas_are_summed_per_product():
+    assert net_deltas([(1, 5), (2, 3), (1, -2), (2, -3)]) == {1: 3}
+
+
+def test_coalesced_requests_are_checked_one_at_a_time(monkeypatch):
+    writes = []
+    published = []
+
+    class Result:
+        def all(self):
+            return [(1, 20), (2, 5)]
+
+    class Session:
+        def execute(self, statement, params):
+            assert statement is adjustments.LOCK_STOCK
+            assert params == {"ids": [1, 2, 9]}
+            return Result()
+
+        def commit(self):
+            pass
+
+        def close(self):
+            pass
+
+    def apply(db, deltas):
+        writes.append(deltas)
+        return {1: 20 + deltas[1], 2: 5 + deltas[2]}
+
+    monkeypatch.setattr(adjustments, "SessionLocal", Session)
+    monkeypatch.setattr(adjustments, "apply_adjustments", apply)
+    monkeypatch.setattr(adjustments, "publish_counts", published.append)
+    results = AdjustmentResults()
+    monkeypatch.setattr(adjustments, "adjustment_results", results)
+    monkeypatch.setattr(
+        adjustments,
+        "adjustment_queue",
+        WriteBehindQueue([adjustments.write_adjustments], flush_interval=0.05),
+    )
+    # a restock and a larger withdrawal: the restock applies on its own
+    restock = queue_adjustments({1: 100, 2: 1})
+    withdrawal = queue_adjustments({1: -150, 9: 2})
+    assert results.get(restock)["status"] == "queued"
+    adjustments.adjustment_queue.flush()
+
+    assert writes == [{1: 100, 2: 1}]
+    assert published == [{1: 120, 2: 6}]
+    assert results.get(restock) == {
+        "id": restock,
+        "status": "applied",
+        "adjusted": [
+            {"product_id": 1, "inventory_count": 120},
+            {"product_id": 2, "inventory_count": 6},
+        ],
+        "rejected": [],
+    }
+    assert results.get(withdrawal)["rejected"] == [1, 9]
+    assert results.get(queue_adjustments({}))["status"] == "applied"
+
+
+def test_adjustments_bind_one_array_per_column():
+    compiled = ADJUST_STOCK.compile(dialect=postgresql.psycopg2.dialect())
+    assert "unnest(%(ids)s::INTEGER[], %(deltas)s::BIGINT[])" in str(compiled)
+    assert "FOR UPDATE" in str(compiled)
+
+
+class LockedStock:
+    """session of write_adjustments over the given counts"""
+
+    counts = {}
+
+    def execute(self, statement, params):
+        return SimpleNamespace(
+            all=lambda: [(i, self.counts[i]) for i in params["ids"] if i in self.counts]
+        )
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_client(monkeypatch, counts):
+    LockedStock.counts = counts
+    queue = WriteBehindQueue([adjustments.write_adjustments], flush_interval=0.05)
+    monkeypatch.setattr(adjustments, "adjustment_queue", queue)
+    monkeypatch.setattr(adjustments, "adjustment_results", AdjustmentResults())
+    monkeypatch.setattr(inventory, "adjustment_results", adjustments.adjustment_results)
+    monkeypatch.setattr(adjustments, "SessionLocal", LockedStock)
+    monkeypatch.setattr(
+        adjustments,
+        "apply_adjustments",
+        lambda db, deltas: {i: counts[i] + delta for i, delta in deltas.items()},
+    )
+    monkeypatch.setattr(adjustments, "publish_counts", lambda counts: None)
+    app = FastAPI()
+    app.include_router(inventory.router)
+    app.dependency_overrides[oauth2.get_current_user] = lambda: SimpleNamespace(
+        id=1, username="invadmin"
+    )
+    app.dependency_overrides[get_db] = lambda: SimpleNamespace(commit=lambda: None)
+    return TestClient(app), queue
+
+
+def adjust(client, *items, coalesce=True):
+    return client.post(
+        "/inventory/adjustments",
+        json={
+            "adjustments": [{"product_id": i, "delta": d} for i, d in items],
+            "coalesce": coalesce,
+        },
+    )
+
+
+def test_coalesced_calls_are_polled_and_rejected_on_their_own(monkeypatch):
+    client, queue = make_client(monkeypatch, {1: 20, 2: MAX_COUNT - 5})
+
+    restock = adjust(client, (1, 100))
+    withdrawal = adjust(client, (1, -150))
+    overflow = adjust(client, (2, 10), (1, -5))
+    assert [r.status_code for r in (restock, withdrawal, overflow)] == [202] * 3
+    assert restock.json()["queued"] == 1
+
+    def status_of(response):
+        return client.get(f"/inventory/adjustments/{response.json()['id']}")
+
+    assert status_of(restock).json()["status"] == "queued"
+
+    queue.flush()
+
+    assert status_of(restock).json() == {
+        "id": restock.json()["id"],
+        "status": "applied",
+        "adjusted": [{"product_id": 1, "inventory_count": 120}],
+        "rejected": [],
+    }
+    assert status_of(withdrawal).json()["rejected"] == [1]
+    assert status_of(overflow).json()["adjusted"] == [
+        {"product_id": 1, "inventory_count": 115}
+    ]
+    assert status_of(overflow).json()["rejected"] == [2]
+    assert client.get("/inventory/adjustments/unknown").status_code == 404
+
+
+def test_deltas_outside_int4_are_rejected(monkeypatch):
+    client, _ = make_client(monkeypatch, {1: 0})
+
+    assert adjust(client, (1, 2**31)).status_code == 422
+    assert adjust(client, (1, -(2**31) - 1), coalesce=False).status_code == 422
+
+
+def test_direct_calls_report_adjusted_and_rejected_products(monkeypatch):
+    client, _ = make_client(monkeypatch, {})
+    monkeypatch.setattr(inventory, "apply_adjustments", lambda db, deltas: {1: 7})
+    monkeypatch.setattr(inventory, "publish_counts", lambda counts: None)
+
+    response = adjust(client, (1, 2), (1, 5), (9, 1), coalesce=False)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "adjusted": [{"product_id": 1, "inventory_count": 7}],
+        "rejected": [9],
+    }
@@ -0,0 +1,90 @@
+from app import autocomplete, cache
+from app.autocomplete import PrefixIndex
+from app.orders import OrderPlaced
+from app.recommendations import CoOccurrenceIndex
+
+ROWS = [
+    (1, "iphone", "apple", "electronics", "smart phone", 0),
+    (2, "s22", "samsung", "electronics", "smart phone", 5),
+    (3, "lenovo e14", "lenovo", "electronics", "laptop", 0),
+    (4, "levis s512", "levis", "clothes", "jeans", 1),
+]
+
+
+def make_index(**kwargs):
+    index = PrefixIndex(**kwargs)
+    index.load(ROWS)
+    return index
+
+
+def test_prefix_matches_all_kinds_by_weight():
+    index = make_index()
+
+    # smart phone weighs iphone (1) + s22 (1 + 5 units ordered)
+    assert index.search("s") == [
+        ("sub_category", "smart phone", None),
+        ("manufacturer", "samsung", None),
+        ("product", "s22", 2),
+        ("product", "levis s512", 4),
+    ]
+    assert index.search("E14") == [("product", "lenovo e14", 3)]
+    assert index.search("xyz") == []
+
+
+def test_upsert_remove_and_popularity_are_incremental():
+    index = make_index()
+
+    index.upsert_product(5, "lenovo yoga", "lenovo", "electronics", "laptop")
+    assert ("product", "lenovo yoga", 5) in index.search("lenovo")
+
+    index.add_popularity(1, 10)
+    assert index.search("", limit=1) == [("category", "electronics", None)]
+    assert index.search("i")[0] == ("product", "iphone", 1)
+
+    index.remove_product(4)
+    assert index.search("levis") == []
+    assert index.search("cl") == []
+
+
+def test_prefix_longer_than_indexed_depth():
+    index = make_index(max_depth=3)
+
+    assert index.search("lenovo e") == [("product", "lenovo e14", 3)]
+    assert index.search("lenovo x") == []
+
+
+def test_only_the_most_ordered_names_are_indexed():
+    index = make_index(max_products=2)
+
+    # s22 (5 units) and levis s512 (1 unit) are kept, the facets of all four count
+    assert index.search("i") == []
+    assert index.search("lenovo") == [("manufacturer", "lenovo", None)]
+    assert index.search("e", limit=1) == [("category", "electronics", None)]
+    assert index.search("levis")[-1] == ("product", "levis s512", 4)
+
+    # a full index takes no new names, removing one makes room
+    index.upsert_product(5, "lenovo yoga", "lenovo", "electronics", "laptop")
+    assert index.search("lenovo y") == []
+    index.remove_product(2)
+    index.upsert_product(5, "lenovo yoga", "lenovo", "electronics", "laptop")
+    assert index.search("lenovo y") == [("product", "lenovo yoga", 5)]
+
+
+def test_orders_are_weighed_from_notifications(monkeypatch):
+    index = make_index()
+    monkeypatch.setattr(cache, "autocomplete_index", index)
+    monkeypatch.setattr(autocomplete, "autocomplete_index", index)
+    monkeypatch.setattr(cache, "related_index", CoOccurrenceIndex())
+
+    lenovo = [
+        ("manufacturer", "lenovo", None),
+        ("product", "lenovo e14", 3),
+        ("sub_category", "laptop", None),
+    ]
+    cache.on_order_placed("INSERT", 1, {"items": [[3, 9]]})
+    assert index.search("l", limit=3) == lenovo
+
+    # the local write-behind event of a notified order is not counted again
+    index.listening = True
+    autocomplete.update_autocomplete_popularity([OrderPlaced(1, 1, [(4, 20)], None)])
+    assert index.search("l", limit=3) == lenovo
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from fastapi import Depends, FastAPI, Request
+from starlette.testclient import TestClient
+
+from app import oauth2
+from app.routers import batch
+
+
+def make_app():
+    app = FastAPI()
+    app.include_router(batch.router)
+    events = []
+
+    @app.get("/whoami")
+    def whoami(current_user: object = Depends(oauth2.get_current_user)):
+        events.append("read")
+        return {"username": current_user.username}
+
+    @app.get("/slow")
+    async def slow(request: Request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(0.01)
+        events.append("slow gone")
+
+    @app.get("/stuck")
+    def stuck(request: Request):
+        # a sync endpoint waiting on a query until its cancel token fires
+        cancelled = threading.Event()
+        token = request.state.cancel_token
+        token.register("query", cancelled.set)
+        cancelled.wait(0 if token.cancelled else 5)
+        time.sleep(0.05)
+        events.append("stuck gone")
+
+    @app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    @app.post("/write")
+    def write(payload: dict):
+        events.append("write")
+        return payload
+
+    return app, events
+
+
+def test_sub_requests_share_the_batch_user(monkeypatch):
+    user = SimpleNamespace(id=1, username="user")
+    monkeypatch.setattr(oauth2, "get_detached_user", lambda token: user)
+    app, events = make_app()
+
+    response = TestClient(app).post(
+        "/batch/",
+        headers={"Authorization": "Bearer token"},
+        json={
+            "requests": [
+                {"id": "me", "path": "/whoami"},
+                {"id": "w", "method": "post", "path": "/write", "body": {"a": 1}},
+                {"path": "/whoami"},
+                {"path": "/batch/", "method": "POST"},
+            ]
+        },
+    )
+
+    responses = response.json()["responses"]
+    assert [r["status"] for r in responses] == [200, 200, 200, 400]
+    assert responses[0] == {
+        "id": "me",
+        "status": 200,
+        "headers": {"content-type": "application/json"},
+        "body": {"username": "user"},
+    }
+    assert responses[1]["body"] == {"a": 1}
+    # the write is a barrier between the reads around it
+    assert events == ["read", "write", "read"]
+
+
+def test_sub_requests_without_token_are_rejected():
+    app, _ = make_app()
+
+    response = TestClient(app).post("/batch/", json={"requests": [{"path": "/whoami"}]})
+
+    assert response.json()["responses"][0]["status"] == 401
+
+
+def test_streams_are_rejected_and_stuck_or_failing_items_answered(monkeypatch):
+    monkeypatch.setattr(batch.settings, "batch_item_timeout", 0.2)
+    app, events = make_app()
+
+    response = TestClient(app).post(
+        "/batch/",
+        json={
+            "requests": [
+                {"path": "/stock/stream?ids=1"},
+                {"path": "/slow"},
+                {"path": "/boom"},
+                {"path": "/stuck"},
+            ]
+        },
+    )
+
+    assert [r["status"] for r in response.json()["responses"]] == [400, 504, 500, 504]
+    # timed out sub-requests are answered only once they have unwound
+    assert sorted(events) == ["slow gone", "stuck gone"]
@@ -0,0 +1,58 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.cancellation import CancelToken, DisconnectCancelMiddleware
+
+
+async def echo(request):
+    return JSONResponse(await request.json())
+
+
+def test_body_is_replayed_to_the_app():
+    app = Starlette(routes=[Route("/echo", echo, methods=["POST"])])
+    app.add_middleware(DisconnectCancelMiddleware)
+
+    response = TestClient(app).post("/echo", json={"product_id": 1})
+
+    assert response.json() == {"product_id": 1}
+
+
+def test_disconnect_cancels_the_request():
+    async def run():
+        cancelled = asyncio.Event()
+
+        async def slow_app(scope, receive, send):
+            scope["state"]["cancel_token"].register("query", cancelled.set)
+            await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+        messages = [
+            {"type": "http.request", "body": b"", "more_body": False},
+            {"type": "http.disconnect"},
+        ]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+        await DisconnectCancelMiddleware(slow_app)(scope, receive, send)
+        return cancelled.is_set()
+
+    assert asyncio.run(run())
+
+
+def test_unregistered_callbacks_are_not_called():
+    token = CancelToken()
+    calls = []
+    token.register("db", lambda: calls.append("db"))
+    token.unregister("db")
+    token.cancel()
+
+    assert token.cancelled
+    assert calls == []
@@ -0,0 +1,17 @@
+import pytest
+from fastapi import HTTPException
+
+from app import models
+from app.routers import cart
+
+
+def test_item_of_a_deleted_product_is_not_found(monkeypatch):
+    monkeypatch.setattr(cart, "with_products", lambda items, db: [])
+
+    with pytest.raises(HTTPException) as exc:
+        cart.cart_item_out(7, models.Cart(user_id=1, product_id=7, quantity=1), None)
+    assert exc.value.status_code == 404
+
+    with pytest.raises(HTTPException) as exc:
+        cart.cart_item_out(7, None, None)
+    assert exc.value.status_code == 404
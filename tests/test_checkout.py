@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from starlette.testclient import TestClient
+
+from app import models, oauth2
+from app.database import get_db
+from app.routers import checkout
+
+
+def make_client(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/shop.db")
+    models.Cart.__table__.create(engine)
+    models.OrderItem.__table__.create(engine)
+    with engine.begin() as conn:
+        # orders defaults created_at with now(), which sqlite does not have
+        conn.exec_driver_sql(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, "
+            "created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.execute(
+            models.Cart.__table__.insert(),
+            [
+                {"user_id": 1, "product_id": 3, "quantity": 2},
+                {"user_id": 1, "product_id": 5, "quantity": 1},
+                {"user_id": 2, "product_id": 3, "quantity": 4},
+            ],
+        )
+    placed = []
+    monkeypatch.setattr(checkout.order_queue, "put", placed.append)
+    app = FastAPI()
+    app.include_router(checkout.router)
+    app.dependency_overrides[oauth2.get_current_user] = lambda: SimpleNamespace(
+        id=1, username="user1"
+    )
+
+    def session():
+        db = Session(engine)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = session
+    return TestClient(app), Session(engine), placed
+
+
+def test_checkout_places_the_order_and_empties_the_cart(tmp_path, monkeypatch):
+    client, db, placed = make_client(tmp_path, monkeypatch)
+
+    response = client.post("/checkout/")
+
+    assert response.status_code == 200
+    order_id = response.json()["order_id"]
+    assert db.query(models.Order.user_id).filter_by(id=order_id).scalar() == 1
+    items = db.query(models.OrderItem.product_id, models.OrderItem.quantity)
+    assert sorted(items.filter_by(order_id=order_id)) == [(3, 2), (5, 1)]
+    # only the cart of the user is emptied
+    assert db.query(models.Cart.user_id).all() == [(2,)]
+    assert [(event.order_id, event.items) for event in placed] == [
+        (order_id, [(3, 2), (5, 1)])
+    ]
+
+    # checking out again finds the cart empty instead of ordering twice
+    assert client.post("/checkout/").status_code == 404
+    assert db.query(models.Order).count() == 1
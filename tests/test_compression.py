@@ -0,0 +1,85 @@
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.compression import CompressionMiddleware, ResponseCache, negotiate_encoding
+from app.metrics import Metrics
+
+calls = []
+
+
+def listing(request):
+    calls.append(request.url.path)
+    response = JSONResponse([{"id": i, "name": f"product {i}"} for i in range(100)])
+    if "x-profile" in request.headers:
+        # as set by ProfilingMiddleware
+        response.headers["X-Profile-Id"] = "abc"
+    return response
+
+
+def small(request):
+    return PlainTextResponse("ok")
+
+
+def make_client(cache=None):
+    app = Starlette(routes=[Route("/products/", listing), Route("/small", small)])
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=100,
+        cache=cache,
+        cacheable=lambda scope: scope["path"] == "/products/",
+        metrics=Metrics(),
+    )
+    return TestClient(app)
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") == "identity"
+    assert negotiate_encoding("") == "identity"
+
+
+def test_gzip_above_threshold_only():
+    client = make_client()
+
+    response = client.get("/products/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert len(response.json()) == 100
+
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == "ok"
+
+
+def test_cached_response_reuses_compressed_variant():
+    cache = ResponseCache(ttl=60)
+    client = make_client(cache)
+    calls.clear()
+
+    first = client.get("/products/", headers={"Accept-Encoding": "gzip"})
+    second = client.get("/products/", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/products/", headers={"Accept-Encoding": "identity"})
+
+    assert calls == ["/products/"]
+    assert first.json() == second.json() == plain.json()
+    assert "content-encoding" not in plain.headers
+    assert list(cache.get("/products/?").variants) == ["gzip"]
+
+    cache.clear()
+    client.get("/products/")
+    assert len(calls) == 2
+
+
+def test_cache_does_not_replay_per_request_headers():
+    client = make_client(ResponseCache(ttl=60))
+    calls.clear()
+
+    profiled = client.get("/products/", headers={"X-Profile": "1"})
+    anonymous = client.get("/products/")
+
+    assert calls == ["/products/"]
+    assert profiled.headers["x-profile-id"] == "abc"
+    assert "x-profile-id" not in anonymous.headers
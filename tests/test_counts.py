@@ -0,0 +1,76 @@
+import threading
+
+from sqlalchemy.orm import Session
+
+from app import cache
+from app import counts as count_module
+from app.counts import CategoryCounts
+
+
+def test_loads_in_background_then_adjusts():
+    loaded = threading.Event()
+
+    def loader():
+        loaded.set()
+        return {"laptops": 3, "phones": 2}
+
+    counts = CategoryCounts(loader)
+    assert counts.snapshot() is None
+    assert loaded.wait(5)
+    counts.refresh()
+
+    assert counts.snapshot() == ({"laptops": 3, "phones": 2}, True)
+    counts.adjust("laptops", -1)
+    counts.adjust("tablets", 1)
+    assert counts.snapshot() == ({"laptops": 2, "phones": 2, "tablets": 1}, True)
+
+
+def test_invalidated_counts_are_served_as_estimates():
+    values = iter([{"laptops": 3}, {"laptops": 5}])
+    counts = CategoryCounts(lambda: next(values))
+    counts.refresh()
+    # keep the reload triggered by snapshot() from running
+    counts._loading = True
+
+    counts.invalidate()
+    assert counts.snapshot() == ({"laptops": 3}, False)
+    counts.refresh()
+    assert counts.snapshot() == ({"laptops": 5}, True)
+
+
+def test_notifications_adjust_the_counts(monkeypatch):
+    counts = CategoryCounts(lambda: {"laptops": 3, "phones": 2})
+    counts.refresh()
+    monkeypatch.setattr(cache, "category_counts", counts)
+    monkeypatch.setattr(cache, "invalidate_catalog", lambda: None)
+    monkeypatch.setattr(cache, "index_product", lambda product: None)
+
+    change = {"table": "products", "id": 1}
+    cache.on_product_change("STOCK", 1, dict(change, category="laptops"))
+    cache.adjust_category_counts("INSERT", dict(change, category="laptops"))
+    cache.adjust_category_counts(
+        "UPDATE", dict(change, category="phones", old_category="laptops")
+    )
+    cache.adjust_category_counts(
+        "UPDATE", dict(change, category="phones", old_category="phones")
+    )
+    cache.adjust_category_counts("DELETE", dict(change, category="phones"))
+    assert counts.snapshot() == ({"laptops": 3, "phones": 2}, True)
+
+    # a notification without categories falls back to a reload
+    counts._loading = True
+    cache.adjust_category_counts("UPDATE", change)
+    assert counts.snapshot() == ({"laptops": 3, "phones": 2}, False)
+
+
+def test_totals_are_recounted_without_the_listener(monkeypatch):
+    counts = CategoryCounts(lambda: {"laptops": 3})
+    counts.refresh()
+    monkeypatch.setattr(count_module, "category_counts", counts)
+    monkeypatch.setattr(count_module, "count_rows", lambda db, query, limit: (4, True))
+    db = Session()
+
+    # nothing adjusts the cached counts, they are not used
+    assert count_module.products_total(db) == (4, True)
+    counts.listening = True
+    assert count_module.products_total(db) == (3, True)
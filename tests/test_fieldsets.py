@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app import schemas
+from app.fieldsets import parse_fields, projected_schema, serialize
+
+
+def test_parse_fields_keeps_schema_order():
+    assert parse_fields("category, id,name", schemas.Product) == (
+        "id",
+        "name",
+        "category",
+    )
+    assert parse_fields(None, schemas.Product) is None
+    assert parse_fields("", schemas.Product) is None
+
+
+def test_parse_fields_rejects_unknown_names():
+    with pytest.raises(HTTPException) as exc:
+        parse_fields("id,inventory_count", schemas.Product)
+    assert exc.value.status_code == 400
+    assert "inventory_count" in exc.value.detail
+
+
+def test_projected_schema_is_cached():
+    fields = ("id", "name")
+    assert projected_schema(schemas.Product, fields) is projected_schema(
+        schemas.Product, fields
+    )
+
+
+def test_serialize_only_returns_requested_fields():
+    rows = [SimpleNamespace(id=1, name="iphone", category="electronics")]
+    fields = parse_fields("id,name,category", schemas.Product)
+
+    assert serialize(rows, schemas.Product, fields) == [
+        {"id": 1, "name": "iphone", "category": "electronics"}
+    ]
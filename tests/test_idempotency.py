@@ -0,0 +1,104 @@
+import asyncio
+
+from app.idempotency import IdempotencyMiddleware, IdempotencyStore
+
+
+def make_app(calls, status=201, release=None):
+    async def app(scope, receive, send):
+        calls.append((await receive())["body"])
+        if release is not None:
+            await release.wait()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b'{"n": %d}' % len(calls)})
+
+    return app
+
+
+async def call(app, body=b"{}", key=b"k1", path="/cart/"):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"idempotency-key", key), (b"authorization", b"Bearer t")],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    headers = dict(sent[0]["headers"])
+    return sent[0]["status"], headers, sent[1]["body"]
+
+
+def test_retry_is_answered_from_the_first_response():
+    async def run():
+        calls = []
+        app = IdempotencyMiddleware(make_app(calls), ["/cart"], IdempotencyStore())
+        first = await call(app)
+        retry = await call(app)
+        other = await call(app, key=b"k2")
+        mismatch = await call(app, body=b'{"quantity": 2}')
+        unscoped = await call(app, path="/products/")
+
+        assert first == (201, {b"content-type": b"application/json"}, b'{"n": 1}')
+        assert retry[0] == 201 and retry[2] == b'{"n": 1}'
+        assert retry[1][b"idempotent-replayed"] == b"true"
+        assert other[2] == b'{"n": 2}'
+        assert mismatch[0] == 422
+        assert unscoped[2] == b'{"n": 3}'
+        assert len(calls) == 3
+
+    asyncio.run(run())
+
+
+def test_concurrent_duplicates_wait_for_the_first_request():
+    async def run():
+        calls = []
+        release = asyncio.Event()
+        app = IdempotencyMiddleware(
+            make_app(calls, release=release), ["/cart"], IdempotencyStore(), wait=5
+        )
+        first = asyncio.ensure_future(call(app))
+        duplicate = asyncio.ensure_future(call(app))
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert (await first)[2] == (await duplicate)[2] == b'{"n": 1}'
+        assert len(calls) == 1
+
+        stuck = IdempotencyMiddleware(
+            make_app([], release=asyncio.Event()),
+            ["/cart"],
+            IdempotencyStore(),
+            wait=0.01,
+        )
+        running = asyncio.ensure_future(call(stuck, key=b"stuck"))
+        await asyncio.sleep(0)
+        assert (await call(stuck, key=b"stuck"))[0] == 409
+        running.cancel()
+
+    asyncio.run(run())
+
+
+def test_server_errors_are_not_stored():
+    async def run():
+        calls = []
+        app = IdempotencyMiddleware(
+            make_app(calls, status=503), ["/checkout"], IdempotencyStore()
+        )
+        await call(app, path="/checkout/")
+        await call(app, path="/checkout/")
+        assert len(calls) == 2
+
+    asyncio.run(run())
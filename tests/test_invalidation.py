@@ -0,0 +1,34 @@
+from app.invalidation import InvalidationListener
+
+
+def test_dispatch_routes_changes_by_table():
+    listener = InvalidationListener("postgresql://unused")
+    products, users = [], []
+    listener.on_change("products", lambda op, id, change: products.append((op, id)))
+    listener.on_change("users", lambda op, id, change: users.append(change))
+
+    listener.dispatch('{"table": "products", "op": "UPDATE", "id": 3}')
+    listener.dispatch('{"table": "users", "op": "DELETE", "id": 7}')
+    listener.dispatch('{"table": "orders", "op": "INSERT", "id": 1}')
+    listener.dispatch("not json")
+
+    assert products == [("UPDATE", 3)]
+    assert users == [{"table": "users", "op": "DELETE", "id": 7}]
+
+
+def test_failing_handler_does_not_stop_others():
+    listener = InvalidationListener("postgresql://unused")
+    seen, flushed = [], []
+
+    def broken(op, id, change):
+        raise RuntimeError("boom")
+
+    listener.on_change("products", broken)
+    listener.on_change("products", lambda op, id, change: seen.append(id))
+    listener.on_flush(lambda: flushed.append(True))
+
+    listener.dispatch('{"table": "products", "op": "INSERT", "id": 1}')
+    listener.flush_all()
+
+    assert seen == [1]
+    assert flushed == [True]
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, select
+
+from app import models
+from app.maintenance import purge_database
+
+
+def test_only_carts_idle_as_a_whole_are_purged(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/cart.db")
+    cart = models.Cart.__table__
+    cart.create(engine)
+    now = datetime.now(timezone.utc)
+    old, recent = now - timedelta(days=40), now - timedelta(days=1)
+    with engine.begin() as conn:
+        conn.execute(
+            cart.insert(),
+            [
+                # user 1 abandoned the cart, user 2 touched one line recently
+                {"user_id": 1, "product_id": p, "quantity": 1, "updated_at": old}
+                for p in range(5)
+            ]
+            + [
+                {"user_id": 2, "product_id": 1, "quantity": 1, "updated_at": old},
+                {"user_id": 2, "product_id": 2, "quantity": 1, "updated_at": recent},
+            ],
+        )
+
+    purged = purge_database(engine, now - timedelta(days=30), batch_size=2, pause=0)
+
+    assert purged == 5
+    with engine.connect() as conn:
+        assert conn.execute(select(cart.c.user_id)).scalars().all() == [2, 2]
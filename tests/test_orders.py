@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from app import orders
+
+
+def test_stats_of_deleted_products_are_skipped(monkeypatch):
+    statements = []
+
+    class Session:
+        def execute(self, stmt):
+            statements.append(stmt)
+
+        def commit(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(orders, "SessionLocal", Session)
+    orders.update_product_stats(
+        [orders.OrderPlaced(1, 1, [(3, 2), (1, 1)], datetime.now())]
+    )
+
+    sql = str(statements[0].compile(dialect=postgresql.psycopg2.dialect()))
+    assert "JOIN products ON products.id = anon_1.product_id" in sql
+    assert "FOR KEY SHARE OF products ON CONFLICT (product_id)" in sql
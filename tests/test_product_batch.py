@@ -0,0 +1,92 @@
+from datetime import datetime
+
+from fastapi import FastAPI
+from sqlalchemy.orm import Session
+from starlette.testclient import TestClient
+
+from app import models
+from app.database import get_db
+from app.routers import product
+
+
+def make_product(id):
+    return models.Product(
+        id=id,
+        name=f"product {id}",
+        manufacturer="acme",
+        supplier="acme",
+        category="tools",
+        sub_category="hammers",
+        country_of_origin="DE",
+        created_at=datetime(2024, 1, 1),
+        updated_at=datetime(2024, 1, 1),
+    )
+
+
+class FakeQuery:
+    def __init__(self, session):
+        self.session = session
+
+    def filter(self, clause):
+        # Product.id == any_(:ids)
+        self.ids = clause.right.element.value
+        return self
+
+    def all(self):
+        self.session.queries.append(self.ids)
+        # the database returns rows in its own order
+        return [make_product(i) for i in sorted(self.ids) if i in self.session.rows]
+
+
+class FakeSession(Session):
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+        self.queries = []
+
+    def query(self, *entities):
+        return FakeQuery(self)
+
+
+def make_client(rows):
+    app = FastAPI()
+    app.include_router(product.router)
+    db = FakeSession(rows)
+    app.dependency_overrides[get_db] = lambda: db
+    return TestClient(app), db
+
+
+def test_products_keep_request_order_without_duplicates():
+    client, db = make_client({1, 2, 3})
+
+    response = client.get("/products/batch?ids=3&ids=1&ids=3&ids=2")
+
+    assert response.status_code == 200
+    assert [p["id"] for p in response.json()["products"]] == [3, 1, 2]
+    assert response.json()["missing"] == []
+    assert db.queries == [[3, 1, 2]]
+
+
+def test_missing_ids_are_reported_in_request_order():
+    client, db = make_client({2})
+
+    response = client.post("/products/batch", json={"ids": [9, 2, 7]})
+
+    assert [p["id"] for p in response.json()["products"]] == [2]
+    assert response.json()["missing"] == [9, 7]
+
+
+def test_empty_ids_do_not_query():
+    client, db = make_client({1})
+
+    assert client.get("/products/batch").json() == {"products": [], "missing": []}
+    assert client.post("/products/batch", json={"ids": []}).status_code == 200
+    assert db.queries == []
+
+
+def test_too_many_ids_are_rejected(monkeypatch):
+    monkeypatch.setattr(product.settings, "product_batch_max_ids", 2)
+    client, db = make_client({1, 2, 3})
+
+    assert client.post("/products/batch", json={"ids": [1, 2, 3]}).status_code == 400
+    assert db.queries == []
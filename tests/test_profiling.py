@@ -0,0 +1,82 @@
+import threading
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from app import oauth2
+from app.database import get_db
+from app.profiling import (
+    ProfileStore,
+    ProfilingMiddleware,
+    RateLimit,
+    SamplingProfiler,
+    collapsed,
+)
+from app.routers import debug
+
+
+def busy_waiting(stop):
+    while not stop.wait(0.001):
+        pass
+
+
+def test_sampling_profiler_collapses_stacks_of_other_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_waiting, args=(stop,), name="worker")
+    worker.start()
+    try:
+        stacks = SamplingProfiler().run(seconds=0.1, interval=0.002)
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = collapsed(stacks).splitlines()
+    worker_lines = [line for line in lines if line.startswith("worker;")]
+    assert worker_lines
+    assert all("busy_waiting (test_profiling.py:" in line for line in worker_lines)
+    assert not any("run (profiling.py" in line for line in lines)
+
+
+def test_rate_limit_allows_bursts_up_to_the_rate():
+    rate = RateLimit(per_minute=2)
+
+    assert [rate.allow() for _ in range(3)] == [True, True, False]
+
+
+def test_only_admin_requests_are_profiled():
+    store = ProfileStore()
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, per_minute=1, store=store)
+    app.get("/ping")(lambda: "pong")
+    client = TestClient(app)
+    user = oauth2.create_access_token({"user_id": 2, "user_name": "user"})
+    admin = oauth2.create_access_token({"user_id": 1, "user_name": "invadmin"})
+
+    for headers in (
+        {"X-Profile": "1"},
+        {"X-Profile": "1", "Authorization": f"Bearer {user}"},
+        {"X-Profile": "1", "Authorization": "Bearer forged"},
+    ):
+        assert "x-profile-id" not in client.get("/ping", headers=headers).headers
+    # the budget of one profile per minute is still there for the admin
+    headers = {"X-Profile": "1", "Authorization": f"Bearer {admin}"}
+    assert "x-profile-id" in client.get("/ping", headers=headers).headers
+    assert len(store.list()) == 1
+
+
+def test_worker_profile_runs_without_a_db_session(monkeypatch):
+    admin = SimpleNamespace(id=1, username="invadmin")
+    monkeypatch.setattr(oauth2, "get_detached_user", lambda token: admin)
+    app = FastAPI()
+    app.include_router(debug.router)
+
+    def no_session():
+        raise AssertionError("sampling must not hold a db session")
+
+    app.dependency_overrides[get_db] = no_session
+    response = TestClient(app).get(
+        "/debug/profile?seconds=0.05", headers={"Authorization": "Bearer t"}
+    )
+
+    assert response.status_code == 200
@@ -0,0 +1,103 @@
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from starlette.testclient import TestClient
+
+from app import cache, models, recommendations
+from app.invalidation import InvalidationListener
+from app.orders import OrderPlaced
+from app.recommendations import CoOccurrenceIndex
+from app.routers import product
+
+
+def test_load_keeps_top_k_by_count():
+    index = CoOccurrenceIndex(top_k=2)
+    index.load([(1, 2, 5), (1, 3, 9), (1, 4, 1), (2, 1, 5)])
+
+    assert index.related(1) == ((3, 9), (2, 5))
+    assert index.related(1, limit=1) == ((3, 9),)
+    assert index.related(42) == ()
+
+
+def test_add_basket_updates_both_directions():
+    index = CoOccurrenceIndex(top_k=3)
+    index.add_basket(1, [1, 2, 3])
+    index.add_basket(2, [1, 3])
+    index.add_basket(3, [4])
+
+    assert index.related(1) == ((3, 2), (2, 1))
+    assert index.related(3) == ((1, 2), (2, 1))
+    assert index.related(4) == ()
+
+
+def test_rows_are_bounded_to_keep():
+    index = CoOccurrenceIndex(top_k=1, keep=2)
+    for order_id, other in enumerate([2, 2, 3, 4], start=1):
+        index.add_basket(order_id, [1, other])
+
+    assert len(index._counts[1]) == 2
+    assert index.related(1) == ((2, 2),)
+    assert index.related(1, limit=0) == ()
+
+
+def test_rebuild_is_fenced_against_concurrent_baskets(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/orders.db")
+    models.OrderItem.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            models.OrderItem.__table__.insert(),
+            [
+                {"order_id": 1, "product_id": 1, "quantity": 1},
+                {"order_id": 1, "product_id": 2, "quantity": 1},
+            ],
+        )
+    index = CoOccurrenceIndex(top_k=5)
+    monkeypatch.setattr(recommendations, "related_index", index)
+    load = index.load
+
+    def load_after_checkout(pairs, fence):
+        # checkouts flushed while the rebuild query runs
+        index.add_basket(1, [1, 2])
+        index.add_basket(2, [1, 2])
+        load(pairs, fence)
+
+    monkeypatch.setattr(index, "load", load_after_checkout)
+    recommendations.rebuild_related_index(Session(engine))
+
+    # order 1 is counted once by the rebuild, order 2 is replayed onto it
+    assert index.related(1) == ((2, 2),)
+    # a late event of an order inside the fence is not counted twice
+    index.add_basket(1, [1, 2])
+    assert index.related(1) == ((2, 2),)
+
+
+def test_related_limit_is_validated():
+    app = FastAPI()
+    app.include_router(product.router)
+    client = TestClient(app)
+
+    assert client.get("/products/1/related?limit=-3").status_code == 422
+    assert client.get("/products/1/related?limit=1000").status_code == 422
+    assert client.get("/products/1/related?limit=2").status_code == 200
+
+
+def test_orders_of_every_worker_come_from_notifications(monkeypatch):
+    index = CoOccurrenceIndex(top_k=5)
+    monkeypatch.setattr(cache, "related_index", index)
+    monkeypatch.setattr(recommendations, "related_index", index)
+    monkeypatch.setattr(cache, "order_items", lambda order_id: [(1, 1), (3, 2)])
+    listener = InvalidationListener("postgresql://unused")
+    listener.on_change("orders", cache.on_order_placed)
+
+    listener.dispatch('{"table": "orders", "op": "INSERT", "id": 1, "items": []}')
+    listener.dispatch(
+        '{"table": "orders", "op": "INSERT", "id": 2, "items": [[1, 1], [2, 4]]}'
+    )
+    # basket too big for the payload
+    listener.dispatch('{"table": "orders", "op": "INSERT", "id": 3}')
+    assert index.related(1) == ((2, 1), (3, 1))
+
+    # the local write-behind event of a notified order is not counted again
+    index.listening = True
+    recommendations.update_related_index([OrderPlaced(4, 1, [(1, 1), (2, 1)], None)])
+    assert index.related(1) == ((2, 1), (3, 1))
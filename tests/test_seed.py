@@ -0,0 +1,107 @@
+from collections import Counter
+from datetime import datetime, timezone
+
+import psycopg2
+
+from app import seed
+from app.seed import (
+    SeedConfig,
+    cart_rows,
+    check_target,
+    copy_text,
+    make_catalog,
+    parse_as_of,
+    product_rows,
+)
+
+CONFIG = SeedConfig(
+    seed=7,
+    products=2000,
+    users=500,
+    categories=20,
+    skew=1.1,
+    cart_share=0.3,
+    mean_cart_size=3.0,
+    first_product_id=1,
+    first_user_id=1,
+    as_of=datetime(2024, 1, 1, tzinfo=timezone.utc),
+)
+
+
+def test_chunks_are_deterministic_and_skewed():
+    catalog = make_catalog(CONFIG)
+    first = list(product_rows(CONFIG, catalog, 0, 1, 2000))
+
+    assert first == list(product_rows(CONFIG, make_catalog(CONFIG), 0, 1, 2000))
+    assert [row[0] for row in first] == list(range(1, 2001))
+    counts = Counter(row[4] for row in first).most_common()
+    # zipf: the top category is far more frequent than the median one
+    assert counts[0][1] > 5 * counts[len(counts) // 2][1]
+
+
+def test_carts_have_distinct_products_within_range():
+    rows = list(cart_rows(CONFIG, 0, 1, 500))
+    users = {row[1] for row in rows}
+
+    assert 100 < len(users) < 200
+    assert len({(row[1], row[2]) for row in rows}) == len(rows)
+    assert all(1 <= row[2] <= 2000 and row[5] >= row[4] for row in rows)
+    # line ids do not depend on the order chunks are loaded in
+    assert len({row[0] for row in rows}) == len(rows)
+    assert rows == list(cart_rows(CONFIG, 0, 1, 500))
+
+
+def test_copy_text_escapes_separators():
+    assert copy_text([(1, "a\tb\\c")]).read() == "1\ta\\tb\\\\c\n"
+
+
+def test_as_of_defaults_to_utc():
+    assert parse_as_of("2024-03-01") == datetime(2024, 3, 1, tzinfo=timezone.utc)
+    assert parse_as_of("2024-03-01T00:00:00+02:00").utcoffset().total_seconds() == 7200
+
+
+class FakeConnection:
+    def __init__(self, rows, superuser):
+        self.rows = rows
+        self.superuser = superuser
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        if "session_replication_role" in sql and not self.superuser:
+            raise psycopg2.Error("permission denied")
+        self.result = any(f"FROM {table})" in sql for table in self.rows)
+
+    def fetchone(self):
+        return (self.result,)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_loading_needs_empty_tables_and_disabled_triggers(monkeypatch):
+    url = seed.SQLALCHEMY_DATABASE_URL
+    monkeypatch.setattr(
+        seed.psycopg2, "connect", lambda dsn: FakeConnection({"users"}, False)
+    )
+
+    problems = check_target([url], allow_triggers=False)
+
+    assert len(problems) == 2
+    assert problems[0].startswith("users on ")
+    assert "--allow-triggers" in problems[1]
+    assert len(check_target([url], allow_triggers=True)) == 1
+    assert check_target([url], allow_triggers=True, truncate=True) == []
@@ -0,0 +1,71 @@
+from app import models
+from app.sharding import (
+    CartSessions,
+    ShardRouter,
+    format_shard_map,
+    move_bucket,
+    parse_shard_map,
+    rebalance,
+    shard_row_counts,
+)
+
+
+def make_router(tmp_path, shards=2, buckets=4, shard_map=""):
+    urls = [f"sqlite:///{tmp_path}/cart-{shard}.db" for shard in range(shards)]
+    router = ShardRouter(urls, buckets=buckets, shard_map=shard_map)
+    for engine in router.engines:
+        models.Cart.__table__.create(engine)
+    return router
+
+
+def add_cart_rows(router, user_ids):
+    for user_id in user_ids:
+        db = router.session(router.shard_of(user_id))
+        db.add(models.Cart(user_id=user_id, product_id=1, quantity=1))
+        db.commit()
+        db.close()
+
+
+def test_shard_map_round_trip():
+    assert parse_shard_map("", 2, 4) == [0, 0, 1, 1]
+    assert parse_shard_map("1:1,3:0", 2, 4) == [0, 1, 1, 0]
+    assert format_shard_map([0, 1, 1, 0]) == "0-0:0,1-2:1,3-3:0"
+
+
+def test_users_are_routed_by_bucket(tmp_path):
+    router = make_router(tmp_path)
+    add_cart_rows(router, [1, 2, 5, 6, 7])
+
+    # buckets 0, 1 -> shard 0 and 2, 3 -> shard 1
+    assert shard_row_counts(router) == [2, 3]
+
+
+def test_unsharded_uses_main_session():
+    main_db = object()
+    carts = CartSessions(ShardRouter([]), main_db)
+    assert carts.for_user(42) is main_db
+
+
+def test_shard_sessions_are_watched_once(tmp_path):
+    opened = []
+    carts = CartSessions(make_router(tmp_path), object(), opened.append)
+
+    db = carts.for_user(2)
+    assert carts.for_user(6) is db and opened == [db]
+    carts.close()
+
+
+def test_move_bucket_and_rebalance(tmp_path):
+    router = make_router(tmp_path, shard_map="0-3:0")
+    add_cart_rows(router, [1, 2, 5, 6, 7])
+    assert shard_row_counts(router) == [5, 0]
+
+    assert move_bucket(router, 1, 1) == 2
+    assert shard_row_counts(router) == [3, 2]
+    db = router.session(1)
+    assert sorted(c.user_id for c in db.query(models.Cart)) == [1, 5]
+    db.close()
+
+    assert rebalance(router) == {1: 2, 2: 2, 3: 1}
+    assert router.shard_of_bucket == [0, 0, 1, 1]
+    assert shard_row_counts(router) == [2, 3]
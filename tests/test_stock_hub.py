@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+from app import stock_hub as stock_hub_module
+from app.stock_hub import StockHub
+
+
+def test_updates_are_coalesced_per_subscriber():
+    async def run():
+        hub = StockHub(min_interval=0)
+        subscription = hub.subscribe([1, 2])
+        assert subscription.snapshot({1: 5, 2: 3}) == [
+            {"product_id": 1, "inventory_count": 5, "delta": None},
+            {"product_id": 2, "inventory_count": 3, "delta": None},
+        ]
+
+        # published from worker threads, e.g. inventory endpoints
+        def writes():
+            for count in (4, 3, 2):
+                hub.publish(1, count)
+            hub.publish(2, 3)
+            hub.publish(7, 1)
+
+        thread = threading.Thread(target=writes)
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0)
+
+        assert await subscription.next(timeout=1) == [
+            {"product_id": 1, "inventory_count": 2, "delta": -3}
+        ]
+        assert await subscription.next(timeout=0.01) == []
+
+        hub.unsubscribe(subscription)
+        assert not hub.watched(1) and hub.subscribers == 0
+
+    asyncio.run(run())
+
+
+def test_deleted_product_is_sent_without_count():
+    async def run():
+        hub = StockHub(min_interval=0)
+        subscription = hub.subscribe([1])
+        subscription.snapshot({1: 5})
+        hub.publish(1, None)
+        await asyncio.sleep(0)
+
+        assert await subscription.next(timeout=1) == [
+            {"product_id": 1, "inventory_count": None, "delta": None}
+        ]
+
+    asyncio.run(run())
+
+
+def test_notified_count_is_published_without_a_query(monkeypatch):
+    published = []
+    monkeypatch.setattr(stock_hub_module.stock_hub, "watched", lambda id: True)
+    monkeypatch.setattr(
+        stock_hub_module.stock_hub,
+        "publish",
+        lambda id, count: published.append((id, count)),
+    )
+
+    def no_query(ids):
+        raise AssertionError("the trigger sent the count")
+
+    monkeypatch.setattr(stock_hub_module, "current_stock", no_query)
+    stock_hub_module.on_stock_change(
+        "STOCK", 3, {"table": "products", "id": 3, "inventory_count": 7}
+    )
+    assert published == [(3, 7)]
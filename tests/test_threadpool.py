@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import anyio
+import pytest
+from fastapi import APIRouter, Depends, FastAPI
+from sqlalchemy import orm
+from starlette.testclient import TestClient
+
+from app import database, oauth2, threadpool
+from app.metrics import metrics
+from app.profiling import ProfiledRoute
+from app.schemas import TokenData
+from app.threadpool import LimiterTimeout, get_limiter, holding, run_on
+
+
+def wait_count(name):
+    summary = metrics.snapshot()["summaries"].get(f"threadpool_wait_seconds.{name}")
+    return (summary or {}).get("count", 0)
+
+
+def test_request_sessions_are_opened_under_a_db_token(monkeypatch):
+    events = []
+
+    class Session:
+        def __init__(self):
+            events.append(("open", get_limiter("db").borrowed_tokens))
+
+        def close(self):
+            events.append(("close", get_limiter("db").borrowed_tokens))
+
+    monkeypatch.setattr(database, "SessionLocal", Session)
+    router = APIRouter(prefix="/items", route_class=ProfiledRoute)
+
+    @router.get("/{item_id}")
+    def get_item(item_id: int, db=Depends(database.get_db)):
+        return {"item_id": item_id, "thread": threading.current_thread().name}
+
+    app = FastAPI()
+    app.include_router(router)
+    before = wait_count("db")
+
+    body = TestClient(app).get("/items/3").json()
+
+    assert body["item_id"] == 3
+    assert body["thread"] != threading.current_thread().name
+    assert events == [("open", 1), ("close", 1)]
+    assert get_limiter("db").borrowed_tokens == 0
+    assert wait_count("db") == before + 1
+
+
+def test_run_on_uses_a_thread_of_the_named_limiter():
+    app = FastAPI()
+
+    @app.get("/hash")
+    async def hash_password():
+        return {"thread": await run_on("cpu", lambda: threading.current_thread().name)}
+
+    before = wait_count("cpu")
+
+    body = TestClient(app).get("/hash").json()
+
+    assert body["thread"] != threading.current_thread().name
+    assert wait_count("cpu") == before + 1
+
+
+def test_waits_for_a_db_token_time_out():
+    async def run():
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setitem(threadpool._limiters, "db", anyio.CapacityLimiter(1))
+            async with holding("db"):
+                with pytest.raises(LimiterTimeout):
+                    async with holding("db", 0.01):
+                        pass
+
+    asyncio.run(run())
+
+
+def test_user_is_resolved_before_the_request_session(monkeypatch):
+    events = []
+
+    class Session(orm.Session):
+        def __init__(self):
+            super().__init__()
+            events.append(("open", get_limiter("db").borrowed_tokens))
+
+    def load_user(user_id):
+        # on a db token of its own, released before get_db takes one
+        events.append(("user", get_limiter("db").borrowed_tokens))
+        return SimpleNamespace(id=user_id, username="u")
+
+    monkeypatch.setattr(database, "SessionLocal", Session)
+    monkeypatch.setattr(oauth2, "load_user", load_user)
+    monkeypatch.setattr(
+        oauth2, "verify_access_token", lambda token, exc: TokenData(id=token)
+    )
+    router = APIRouter(
+        route_class=ProfiledRoute,
+        dependencies=[
+            Depends(oauth2.get_current_user),
+            Depends(database.statement_timeout("hot")),
+        ],
+    )
+
+    @router.get("/me")
+    def me(db=Depends(database.get_db), user=Depends(oauth2.get_current_user)):
+        return {"id": user.id}
+
+    app = FastAPI()
+    app.include_router(router)
+
+    response = TestClient(app).get("/me", headers={"Authorization": "Bearer 7"})
+
+    assert response.json() == {"id": "7"}
+    assert events == [("user", 1), ("open", 1)]
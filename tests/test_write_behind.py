@@ -0,0 +1,50 @@
+from app.metrics import metrics
+from app.write_behind import WriteBehindQueue
+
+
+def test_batches_events():
+    batches = []
+    q = WriteBehindQueue([batches.append], batch_size=3, flush_interval=0.05)
+    for i in range(7):
+        assert q.put(i)
+    q.flush()
+
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert q.stats["processed"] == 7
+
+
+def test_drops_when_full():
+    q = WriteBehindQueue([lambda batch: None], maxsize=2, name="test-full")
+    assert q.put(1)
+    assert q.put(2)
+    assert not q.put(3)
+    assert q.stats["dropped"] == 1
+    assert metrics.snapshot()["counters"]["write_behind_dropped.test-full"] == 1
+
+
+def test_retries_failed_handler():
+    calls = []
+
+    def flaky(batch):
+        calls.append(batch)
+        if len(calls) < 3:
+            raise RuntimeError("db unavailable")
+
+    q = WriteBehindQueue([flaky], max_retries=3, retry_backoff=0)
+    q.put("order")
+    q.flush()
+
+    assert len(calls) == 3
+    assert q.stats["failed"] == 0
+
+
+def test_stop_flushes_pending_events():
+    seen = []
+    q = WriteBehindQueue([seen.extend], flush_interval=0.05)
+    q.start()
+    for i in range(5):
+        q.put(i)
+    q.stop()
+
+    assert sorted(seen) == [0, 1, 2, 3, 4]
+    assert not q.put(6)